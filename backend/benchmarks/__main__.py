@@ -0,0 +1,61 @@
+# Run from backend/:
+#
+#   python -m benchmarks run --size small --output results.json
+#   python -m benchmarks run --select 'crud.search_*' --elements 1000000
+#   python -m benchmarks compare before.json after.json --threshold 0.1
+#   python -m benchmarks list
+#
+# compare exits with status 1 when any scenario got slower than the threshold.
+import argparse
+import json
+import sys
+from typing import Optional
+
+from .runner import DEFAULT_ROUNDS, compare, run
+from .scenarios import SCENARIOS
+from .synthetic import SIZES
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run scenarios and write a JSON results file")
+    run_parser.add_argument("--size", choices=list(SIZES), default="tiny")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--select", action="append", help="fnmatch pattern over group.name, may be repeated")
+    run_parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    run_parser.add_argument("--regenerate", action="store_true", help="Rebuild the cached corpus")
+    run_parser.add_argument("--output", default="benchmark-results.json")
+    for name in ("series", "segments", "elements", "codes"):
+        run_parser.add_argument(f"--{name}", type=int, help=f"Override the number of {name} of the size preset")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two results files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Allowed slowdown of the median, 0.1 is 10%%")
+
+    subparsers.add_parser("list", help="List scenarios")
+
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        for scenario in SCENARIOS:
+            print(scenario.fullname)
+        return 0
+
+    if args.command == "compare":
+        with open(args.old) as old, open(args.new) as new:
+            rows, regressed = compare(json.load(old), json.load(new), args.threshold)
+        for row in rows:
+            flag = "  SLOWER" if row["regressed"] else ""
+            print(f"{row['fullname']:45} {row['old'] * 1000:9.2f} ms -> {row['new'] * 1000:9.2f} ms  {row['ratio']:5.2f}x{flag}")
+        return 1 if regressed else 0
+
+    overrides = {name: getattr(args, name) for name in ("series", "segments", "elements", "codes") if getattr(args, name)}
+    results = run(args.size, args.seed, args.select, args.rounds, args.regenerate, **overrides)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Wrote {len(results['benchmarks'])} results to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
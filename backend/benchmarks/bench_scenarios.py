@@ -0,0 +1,39 @@
+# The scenarios as pytest-benchmark tests, for those who prefer its tooling:
+#
+#   pytest benchmarks/bench_scenarios.py --benchmark-json results.json
+#
+# KANOT_BENCH_SIZE and KANOT_BENCH_SEED pick the corpus. The file name keeps
+# the regular test run from collecting it.
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from kanot.db.crud import DatabaseManager
+from kanot.db.engine import create_database_engine
+
+from .runner import corpus
+from .scenarios import SCENARIOS, BenchmarkContext
+
+pytest.importorskip("pytest_benchmark")
+
+@pytest.fixture(scope="session")
+def ctx(tmp_path_factory: pytest.TempPathFactory) -> BenchmarkContext:
+    size = os.environ.get("KANOT_BENCH_SIZE", "tiny")
+    seed = int(os.environ.get("KANOT_BENCH_SEED", 0))
+    source, counts = corpus(size, seed)
+    path = Path(tmp_path_factory.mktemp("bench")) / "kanot.db"
+    shutil.copyfile(source, path)
+    url = f"sqlite:///{path}"
+    return BenchmarkContext(DatabaseManager(create_database_engine(url)), url, counts, seed)
+
+@pytest.mark.parametrize("scenario", SCENARIOS, ids=[s.fullname for s in SCENARIOS])
+def test_scenario(benchmark, ctx: BenchmarkContext, scenario) -> None:
+    benchmark.group = scenario.group
+
+    def setup():
+        prepared = scenario.setup(ctx) if scenario.setup else ()
+        return ((ctx, *(prepared if isinstance(prepared, tuple) else (prepared,))), {})
+
+    benchmark.pedantic(scenario.run, setup=setup, rounds=scenario.rounds or 10, warmup_rounds=1)
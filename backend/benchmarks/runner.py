@@ -0,0 +1,148 @@
+# Run scenarios against a synthetic corpus and write the timings as JSON,
+# laid out like pytest-benchmark's --benchmark-json output so the same tools
+# can read both. Corpora are generated once per size and seed and cached;
+# every run works on a fresh copy, since some scenarios write.
+import datetime
+import fnmatch
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from kanot.db.crud import DatabaseManager
+from kanot.db.engine import create_database_engine
+
+from .scenarios import SCENARIOS, BenchmarkContext, Scenario
+from .synthetic import SIZES, generate
+
+logger = logging.getLogger("kanot")
+
+DATA_DIR = Path(__file__).parent / ".data"
+DEFAULT_ROUNDS = 10
+
+def corpus(size: str, seed: int = 0, regenerate: bool = False, **overrides: int) -> tuple[Path, dict[str, int]]:
+    # Path of the cached corpus database and its row counts
+    DATA_DIR.mkdir(exist_ok=True)
+    suffix = "".join(f"-{name}{value}" for name, value in sorted(overrides.items()))
+    path = DATA_DIR / f"{size}-{seed}{suffix}.db"
+    counts_path = path.with_suffix(".json")
+    if regenerate or not path.exists() or not counts_path.exists():
+        path.unlink(missing_ok=True)
+        logger.info(f"Generating {size} corpus in {path}")
+        engine = create_database_engine(f"sqlite:///{path}")
+        counts = generate(engine, size, seed, **overrides)
+        engine.dispose()
+        counts_path.write_text(json.dumps(counts))
+    return path, json.loads(counts_path.read_text())
+
+def stats(timings: list[float]) -> dict[str, Any]:
+    ordered = sorted(timings)
+    quartiles = statistics.quantiles(ordered, n=4) if len(ordered) > 1 else [ordered[0]] * 3
+    mean = statistics.fmean(ordered)
+    return {
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": mean,
+        "stddev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        "median": statistics.median(ordered),
+        "iqr": quartiles[2] - quartiles[0],
+        "q1": quartiles[0],
+        "q3": quartiles[2],
+        "rounds": len(ordered),
+        "ops": 1 / mean if mean else 0.0,
+        "data": timings,
+    }
+
+def run_scenario(ctx: BenchmarkContext, scenario: Scenario, rounds: int = DEFAULT_ROUNDS, warmup: int = 1) -> list[float]:
+    timings = []
+    for i in range(warmup + (scenario.rounds or rounds)):
+        prepared = scenario.setup(ctx) if scenario.setup else ()
+        args = prepared if isinstance(prepared, tuple) else (prepared,)
+        start = time.perf_counter()
+        scenario.run(ctx, *args)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            timings.append(elapsed)
+    return timings
+
+def commit_info() -> dict[str, Any]:
+    def git(*args: str) -> str:
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, cwd=Path(__file__).parent, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+    return {"id": git("rev-parse", "HEAD"), "branch": git("rev-parse", "--abbrev-ref", "HEAD"), "dirty": bool(git("status", "--porcelain"))}
+
+def machine_info() -> dict[str, Any]:
+    return {
+        "node": platform.node(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "python_version": platform.python_version(),
+        "sqlite_version": sqlite3.sqlite_version,
+        "cpu_count": os.cpu_count(),
+    }
+
+def run(size: str = "tiny", seed: int = 0, select: Optional[list[str]] = None, rounds: int = DEFAULT_ROUNDS, regenerate: bool = False, **overrides: int) -> dict[str, Any]:
+    # select holds fnmatch patterns over "group.name", e.g. ["crud.search_*"]
+    if size not in SIZES:
+        raise ValueError(f"Unknown size {size!r}, expected one of {', '.join(SIZES)}")
+    source, counts = corpus(size, seed, regenerate, **overrides)
+    scenarios = [s for s in SCENARIOS if not select or any(fnmatch.fnmatch(s.fullname, pattern) for pattern in select)]
+
+    workdir = tempfile.mkdtemp(prefix="kanot-bench-")
+    path = Path(workdir) / "kanot.db"
+    shutil.copyfile(source, path)
+    url = f"sqlite:///{path}"
+    db_manager = DatabaseManager(create_database_engine(url))
+    ctx = BenchmarkContext(db_manager, url, counts, seed)
+
+    benchmarks = []
+    try:
+        for scenario in scenarios:
+            timings = run_scenario(ctx, scenario, rounds)
+            result = stats(timings)
+            benchmarks.append({"group": scenario.group, "name": scenario.name, "fullname": scenario.fullname, "stats": result})
+            logger.info(f"{scenario.fullname:45} median {result['median'] * 1000:9.2f} ms  min {result['min'] * 1000:9.2f} ms")
+    finally:
+        db_manager.engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+        shutil.rmtree(ctx.tmp, ignore_errors=True)
+
+    return {
+        "machine_info": machine_info(),
+        "commit_info": commit_info(),
+        "datetime": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "corpus": {"size": size, "seed": seed, **counts},
+        "benchmarks": benchmarks,
+    }
+
+def compare(old: dict[str, Any], new: dict[str, Any], threshold: float = 0.1) -> tuple[list[dict[str, Any]], bool]:
+    # Median ratio per scenario present in both results. A scenario regressed
+    # when new / old exceeds 1 + threshold.
+    old_by_name = {b["fullname"]: b["stats"] for b in old["benchmarks"]}
+    rows = []
+    regressed = False
+    for benchmark in new["benchmarks"]:
+        before = old_by_name.get(benchmark["fullname"])
+        if before is None:
+            continue
+        ratio = benchmark["stats"]["median"] / before["median"] if before["median"] else float("inf")
+        slower = ratio > 1 + threshold
+        regressed = regressed or slower
+        rows.append({
+            "fullname": benchmark["fullname"],
+            "old": before["median"],
+            "new": benchmark["stats"]["median"],
+            "ratio": ratio,
+            "regressed": slower,
+        })
+    return rows, regressed
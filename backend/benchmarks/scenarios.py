@@ -0,0 +1,180 @@
+# Benchmark scenarios. Each one is a function of the BenchmarkContext,
+# registered with @scenario; "crud" scenarios call DatabaseManager directly
+# and "api" scenarios go through the FastAPI app with TestClient. A setup
+# function runs untimed before every round and its result is passed on.
+import os
+import tempfile
+from typing import Any, Callable, Optional
+
+from kanot.db.crud import DatabaseManager
+from kanot.exporter import export_project
+
+from .synthetic import common_words, sample
+
+class Scenario:
+    def __init__(self, group: str, name: str, run: Callable[..., Any], setup: Optional[Callable[["BenchmarkContext"], Any]] = None, rounds: Optional[int] = None):
+        self.group = group
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.rounds = rounds
+
+    @property
+    def fullname(self) -> str:
+        return f"{self.group}.{self.name}"
+
+SCENARIOS: list[Scenario] = []
+
+def scenario(group: str, setup: Optional[Callable[["BenchmarkContext"], Any]] = None, rounds: Optional[int] = None) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    def register(run: Callable[..., Any]) -> Callable[..., Any]:
+        SCENARIOS.append(Scenario(group, run.__name__, run, setup, rounds))
+        return run
+    return register
+
+class BenchmarkContext:
+    def __init__(self, db: DatabaseManager, url: str, counts: dict[str, int], seed: int = 0):
+        self.db = db
+        self.url = url
+        self.counts = counts
+        self.seed = seed
+        self.words = common_words(seed)
+        self.tmp = tempfile.mkdtemp(prefix="kanot-bench-")
+        self.round = 0
+        self._client: Any = None
+
+    @property
+    def client(self) -> Any:
+        # kanot.main opens the database named by KANOT_DATABASE_URL when it
+        # is first imported, so the app can only be benchmarked on one database
+        # per process
+        if self._client is None:
+            os.environ["KANOT_DATABASE_URL"] = self.url
+            from fastapi.testclient import TestClient
+
+            from kanot import main
+
+            if main.engine.url.render_as_string(hide_password=False) != self.url:
+                raise RuntimeError(f"kanot.main is already bound to {main.engine.url}, not {self.url}")
+            self._client = TestClient(main.app)
+        return self._client
+
+    def elements(self, k: int) -> list[int]:
+        self.round += 1
+        return sample(self.seed + self.round, self.counts["elements"], k)
+
+# DatabaseManager
+
+@scenario("crud")
+def search_elements_common_word(ctx: BenchmarkContext) -> Any:
+    return ctx.db.search_elements(ctx.words[0], limit=100, search_mode="fulltext")
+
+@scenario("crud")
+def search_elements_phrase(ctx: BenchmarkContext) -> Any:
+    return ctx.db.search_elements(f'"{ctx.words[0]} {ctx.words[1]}"', limit=100, search_mode="fulltext")
+
+@scenario("crud")
+def search_elements_like(ctx: BenchmarkContext) -> Any:
+    return ctx.db.search_elements(ctx.words[3], limit=100, search_mode="like")
+
+@scenario("crud")
+def search_elements_rank(ctx: BenchmarkContext) -> Any:
+    return ctx.db.search_elements(ctx.words[5], limit=100, search_mode="fulltext", order_by="rank")
+
+@scenario("crud")
+def search_elements_by_codes(ctx: BenchmarkContext) -> Any:
+    return ctx.db.search_elements("", code_ids=[1, 2, 3], limit=100)
+
+@scenario("crud")
+def search_elements_deep_page(ctx: BenchmarkContext) -> Any:
+    return ctx.db.search_elements(ctx.words[0], skip=ctx.counts["elements"] // 4, limit=100, search_mode="fulltext")
+
+@scenario("crud")
+def search_elements_keyset(ctx: BenchmarkContext) -> Any:
+    elements, cursor = ctx.db.search_elements_keyset(ctx.words[0], cursor=None, limit=100, search_mode="fulltext")
+    return ctx.db.search_elements_keyset(ctx.words[0], cursor=cursor, limit=100, search_mode="fulltext")
+
+@scenario("crud")
+def count_elements(ctx: BenchmarkContext) -> Any:
+    return ctx.db.count_elements(ctx.words[0], series_ids=[1], search_mode="fulltext")
+
+@scenario("crud")
+def count_facets(ctx: BenchmarkContext) -> Any:
+    return ctx.db.count_facets(ctx.words[0], search_mode="fulltext")
+
+@scenario("crud")
+def read_elements_page(ctx: BenchmarkContext) -> Any:
+    return ctx.db.read_elements_paginated(skip=0, limit=1000)
+
+@scenario("crud")
+def read_elements_page_dicts(ctx: BenchmarkContext) -> Any:
+    return ctx.db.read_elements_paginated(skip=0, limit=1000, shape="dicts")
+
+@scenario("crud")
+def read_elements_page_compact(ctx: BenchmarkContext) -> Any:
+    return ctx.db.read_elements_paginated(skip=0, limit=1000, shape="compact")
+
+@scenario("crud")
+def read_all_codes(ctx: BenchmarkContext) -> Any:
+    return ctx.db.read_all_codes()
+
+@scenario("crud")
+def read_cooccurrences(ctx: BenchmarkContext) -> Any:
+    return ctx.db.read_cooccurrences(min_count=2, limit=1000)
+
+@scenario("crud", setup=lambda ctx: ctx.elements(500))
+def batch_annotate_remove(ctx: BenchmarkContext, element_ids: list[int]) -> Any:
+    code_ids = [ctx.counts["codes"] - 2, ctx.counts["codes"] - 1, ctx.counts["codes"]]
+    ctx.db.create_batch_annotations(element_ids, code_ids)
+    return ctx.db.delete_batch_annotations(element_ids, code_ids)
+
+def _merge_setup(ctx: BenchmarkContext) -> tuple[int, int]:
+    # Two fresh codes sharing some elements
+    source = ctx.db.create_code(f"Merge source {ctx.round}", "", 1, "", "")
+    target = ctx.db.create_code(f"Merge target {ctx.round}", "", 1, "", "")
+    if source is None or target is None:
+        raise RuntimeError(f"Could not create the codes to merge in round {ctx.round}")
+    elements = ctx.elements(1000)
+    ctx.db.create_batch_annotations(elements, [source.code_id])
+    ctx.db.create_batch_annotations(elements[::2], [target.code_id])
+    return source.code_id, target.code_id
+
+@scenario("crud", setup=_merge_setup)
+def merge_codes(ctx: BenchmarkContext, source_id: int, target_id: int) -> Any:
+    return ctx.db.merge_codes(source_id, target_id)
+
+@scenario("crud", rounds=3)
+def export(ctx: BenchmarkContext) -> Any:
+    return export_project(ctx.db.engine, os.path.join(ctx.tmp, "export"))
+
+# FastAPI
+
+@scenario("api")
+def get_search_elements(ctx: BenchmarkContext) -> Any:
+    return ctx.client.get("/search_elements/", params={"search_term": ctx.words[0], "limit": 100, "search_mode": "fulltext"}).content
+
+@scenario("api")
+def get_search_elements_facets(ctx: BenchmarkContext) -> Any:
+    params = {"search_term": ctx.words[0], "limit": 100, "search_mode": "fulltext", "facets": "series,segment,code"}
+    return ctx.client.get("/search_elements/", params=params).content
+
+@scenario("api")
+def get_elements_page(ctx: BenchmarkContext) -> Any:
+    return ctx.client.get("/elements/", params={"limit": 1000}).content
+
+@scenario("api")
+def get_elements_page_compact(ctx: BenchmarkContext) -> Any:
+    return ctx.client.get("/elements/", params={"limit": 1000, "format": "compact"}).content
+
+@scenario("api")
+def get_codes(ctx: BenchmarkContext) -> Any:
+    return ctx.client.get("/codes/").content
+
+@scenario("api", setup=lambda ctx: ctx.elements(500))
+def post_delete_batch_annotations(ctx: BenchmarkContext, element_ids: list[int]) -> Any:
+    body = {"element_ids": element_ids, "code_ids": [ctx.counts["codes"] - 1, ctx.counts["codes"]]}
+    ctx.client.post("/batch_annotations/", json=body)
+    return ctx.client.request("DELETE", "/batch_annotations/", json=body).content
+
+@scenario("api")
+def stream_segment_elements(ctx: BenchmarkContext) -> Any:
+    return ctx.client.get("/stream/elements", params={"segment_ids": "1"}).content
@@ -0,0 +1,83 @@
+# Compare the two ways of serializing a page of elements:
+#
+#   ORM:  joinedload ORM objects, validated per row by the ElementResponse
+#         model (from_attributes) and encoded with json, as FastAPI does for
+#         a response_model
+#   fast: column tuples assembled into shared dicts and encoded with orjson
+#   compact: the normalized page of format=compact, codes sent once
+#
+# Run from backend/: python -m benchmarks.serialization [--elements N] [--limit N]
+# The full scenario suite is in scenarios.py, see __main__.py
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable, List
+
+from kanot.db.crud import DatabaseManager
+from kanot.db.engine import create_database_engine
+
+from .synthetic import generate
+
+def normalized(body: bytes) -> Any:
+    # The ORM path leaves annotation order to the query plan
+    elements = json.loads(body)
+    for element in elements:
+        element["annotations"].sort(key=lambda annotation: annotation["annotation_id"])
+    return elements
+
+def timed(run: Callable[[], bytes], repeat: int) -> tuple[float, bytes]:
+    best, body = float("inf"), b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = run()
+        best = min(best, time.perf_counter() - start)
+    return best, body
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--elements", type=int, default=20000)
+    parser.add_argument("--codes", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=1000, help="Page size")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    # kanot.main opens its own database on import, point it at the benchmark one
+    os.environ["KANOT_DATABASE_URL"] = url
+    engine = create_database_engine(url)
+    counts = generate(engine, "small", elements=args.elements, codes=args.codes)
+    db_manager = DatabaseManager(engine)
+
+    from pydantic import TypeAdapter
+
+    from kanot.main import ElementResponse
+    from kanot.serialization import dumps
+
+    adapter = TypeAdapter(List[ElementResponse])
+
+    def orm_path() -> bytes:
+        elements = db_manager.search_elements("", limit=args.limit)
+        content = adapter.dump_python(adapter.validate_python(elements, from_attributes=True), mode="json")
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def fast_path() -> bytes:
+        return dumps(db_manager.search_elements("", limit=args.limit, shape="dicts"))
+
+    def compact_path() -> bytes:
+        return dumps(db_manager.search_elements("", limit=args.limit, shape="compact"))
+
+    orm_seconds, orm_body = timed(orm_path, args.repeat)
+    fast_seconds, fast_body = timed(fast_path, args.repeat)
+    compact_seconds, compact_body = timed(compact_path, args.repeat)
+    assert normalized(orm_body) == normalized(fast_body), "fast path output differs from the response model"
+
+    print(f"page of {args.limit} elements, {counts['annotations'] / counts['elements']:.1f} annotations each on average")
+    print(f"  ORM + response_model:  {orm_seconds * 1000:8.1f} ms {len(orm_body) / 1024:8.0f} KiB")
+    print(f"  column dicts + orjson: {fast_seconds * 1000:8.1f} ms {len(fast_body) / 1024:8.0f} KiB  {orm_seconds / fast_seconds:5.1f}x")
+    print(f"  compact + orjson:      {compact_seconds * 1000:8.1f} ms {len(compact_body) / 1024:8.0f} KiB  {orm_seconds / compact_seconds:5.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Seeded synthetic corpus for benchmarks. Word and code frequencies follow a
+# Zipf distribution, as in real transcripts: a few words and codes are very
+# common and most are rare. The same size and seed always give the same
+# database, so timings are comparable across commits.
+import itertools
+import logging
+import math
+import random
+from typing import Any, Iterator
+
+from sqlalchemy import Engine, insert
+
+from kanot.db.code_usage import rebuild_code_usage
+from kanot.db.cooccurrence import rebuild_cooccurrences
+from kanot.db.schema import Annotation, Code, CodeType, Element, Segment, Series, create_database
+
+logger = logging.getLogger("kanot")
+
+SIZES: dict[str, dict[str, int]] = {
+    "tiny": {"series": 2, "segments": 20, "elements": 2_000, "codes": 200},
+    "small": {"series": 5, "segments": 200, "elements": 50_000, "codes": 2_000},
+    "medium": {"series": 10, "segments": 2_000, "elements": 500_000, "codes": 10_000},
+    "large": {"series": 20, "segments": 20_000, "elements": 5_000_000, "codes": 50_000},
+}
+
+CODE_TYPES = ["Person", "Place", "Organisation", "Event", "Concept", "Date"]
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "ta", "so", "vi", "dun", "bel", "fast", "der", "ry", "an", "el", "or", "is", "ton", "ber", "gal"]
+VOCABULARY_SIZE = 8_000
+# Rows per INSERT statement and transaction
+CHUNK_SIZE = 10_000
+# Mean annotations per element; about a third of elements have none
+MEAN_ANNOTATIONS = 2.5
+
+def zipf_weights(n: int, s: float = 1.1) -> list[float]:
+    # Cumulative weights for random.choices
+    return list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+def vocabulary(rng: random.Random, size: int = VOCABULARY_SIZE) -> list[str]:
+    words: set[str] = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))))
+    # Sorted before shuffling so the result does not depend on set order
+    ordered = sorted(words)
+    rng.shuffle(ordered)
+    return ordered
+
+def text(rng: random.Random, words: list[str], weights: list[float], length: int) -> str:
+    chosen = rng.choices(words, cum_weights=weights, k=length)
+    chosen[0] = chosen[0].capitalize()
+    return " ".join(chosen) + "."
+
+def code_terms(rng: random.Random, words: list[str], n: int) -> list[str]:
+    # Unique one to three word terms, codes.term is unique
+    terms: list[str] = []
+    seen: set[str] = set()
+    while len(terms) < n:
+        term = " ".join(rng.choice(words[:2000]).capitalize() for _ in range(rng.randint(1, 3)))
+        if term not in seen:
+            seen.add(term)
+            terms.append(term)
+    return terms
+
+def poisson(rng: random.Random, mean: float) -> int:
+    # Knuth's method, fine for small means
+    limit, k, p = math.exp(-mean), 0, rng.random()
+    while p > limit:
+        k += 1
+        p *= rng.random()
+    return k
+
+def _chunks(rows: Iterator[dict[str, Any]], size: int = CHUNK_SIZE) -> Iterator[list[dict[str, Any]]]:
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+def generate(engine: Engine, size: str = "tiny", seed: int = 0, **overrides: int) -> dict[str, int]:
+    # Fill an empty database; counts come from SIZES[size], updated with
+    # overrides such as elements=1_000_000. Rows are generated and written a
+    # chunk at a time, so memory does not grow with the corpus.
+    counts = {**SIZES[size], **overrides}
+    rng = random.Random(seed)
+    words = vocabulary(rng)
+    word_weights = zipf_weights(len(words))
+    code_weights = zipf_weights(counts["codes"])
+    create_database(engine)
+
+    with engine.begin() as connection:
+        connection.execute(insert(CodeType), [{"type_id": i + 1, "type_name": name} for i, name in enumerate(CODE_TYPES)])
+        connection.execute(insert(Series), [{"series_id": i, "series_title": f"Series {i}"} for i in range(1, counts["series"] + 1)])
+        connection.execute(insert(Segment), [
+            {"segment_id": i, "segment_title": f"Episode {i}: {text(rng, words, word_weights, 4)}", "series_id": rng.randint(1, counts["series"])}
+            for i in range(1, counts["segments"] + 1)
+        ])
+        terms = code_terms(rng, words, counts["codes"])
+        connection.execute(insert(Code), [
+            {
+                "code_id": i,
+                "term": terms[i - 1],
+                "description": text(rng, words, word_weights, rng.randint(10, 40)),
+                "type_id": rng.randint(1, len(CODE_TYPES)),
+                "reference": f"https://example.org/glossary/{i}",
+                "coordinates": f"{rng.uniform(51, 56):.4f},{rng.uniform(-8, -5):.4f}" if rng.random() < 0.3 else None,
+            }
+            for i in range(1, counts["codes"] + 1)
+        ])
+
+    # Elements are spread over segments in order, like transcript lines
+    per_segment = max(1, counts["elements"] // counts["segments"])
+
+    def elements() -> Iterator[dict[str, Any]]:
+        for i in range(1, counts["elements"] + 1):
+            length = max(3, int(rng.lognormvariate(3, 0.6)))
+            segment_id = min(counts["segments"], (i - 1) // per_segment + 1)
+            yield {"element_id": i, "element_text": text(rng, words, word_weights, length), "segment_id": segment_id}
+
+    def annotations(element_ids: range) -> Iterator[dict[str, Any]]:
+        for element_id in element_ids:
+            n = min(poisson(rng, MEAN_ANNOTATIONS), counts["codes"])
+            code_ids = set(rng.choices(range(1, counts["codes"] + 1), cum_weights=code_weights, k=n))
+            for code_id in sorted(code_ids):
+                yield {"element_id": element_id, "code_id": code_id}
+
+    written = 0
+    annotations_written = 0
+    for chunk in _chunks(elements()):
+        first, last = chunk[0]["element_id"], chunk[-1]["element_id"]
+        with engine.begin() as connection:
+            connection.execute(insert(Element), chunk)
+            rows = list(annotations(range(first, last + 1)))
+            if rows:
+                connection.execute(insert(Annotation), rows)
+        written += len(chunk)
+        annotations_written += len(rows)
+        if written % (CHUNK_SIZE * 10) == 0:
+            logger.info(f"Generated {written} of {counts['elements']} elements")
+
+    with engine.begin() as connection:
+        rebuild_cooccurrences(connection)
+        rebuild_code_usage(connection)
+
+    return {**counts, "annotations": annotations_written}
+
+def common_words(seed: int = 0, n: int = 20) -> list[str]:
+    # The most frequent words of the corpus generated with this seed, for
+    # search scenarios that should match many elements
+    return vocabulary(random.Random(seed))[:n]
+
+def sample(seed: int, population: int, k: int) -> list[int]:
+    # k sorted ids between 1 and population
+    return sorted(random.Random(seed).sample(range(1, population + 1), min(k, population)))
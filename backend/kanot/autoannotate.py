@@ -0,0 +1,226 @@
+import datetime
+import json
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+from .db.crud import DatabaseManager
+from .db.prompt_cache import DEFAULT_MAX_ENTRIES, cache_key, codebook_hash
+from .llm import PROMPT_TEMPLATE, ModelClient, TransientModelError, build_prompt, create_model_client, parse_response
+
+logger = logging.getLogger("kanot")
+
+DEFAULT_BATCH_SIZE = 20
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+# A running job that was asked to stop is "cancelling" until its batches in
+# flight finish, then "cancelled"
+ACTIVE_STATUSES = ["queued", "running", "cancelling"]
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def elements_per_second(job: Any) -> float:
+    if not job.started_at or not job.processed_elements:
+        return 0.0
+    started = job.started_at.replace(tzinfo=None)
+    finished = (job.finished_at or datetime.datetime.now(datetime.timezone.utc)).replace(tzinfo=None)
+    seconds = (finished - started).total_seconds()
+    return job.processed_elements / seconds if seconds > 0 else 0.0
+
+def cache_hit_rate(job: Any) -> float:
+    lookups = job.cache_hits + job.cache_misses
+    return job.cache_hits / lookups if lookups else 0.0
+
+class JobCancelled(Exception):
+    pass
+
+class AutoannotationRunner:
+    # Runs autoannotation jobs in the background. Each job is split into
+    # batches of elements, one prompt per batch; batches of all jobs share one
+    # pool of max_concurrency workers, which bounds concurrent model calls.
+    # Answers are cached per element text, so re-running a job after a
+    # codebook edit only prompts the model for elements it has not seen with
+    # the current codebook.
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        client_factory: Callable[[str], ModelClient] = create_model_client,
+        max_jobs: int = 2,
+        max_concurrency: int = 8,
+        max_retries: int = 4,
+        base_delay: float = 0.5,
+        use_cache: bool = True,
+        cache_size: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.db_manager = db_manager
+        self.client_factory = client_factory
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.use_cache = use_cache
+        self.cache_size = cache_size
+        self._jobs = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="autoannotate-job")
+        self._batches = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="autoannotate-batch")
+        self._cancelled: dict[int, threading.Event] = {}
+        self._futures: dict[int, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id: int) -> Future:
+        with self._lock:
+            self._cancelled[job_id] = threading.Event()
+            future = self._jobs.submit(self._run, job_id)
+            self._futures[job_id] = future
+        return future
+
+    def cancel(self, job_id: int) -> bool:
+        job = self.db_manager.read_autoannotation_job(job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return False
+        with self._lock:
+            event = self._cancelled.get(job_id)
+        if event is None:
+            # Not owned by this process, nothing is working on it
+            return self.db_manager.update_autoannotation_job(job_id, from_statuses=ACTIVE_STATUSES, status="cancelled", finished_at=_now())
+        # Record the cancel before the runner sees it, so the runner's final
+        # status is written after this one
+        if not self.db_manager.update_autoannotation_job(job_id, from_statuses=ACTIVE_STATUSES, status="cancelling"):
+            return False
+        event.set()
+        return True
+
+    def wait(self, job_id: int, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+
+    def recover(self) -> None:
+        # Jobs left running by a previous process may have written part of
+        # their batches, fail them; jobs that never started are queued again
+        for job in self.db_manager.read_all_autoannotation_jobs():
+            if job.status == "running":
+                self.db_manager.update_autoannotation_job(
+                    job.job_id, status="failed", error="Interrupted by server restart", finished_at=_now()
+                )
+            elif job.status == "cancelling":
+                self.db_manager.update_autoannotation_job(job.job_id, status="cancelled", finished_at=_now())
+            elif job.status == "queued":
+                self.submit(job.job_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            events = list(self._cancelled.values())
+        for event in events:
+            event.set()
+        self._jobs.shutdown(wait=wait)
+        self._batches.shutdown(wait=wait)
+
+    def _run(self, job_id: int) -> None:
+        cancelled = self._cancelled[job_id]
+        try:
+            self._run_job(job_id, cancelled)
+        except Exception as e:
+            logger.error(f"Autoannotation job {job_id} failed: {str(e)}")
+            self.db_manager.update_autoannotation_job(job_id, status="failed", error=str(e), finished_at=_now())
+        finally:
+            with self._lock:
+                self._cancelled.pop(job_id, None)
+
+    def _run_job(self, job_id: int, cancelled: threading.Event) -> None:
+        job = self.db_manager.read_autoannotation_job(job_id)
+        if job is None:
+            return
+        if cancelled.is_set():
+            self.db_manager.update_autoannotation_job(job_id, status="cancelled", finished_at=_now())
+            return
+
+        element_ids = json.loads(job.element_ids) or self.db_manager.read_element_ids()
+        codes = self.db_manager.read_code_terms(json.loads(job.code_ids))
+        client = self.client_factory(job.model)
+        if not self.db_manager.update_autoannotation_job(
+            job_id, from_statuses=["queued"], status="running", started_at=_now(), total_elements=len(element_ids)
+        ):
+            # Cancelled while starting, no batch has run
+            self.db_manager.update_autoannotation_job(job_id, status="cancelled", finished_at=_now())
+            return
+        logger.info(f"Autoannotation job {job_id}: {len(element_ids)} elements, {len(codes)} codes, model {job.model}")
+
+        batch_size = job.batch_size or DEFAULT_BATCH_SIZE
+        batches = [element_ids[i:i + batch_size] for i in range(0, len(element_ids), batch_size)]
+        codebook = codebook_hash(codes)
+        pending = {
+            self._batches.submit(self._run_batch, job_id, client, codes, codebook, batch, cancelled)
+            for batch in batches
+        }
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                exception = future.exception()
+                if exception is not None and not isinstance(exception, JobCancelled) and error is None:
+                    error = exception
+                    # Stop the remaining batches of this job
+                    cancelled.set()
+
+        if error is not None:
+            raise error
+        status = "cancelled" if cancelled.is_set() else "completed"
+        self.db_manager.update_autoannotation_job(job_id, status=status, finished_at=_now())
+        logger.info(f"Autoannotation job {job_id} {status}")
+
+    def _run_batch(self, job_id: int, client: ModelClient, codes: list[tuple[int, str, Optional[str]]], codebook: str, element_ids: list[int], cancelled: threading.Event) -> None:
+        if cancelled.is_set():
+            raise JobCancelled()
+        elements = self.db_manager.read_element_texts(element_ids)
+        keys = {element_id: cache_key(client.model_name, PROMPT_TEMPLATE, codebook, text) for element_id, text in elements}
+        cached = self.db_manager.read_prompt_cache(list(set(keys.values()))) if self.use_cache else {}
+        assigned = {element_id: cached[key] for element_id, key in keys.items() if key in cached}
+        misses = [(element_id, text) for element_id, text in elements if element_id not in assigned]
+        calls, prompt_tokens, completion_tokens = 0, 0, 0
+        if misses:
+            answers, calls, prompt_tokens, completion_tokens = self._complete(job_id, client, build_prompt(codes, misses), cancelled)
+            answered = {element_id: answers[element_id] for element_id, _ in misses if element_id in answers}
+            if self.use_cache:
+                self.db_manager.write_prompt_cache({keys[element_id]: code_ids for element_id, code_ids in answered.items()}, self.cache_size)
+            assigned.update(answered)
+
+        # Ignore ids the model made up
+        known_codes = {code_id for code_id, _, _ in codes}
+        pairs = [
+            (element_id, code_id)
+            for element_id, code_ids in assigned.items()
+            for code_id in code_ids if code_id in known_codes
+        ]
+        created = self.db_manager.create_annotation_pairs(pairs)
+        self.db_manager.add_autoannotation_progress(
+            job_id,
+            processed_elements=len(element_ids),
+            annotations_created=created,
+            model_calls=calls,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cache_hits=len(elements) - len(misses),
+            cache_misses=len(misses),
+            cost=client.cost(prompt_tokens, completion_tokens),
+        )
+
+    def _complete(self, job_id: int, client: ModelClient, prompt: str, cancelled: threading.Event) -> tuple[dict[int, list[int]], int, int, int]:
+        # Returns (answers, model calls, prompt tokens, completion tokens)
+        calls, prompt_tokens, completion_tokens = 0, 0, 0
+        for attempt in range(self.max_retries + 1):
+            calls += 1
+            try:
+                text, used_prompt, used_completion = client.complete(prompt)
+                prompt_tokens += used_prompt
+                completion_tokens += used_completion
+                return parse_response(text), calls, prompt_tokens, completion_tokens
+            except (TransientModelError, ValueError) as e:
+                # Unparseable answers are retried like rate limits, a second
+                # sample usually comes back well-formed
+                if attempt == self.max_retries:
+                    raise
+                delay = self.base_delay * 2 ** attempt
+                logger.warning(f"Autoannotation job {job_id}: {str(e)}, retrying in {delay:.1f}s")
+                if cancelled.wait(delay):
+                    raise JobCancelled()
+        raise AssertionError("unreachable")
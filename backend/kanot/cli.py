@@ -0,0 +1,106 @@
+import argparse
+from pathlib import Path
+from typing import Optional
+
+from .db.crud import DatabaseManager, logger
+from .db.engine import create_database_engine, database_url
+from .db.schema import create_database, drop_database
+from .exporter import COMPRESSIONS, export_project
+from .importer import DEFAULT_BATCH_SIZE, import_glossary, import_transcripts
+from .transcripts import DEFAULT_MAX_CHARS, FORMATS, SPLIT_MODES, guess_format, ingest_transcript, open_transcript
+
+def run_import(args: argparse.Namespace) -> int:
+    if not args.glossary and not args.transcripts:
+        logger.error("Nothing to import, pass --glossary and/or --transcripts.")
+        return 1
+    engine = create_database_engine(args.database_url)
+    if args.drop:
+        drop_database(engine)
+    create_database(engine)
+    upsert = not args.no_upsert
+    if args.glossary:
+        codes = import_glossary(engine, args.glossary, args.batch_size, upsert, args.resume)
+        logger.info(f"Imported {codes} codes")
+    if args.transcripts:
+        elements = import_transcripts(engine, args.transcripts, args.series_title, args.batch_size, upsert, args.resume)
+        logger.info(f"Imported {elements} elements")
+    return 0
+
+def run_transcript(args: argparse.Namespace) -> int:
+    engine = create_database_engine(args.database_url)
+    create_database(engine)
+    path = Path(args.file)
+    try:
+        with open_transcript(path) as lines:
+            result = ingest_transcript(
+                engine,
+                lines,
+                args.segment_title or path.stem,
+                args.series_title or path.parent.name or path.stem,
+                args.format or guess_format(path.name),
+                args.split,
+                args.max_chars,
+                args.batch_size,
+            )
+    except ValueError as e:
+        logger.error(f"Cannot ingest {path}: {str(e)}")
+        return 1
+    logger.info(f"Created segment {result['segment_id']} with {result['elements']} elements")
+    return 0
+
+def run_export(args: argparse.Namespace) -> int:
+    engine = create_database_engine(args.database_url)
+    manifest = export_project(engine, args.output, args.compression, args.batch_size)
+    logger.info(f"Exported {manifest['elements']} elements and {manifest['codes']} codes to {args.output}")
+    return 0
+
+def run_rebuild(args: argparse.Namespace) -> int:
+    # Recount the tables derived from annotations, after writes made outside kanot
+    db_manager = DatabaseManager(create_database_engine(args.database_url))
+    db_manager.rebuild_cooccurrences()
+    db_manager.rebuild_code_usage()
+    logger.info("Rebuilt code co-occurrences and code usage")
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="kanot")
+    parser.add_argument("--database-url", default=database_url(), help="Defaults to KANOT_DATABASE_URL or the local sqlite database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Stream glossary and transcript CSV or JSONL files into the database")
+    import_parser.add_argument("--glossary", help="Glossary file with one code per row")
+    import_parser.add_argument("--transcripts", help="Transcript file with one element per row and ';'-separated code ids")
+    import_parser.add_argument("--series-title", help="Series the transcript segments belong to, defaults to the file name")
+    import_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per chunk and transaction")
+    import_parser.add_argument("--resume", action="store_true", help="Skip rows written by an earlier, interrupted import of the same files")
+    import_parser.add_argument("--no-upsert", action="store_true", help="Keep existing rows instead of updating them")
+    import_parser.add_argument("--drop", action="store_true", help="Drop and recreate all tables first")
+    import_parser.set_defaults(func=run_import)
+
+    transcript_parser = subparsers.add_parser("transcript", help="Split a plain text, SRT, WebVTT or CSV transcript into the elements of a new segment")
+    transcript_parser.add_argument("file")
+    transcript_parser.add_argument("--segment-title", help="Defaults to the file name")
+    transcript_parser.add_argument("--series-title", help="Series to add the segment to, found or created by title, defaults to the directory name")
+    transcript_parser.add_argument("--format", choices=list(FORMATS), help="Defaults to the file extension, txt when unknown")
+    transcript_parser.add_argument("--split", choices=list(SPLIT_MODES), default="sentence", help="One element per sentence, speaker turn or line")
+    transcript_parser.add_argument("--max-chars", type=int, default=DEFAULT_MAX_CHARS, help="Longer elements are cut at a word boundary")
+    transcript_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Elements per transaction")
+    transcript_parser.set_defaults(func=run_transcript)
+
+    export_parser = subparsers.add_parser("export", help="Write the project as sharded, compressed JSON for a static dashboard")
+    export_parser.add_argument("output", help="Output directory, replaced if it exists")
+    export_parser.add_argument("--compression", choices=list(COMPRESSIONS), default="gzip")
+    export_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows fetched per round trip")
+    export_parser.set_defaults(func=run_export)
+
+    rebuild_parser = subparsers.add_parser("rebuild", help="Recount code co-occurrences and code usage from the annotations")
+    rebuild_parser.set_defaults(func=run_rebuild)
+
+    return parser
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,63 @@
+import functools
+from typing import Any, Callable, Optional, TypeVar
+
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .crud import DatabaseManager
+
+T = TypeVar("T")
+
+@functools.lru_cache(maxsize=None)
+def _adapter(response_model: Any) -> TypeAdapter:
+    return TypeAdapter(response_model)
+
+class AsyncDatabaseManager:
+    # Runs DatabaseManager methods from async endpoints. On an AsyncEngine the
+    # work runs in a greenlet on the event loop through AsyncSession.run_sync:
+    # it is the same sync code, but every statement awaits the async driver,
+    # so a request waiting on SQLite yields to the others instead of holding
+    # a threadpool thread. Without an async engine the work runs on the
+    # threadpool as before.
+    def __init__(self, db_manager: DatabaseManager, engine: Optional[AsyncEngine] = None) -> None:
+        self.db_manager = db_manager
+        self.engine = engine
+        # The sync sessions inside are of the DatabaseManager's session class,
+        # so its read cache listeners see these writes too
+        self.Session = (
+            async_sessionmaker(engine, sync_session_class=db_manager.Session.class_, expire_on_commit=False)
+            if engine is not None
+            else None
+        )
+
+    async def run(self, work: Callable[[Session], T], response_model: Any = None) -> T:
+        # Run work(session) as one unit of work, committed at the end. With a
+        # response_model the result is validated into it before the session
+        # closes, while lazy relationships can still load; after that no
+        # attribute access may reach the database.
+        def validated(session: Session) -> Any:
+            result = work(session)
+            if response_model is not None and result is not None:
+                return _adapter(response_model).validate_python(result, from_attributes=True)
+            return result
+
+        if self.Session is None:
+            return await run_in_threadpool(self._run_sync, validated)
+        async with self.Session() as session:
+            try:
+                result = await session.run_sync(validated)
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        return result
+
+    def _run_sync(self, work: Callable[[Session], T]) -> T:
+        with self.db_manager.unit_of_work() as session:
+            return work(session)
+
+    async def dispose(self) -> None:
+        if self.engine is not None:
+            await self.engine.dispose()
@@ -0,0 +1,63 @@
+from typing import Any, Hashable, Iterable, Optional
+
+# Bulk writes check every item against the database before anything is
+# written. Items that fail a check are skipped and reported, the others are
+# written together. Results come back in the order the items are applied:
+# deletes, then updates, then creates, each in request order.
+OPERATIONS = ("delete", "update", "create")
+
+def changes(row: dict[str, Any]) -> dict[str, Any]:
+    # A partial update: None leaves a column as it is
+    return {column: value for column, value in row.items() if value is not None}
+
+class UniqueValues:
+    # Holder of each value of a unique column, such as a code term, as the
+    # items of a bulk request are checked in order. Holders are primary keys,
+    # or any other hashable for rows not created yet.
+    def __init__(self, rows: Iterable[tuple[Any, Hashable]]) -> None:
+        self.holder: dict[Any, Hashable] = {}
+        self.value: dict[Hashable, Any] = {}
+        for value, holder in rows:
+            self.holder[value] = holder
+            self.value[holder] = value
+
+    def release(self, holder: Hashable) -> None:
+        value = self.value.pop(holder, None)
+        if value is not None:
+            self.holder.pop(value, None)
+
+    def claim(self, holder: Hashable, value: Any) -> bool:
+        if self.holder.get(value, holder) != holder:
+            return False
+        self.release(holder)
+        self.holder[value] = holder
+        self.value[holder] = value
+        return True
+
+class BulkReport:
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.results: list[dict[str, Any]] = []
+
+    def _result(self, op: str, index: int, status: str, id: Optional[int], detail: Optional[str] = None) -> dict[str, Any]:
+        return {"op": op, "index": index, "status": status, self.key: id, "detail": detail}
+
+    def reject(self, op: str, index: int, id: Optional[int], status: str, detail: str) -> bool:
+        self.results.append(self._result(op, index, status, id, detail))
+        return False
+
+    def done(self, deleted: list[tuple[int, int]], updated: list[tuple[int, dict[str, Any]]], created: list[tuple[int, dict[str, Any]]], created_ids: list[int]) -> dict[str, Any]:
+        results = [
+            *(self._result("delete", index, "ok", id) for index, id in deleted),
+            *(self._result("update", index, "ok", row[self.key]) for index, row in updated),
+            *(self._result("create", index, "ok", id) for (index, _), id in zip(created, created_ids)),
+            *self.results,
+        ]
+        results.sort(key=lambda result: (OPERATIONS.index(result["op"]), result["index"]))
+        return {
+            "deleted": len(deleted),
+            "updated": len(updated),
+            "created": len(created),
+            "failed": len(self.results),
+            "results": results,
+        }
@@ -0,0 +1,190 @@
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, Optional
+
+from sqlalchemy import bindparam, delete, distinct, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .schema import Annotation, Code, CodeSegmentUsage, CodeUsage, Element, Segment
+
+# Ids per statement, well below SQLite's bound parameter limit
+CHUNK_SIZE = 10000
+
+# Usage columns /codes/ can sort and filter by
+USAGE_COLUMNS = {
+    "annotations": CodeUsage.annotation_count,
+    "segments": CodeUsage.segment_count,
+    "series": CodeUsage.series_count,
+}
+
+COLUMNS = ["code_id", "annotation_count", "segment_count", "series_count"]
+
+SEGMENT_COLUMNS = ["code_id", "segment_id", "count"]
+
+def _usage(code_ids: Any = None) -> Any:
+    # Usage of every code, or of some codes, counted from annotations
+    query = (
+        select(
+            Code.code_id,
+            func.count(Annotation.annotation_id),
+            func.count(distinct(Element.segment_id)),
+            func.count(distinct(Segment.series_id)),
+        )
+        .outerjoin(Annotation, Annotation.code_id == Code.code_id)
+        .outerjoin(Element, Element.element_id == Annotation.element_id)
+        .outerjoin(Segment, Segment.segment_id == Element.segment_id)
+    )
+    if code_ids is not None:
+        query = query.where(Code.code_id.in_(code_ids))
+    return query.group_by(Code.code_id)
+
+def _segment_usage(code_ids: Any = None) -> Any:
+    # Annotations per code and segment, counted from annotations
+    query = (
+        select(Annotation.code_id, Element.segment_id, func.count())
+        .join(Code, Code.code_id == Annotation.code_id)
+        .join(Element, Element.element_id == Annotation.element_id)
+        .where(Element.segment_id.is_not(None))
+    )
+    if code_ids is not None:
+        query = query.where(Annotation.code_id.in_(code_ids))
+    return query.group_by(Annotation.code_id, Element.segment_id)
+
+def rebuild_code_usage(connection: Any) -> None:
+    # Full recount in one set-based pass over annotations
+    connection.execute(delete(CodeSegmentUsage))
+    connection.execute(CodeSegmentUsage.__table__.insert().from_select(SEGMENT_COLUMNS, _segment_usage()))
+    connection.execute(delete(CodeUsage))
+    connection.execute(CodeUsage.__table__.insert().from_select(COLUMNS, _usage()))
+
+def refresh_code_usage(connection: Any, code_ids: Iterable[int]) -> None:
+    # Recount some codes. Deleted codes lose their row, new ones get one.
+    code_ids = sorted(set(code_ids))
+    for start in range(0, len(code_ids), CHUNK_SIZE):
+        chunk = code_ids[start:start + CHUNK_SIZE]
+        connection.execute(delete(CodeSegmentUsage).where(CodeSegmentUsage.code_id.in_(chunk)))
+        connection.execute(CodeSegmentUsage.__table__.insert().from_select(SEGMENT_COLUMNS, _segment_usage(chunk)))
+        connection.execute(delete(CodeUsage).where(CodeUsage.code_id.in_(chunk)))
+        connection.execute(CodeUsage.__table__.insert().from_select(COLUMNS, _usage(chunk)))
+
+def _annotations(connection: Any, element_ids: list[int]) -> Counter[tuple[int, Optional[int]]]:
+    # Annotations on some elements, counted per code and segment
+    annotations: Counter[tuple[int, Optional[int]]] = Counter()
+    for start in range(0, len(element_ids), CHUNK_SIZE):
+        chunk = element_ids[start:start + CHUNK_SIZE]
+        rows = connection.execute(
+            select(Annotation.code_id, Element.segment_id)
+            .join(Element, Element.element_id == Annotation.element_id)
+            .where(Annotation.element_id.in_(chunk))
+        )
+        annotations.update((code_id, segment_id) for code_id, segment_id in rows)
+    return annotations
+
+def _adjust_segments(connection: Any, deltas: dict[tuple[int, int], int]) -> tuple[Counter[int], Counter[int]]:
+    # Add deltas to per segment counts and return the change in segment and
+    # series counts per code, from the rows that were added or removed
+    segment_counts: Counter[int] = Counter()
+    series_counts: Counter[int] = Counter()
+    if not deltas:
+        return segment_counts, series_counts
+
+    table = CodeSegmentUsage.__table__
+    stmt = insert(table)
+    upsert = stmt.on_conflict_do_update(
+        index_elements=["code_id", "segment_id"],
+        set_={"count": table.c["count"] + stmt.excluded["count"]},
+    ).returning(table.c.code_id, table.c.segment_id, table.c["count"])
+    counts = {
+        (code_id, segment_id): count
+        for code_id, segment_id, count in connection.execute(upsert, [
+            {"code_id": code_id, "segment_id": segment_id, "count": delta} for (code_id, segment_id), delta in deltas.items()
+        ])
+    }
+    # +1 for a row that was added, -1 for one that is removed
+    crossed = {key: 1 if count > 0 else -1 for key, count in counts.items() if (count > 0) != (count - deltas[key] > 0)}
+    if not crossed:
+        return segment_counts, series_counts
+
+    removed = [{"c": code_id, "s": segment_id} for (code_id, segment_id), count in counts.items() if count <= 0]
+    if removed:
+        connection.execute(
+            delete(table).where(table.c.code_id == bindparam("c"), table.c.segment_id == bindparam("s")),
+            removed,
+        )
+    for (code_id, _), sign in crossed.items():
+        segment_counts[code_id] += sign
+
+    # A code is in a series while it has a row for any segment of it. Compare
+    # the segments of each affected series now with those before the write.
+    series_of = dict(connection.execute(
+        select(Segment.segment_id, Segment.series_id).where(Segment.segment_id.in_({segment_id for _, segment_id in crossed}))
+    ).all())
+    affected = {(code_id, series_of[segment_id]) for code_id, segment_id in crossed if series_of.get(segment_id) is not None}
+    if not affected:
+        return segment_counts, series_counts
+    segments_after: dict[tuple[int, int], set[int]] = {key: set() for key in affected}
+    rows = connection.execute(
+        select(CodeSegmentUsage.code_id, Segment.series_id, CodeSegmentUsage.segment_id)
+        .join(Segment, Segment.segment_id == CodeSegmentUsage.segment_id)
+        .where(
+            CodeSegmentUsage.code_id.in_({code_id for code_id, _ in affected}),
+            Segment.series_id.in_({series_id for _, series_id in affected}),
+        )
+    )
+    for code_id, series_id, segment_id in rows:
+        if (code_id, series_id) in segments_after:
+            segments_after[code_id, series_id].add(segment_id)
+    for (code_id, series_id), segment_ids in segments_after.items():
+        segments_before = {segment_id for segment_id in segment_ids if (code_id, segment_id) not in crossed}
+        segments_before |= {
+            segment_id for (other_id, segment_id), sign in crossed.items()
+            if other_id == code_id and sign < 0 and series_of.get(segment_id) == series_id
+        }
+        series_counts[code_id] += bool(segment_ids) - bool(segments_before)
+    return segment_counts, series_counts
+
+def adjust_code_usage(connection: Any, deltas: dict[tuple[int, Optional[int]], int]) -> None:
+    # Apply a change in annotations per code and segment. Annotation counts
+    # move by the delta, segment and series counts only when a code gains its
+    # first annotation in a segment or loses its last.
+    annotation_counts: Counter[int] = Counter()
+    for (code_id, _), delta in deltas.items():
+        annotation_counts[code_id] += delta
+    segment_counts, series_counts = _adjust_segments(connection, {
+        (code_id, segment_id): delta for (code_id, segment_id), delta in deltas.items() if segment_id is not None
+    })
+
+    rows = [
+        {"c": code_id, "a": annotation_counts[code_id], "s": segment_counts[code_id], "r": series_counts[code_id]}
+        for code_id in annotation_counts.keys() | segment_counts.keys() | series_counts.keys()
+        if annotation_counts[code_id] or segment_counts[code_id] or series_counts[code_id]
+    ]
+    if rows:
+        table = CodeUsage.__table__
+        connection.execute(
+            update(table)
+            .where(table.c.code_id == bindparam("c"))
+            .values(
+                annotation_count=table.c.annotation_count + bindparam("a"),
+                segment_count=table.c.segment_count + bindparam("s"),
+                series_count=table.c.series_count + bindparam("r"),
+            ),
+            rows,
+        )
+
+@contextmanager
+def track_code_usage(connection: Any, code_ids: Iterable[int] = (), element_ids: Iterable[int] = ()) -> Iterator[None]:
+    # Wrap a write that changes annotations. The annotations of element_ids
+    # are compared before and after and only the difference is applied.
+    # code_ids are recounted after the write, for codes that were created or
+    # deleted or whose segments moved to another series.
+    element_ids = sorted(set(element_ids))
+    before = _annotations(connection, element_ids)
+    yield
+    if isinstance(connection, Session):
+        connection.flush()
+    deltas = _annotations(connection, element_ids)
+    deltas.subtract(before)
+    adjust_code_usage(connection, {key: delta for key, delta in deltas.items() if delta})
+    refresh_code_usage(connection, [code_id for code_id in code_ids if code_id is not None])
@@ -0,0 +1,107 @@
+from collections import Counter
+from contextlib import contextmanager
+from itertools import combinations
+from typing import Any, Iterable, Iterator, Optional
+
+from sqlalchemy import and_, bindparam, delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session, aliased
+
+from .schema import Annotation, CodeCooccurrence, Element, Segment
+
+# Element ids per statement, well below SQLite's bound parameter limit
+CHUNK_SIZE = 10000
+
+def _pairs() -> Any:
+    # Co-annotated code pairs per segment
+    a = aliased(Annotation)
+    b = aliased(Annotation)
+    return (
+        select(a.code_id, b.code_id, Element.segment_id, func.count())
+        .join(b, and_(b.element_id == a.element_id, b.code_id > a.code_id))
+        .join(Element, Element.element_id == a.element_id)
+        .where(Element.segment_id.is_not(None))
+        .group_by(a.code_id, b.code_id, Element.segment_id)
+    )
+
+def rebuild_cooccurrences(connection: Any) -> None:
+    # Full recount in one set-based pass over annotations
+    connection.execute(delete(CodeCooccurrence))
+    connection.execute(
+        insert(CodeCooccurrence).from_select(["code_a_id", "code_b_id", "segment_id", "count"], _pairs())
+    )
+
+def _element_pairs(connection: Any, element_ids: list[int]) -> Counter[tuple[int, int, int]]:
+    # Co-annotated code pairs per segment on some elements
+    codes: dict[int, tuple[int, list[int]]] = {}
+    for start in range(0, len(element_ids), CHUNK_SIZE):
+        rows = connection.execute(
+            select(Element.element_id, Element.segment_id, Annotation.code_id)
+            .join(Annotation, Annotation.element_id == Element.element_id)
+            .where(Element.element_id.in_(element_ids[start:start + CHUNK_SIZE]), Element.segment_id.is_not(None))
+        )
+        for element_id, segment_id, code_id in rows:
+            codes.setdefault(element_id, (segment_id, []))[1].append(code_id)
+    pairs: Counter[tuple[int, int, int]] = Counter()
+    for segment_id, code_ids in codes.values():
+        pairs.update((a, b, segment_id) for a, b in combinations(sorted(code_ids), 2))
+    return pairs
+
+def adjust_cooccurrences(connection: Any, deltas: dict[tuple[int, int, int], int]) -> None:
+    # Add a count delta to some (code_a_id, code_b_id, segment_id) pairs and
+    # drop those of them whose count reaches zero
+    table = CodeCooccurrence.__table__
+    rows = [
+        {"code_a_id": code_a_id, "code_b_id": code_b_id, "segment_id": segment_id, "count": delta}
+        for (code_a_id, code_b_id, segment_id), delta in deltas.items() if delta
+    ]
+    if not rows:
+        return
+    stmt = insert(table)
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["code_a_id", "code_b_id", "segment_id"],
+            set_={"count": table.c["count"] + stmt.excluded["count"]},
+        ),
+        rows,
+    )
+    removed = [{"a": row["code_a_id"], "b": row["code_b_id"], "s": row["segment_id"]} for row in rows if row["count"] < 0]
+    if removed:
+        connection.execute(
+            delete(table).where(
+                table.c.code_a_id == bindparam("a"),
+                table.c.code_b_id == bindparam("b"),
+                table.c.segment_id == bindparam("s"),
+                table.c["count"] <= 0,
+            ),
+            removed,
+        )
+
+@contextmanager
+def track_cooccurrences(connection: Any, element_ids: Iterable[int]) -> Iterator[None]:
+    # Wrap an annotation write: the pairs of the touched elements are compared
+    # before and after, and only the pairs that changed are written, inside
+    # the caller's transaction
+    element_ids = sorted(set(element_ids))
+    before = _element_pairs(connection, element_ids)
+    yield
+    if isinstance(connection, Session):
+        connection.flush()
+    deltas = _element_pairs(connection, element_ids)
+    deltas.subtract(before)
+    adjust_cooccurrences(connection, deltas)
+
+def read_cooccurrences(connection: Any, min_count: int = 1, series_ids: Optional[list[int]] = None, segment_ids: Optional[list[int]] = None, limit: int = 1000) -> list[Any]:
+    count = func.sum(CodeCooccurrence.count).label("count")
+    query = select(CodeCooccurrence.code_a_id, CodeCooccurrence.code_b_id, count)
+    if series_ids:
+        query = query.join(Segment, Segment.segment_id == CodeCooccurrence.segment_id).where(Segment.series_id.in_(series_ids))
+    if segment_ids:
+        query = query.where(CodeCooccurrence.segment_id.in_(segment_ids))
+    query = (
+        query.group_by(CodeCooccurrence.code_a_id, CodeCooccurrence.code_b_id)
+        .having(count >= min_count)
+        .order_by(count.desc(), CodeCooccurrence.code_a_id, CodeCooccurrence.code_b_id)
+        .limit(limit)
+    )
+    return connection.execute(query).all()
@@ -1,19 +1,45 @@
+import base64
+import datetime
+import json
 import logging
+import os
+import re
+import threading
+import uuid
+from contextlib import contextmanager
 from logging.config import dictConfig
-from typing import Any, Optional
+from typing import Any, Callable, Iterator, Optional
 
-from sqlalchemy import and_, func
+from sqlalchemy import ColumnClause, ColumnElement, and_, delete, event, func, inspect, literal, literal_column, null, or_, select, true, union_all, update
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import joinedload, sessionmaker
+from sqlalchemy.orm import Session, aliased, contains_eager, joinedload, sessionmaker
 
+from ..instrumentation import annotation_batch_sizes, annotations_created, annotations_deleted
+from .bulk import BulkReport, UniqueValues, changes
+from .code_usage import USAGE_COLUMNS, rebuild_code_usage, refresh_code_usage, track_code_usage
+from .cooccurrence import read_cooccurrences, rebuild_cooccurrences, track_cooccurrences
+from .prompt_cache import DEFAULT_MAX_ENTRIES, read_cache, write_cache
 from .schema import (
     Annotation,
+    AutoannotationJob,
     Code,
+    CodeCooccurrence,
+    CodeSegmentUsage,
     CodeType,
+    CodeUsage,
     Element,
     Segment,
     Series,
+    CODES_FTS_TABLE,
+    CODES_TRIGRAM_TABLE,
+    ELEMENTS_FTS_TABLE,
+    code_search_indexes,
+    codes_fts,
+    codes_trigram,
     create_database,
+    elements_fts,
+    has_fulltext_index,
 )
 
 # Define logging configuration
@@ -44,68 +70,277 @@ dictConfig(log_config)
 # Initialize logger
 logger = logging.getLogger("kanot")
 
+_fulltext_token = re.compile(r'"([^"]*)"|(\S+)')
+
+FACETS = ("series", "segment", "code")
+
+# Rarely written data that list endpoints serve from the read cache
+CACHED_MODELS = (CodeType, Code, Series, Segment)
+
+def to_fulltext_query(search_term: str) -> str:
+    # Turn free text from the search bar into a safe FTS5 MATCH expression.
+    # Quoted parts are phrase queries, bare words are prefix queries, and all
+    # parts must match. Every part is quoted so user input is never parsed as
+    # FTS5 syntax.
+    parts = []
+    for phrase, word in _fulltext_token.findall(search_term):
+        if phrase.strip():
+            parts.append('"' + phrase.strip() + '"')
+        elif word:
+            word = word.replace('"', '')
+            if re.search(r"\w", word):
+                parts.append('"' + word + '"*')
+    return " ".join(parts)
+
+def to_trigram_query(search_term: str) -> str:
+    # FTS5 trigram MATCH expression for fuzzy search: any three-character
+    # window of the term may match, so a typo only loses the windows it
+    # touches and bm25 ranks codes sharing more windows first. Empty for
+    # terms shorter than three characters.
+    text = " ".join(search_term.lower().split())
+    grams = dict.fromkeys(text[i:i + 3] for i in range(len(text) - 2))
+    return " OR ".join('"' + gram.replace('"', '""') + '"' for gram in grams)
+
+def _hot_queries() -> dict[str, Any]:
+    # Representative shapes of the queries DatabaseManager runs most, used to
+    # check that each one is served by an index
+    return {
+        "annotations_for_code": select(Annotation).where(Annotation.code_id == 1),
+        "annotations_for_element_and_code": select(Annotation).where(Annotation.element_id == 1, Annotation.code_id == 1),
+        "codes_for_element": select(Code).join(Annotation).where(Annotation.element_id == 1),
+        "codes_by_type": select(Code).where(Code.type_id == 1),
+        "elements_by_segment": select(Element).where(Element.segment_id.in_([1, 2])),
+        "segments_by_series": select(Segment).where(Segment.series_id.in_([1, 2])),
+        "elements_by_code": select(Annotation.element_id).where(Annotation.code_id.in_([1, 2])),
+        "elements_keyset_page": select(Element.element_id).where(Element.element_id > 1).order_by(Element.element_id).limit(100),
+        "codes_by_usage": select(CodeUsage.code_id).order_by(CodeUsage.annotation_count.desc(), CodeUsage.code_id.desc()).limit(100),
+    }
+
+def is_table_scan(plan_detail: str) -> bool:
+    # EXPLAIN QUERY PLAN reports full scans as "SCAN <table>", while index
+    # lookups are "SEARCH ..." and index-only scans say "USING ... INDEX"
+    return plan_detail.startswith("SCAN ") and "USING" not in plan_detail and "VIRTUAL TABLE" not in plan_detail
+
+def encode_cursor(values: list[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str) -> list[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
 class DatabaseManager:
     def __init__(self, engine: Any) -> None:
         self.engine = engine
         self.Session = sessionmaker(bind=engine)
+        new_cooccurrence_table = not inspect(engine).has_table(CodeCooccurrence.__tablename__)
+        new_code_usage_table = not all(inspect(engine).has_table(model.__tablename__) for model in (CodeUsage, CodeSegmentUsage))
         create_database(engine)
+        if new_cooccurrence_table:
+            self.rebuild_cooccurrences()
+        if new_code_usage_table:
+            self.rebuild_code_usage()
+        self.fulltext_enabled = has_fulltext_index(engine)
+        self.code_search = code_search_indexes(engine)
+        if not self.fulltext_enabled:
+            logger.warning("FTS5 full-text index unavailable, element search falls back to LIKE.")
+
+        # Read cache: serialized responses stamped with the data version they
+        # were built at. The version is bumped after any commit that wrote
+        # codes, code types, series or segments. The epoch keeps ETags from an
+        # earlier process from matching after a restart.
+        self.data_version = 0
+        self._version_lock = threading.Lock()
+        self._cache_epoch = uuid.uuid4().hex[:8]
+        self._cache: dict[str, tuple[int, bytes]] = {}
+        event.listen(self.Session, "after_flush", self._track_cached_writes)
+        event.listen(self.Session, "do_orm_execute", self._track_cached_statements)
+        event.listen(self.Session, "after_commit", self._bump_data_version)
+        event.listen(self.Session, "after_rollback", self._discard_cached_writes)
+
+    # Sessions
+    #
+    # Every method takes an optional session. Without one it opens, commits and
+    # closes its own session as before. With one, for example from
+    # unit_of_work, it only flushes, and the caller commits or rolls back the
+    # whole unit at the end. A method that hits an error rolls back the session
+    # it was given, discarding earlier writes in the same unit.
+
+    @contextmanager
+    def unit_of_work(self) -> Iterator[Session]:
+        # Objects stay readable after the commit, so a response can be
+        # serialized from them once the unit has ended
+        session = self.Session(expire_on_commit=False)
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _open(self, session: Optional[Session]) -> Session:
+        if session is not None:
+            return session
+        session = self.Session()
+        session.info["owned"] = True
+        return session
+
+    def _commit(self, session: Session) -> None:
+        if session.info.get("owned"):
+            session.commit()
+        else:
+            session.flush()
+
+    def _close(self, session: Session) -> None:
+        if session.info.get("owned"):
+            session.close()
+
+    # Read cache
+
+    def _track_cached_writes(self, session: Session, flush_context: Any) -> None:
+        if any(isinstance(obj, CACHED_MODELS) for obj in (*session.new, *session.dirty, *session.deleted)):
+            session.info["cached_data_changed"] = True
+
+    def _track_cached_statements(self, orm_execute_state: Any) -> None:
+        if orm_execute_state.is_select:
+            return
+        if any(mapper.class_ in CACHED_MODELS for mapper in orm_execute_state.all_mappers):
+            orm_execute_state.session.info["cached_data_changed"] = True
+
+    def _bump_data_version(self, session: Session) -> None:
+        if session.info.pop("cached_data_changed", False):
+            with self._version_lock:
+                self.data_version += 1
+
+    def _discard_cached_writes(self, session: Session) -> None:
+        session.info.pop("cached_data_changed", None)
+
+    def invalidate_read_cache(self) -> None:
+        # For writes that bypass the sessions, such as bulk ingestion on the engine
+        with self._version_lock:
+            self.data_version += 1
+
+    def read_cached(self, key: str, build: Callable[[], bytes]) -> tuple[str, bytes]:
+        # Return (etag, body) for a cached response, building it on a miss
+        version = self.data_version
+        entry = self._cache.get(key)
+        if entry is None or entry[0] != version:
+            entry = (version, build())
+            self._cache[key] = entry
+        return f'W/"{self._cache_epoch}-{entry[0]}"', entry[1]
+
+    # Query plan health
+
+    def explain_query_plans(self) -> dict[str, list[str]]:
+        plans: dict[str, list[str]] = {}
+        with self.engine.connect() as connection:
+            for name, stmt in _hot_queries().items():
+                sql = str(stmt.compile(self.engine, compile_kwargs={"literal_binds": True}))
+                rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").all()
+                plans[name] = [row[-1] for row in rows]
+        return plans
+
+    def check_query_plans(self) -> list[str]:
+        # Warn about hot queries that fall back to a full table scan, which
+        # usually means an index is missing from an older database file
+        if self.engine.dialect.name != "sqlite":
+            return []
+        scans = []
+        for name, plan in self.explain_query_plans().items():
+            for detail in plan:
+                if is_table_scan(detail):
+                    scans.append(name)
+                    logger.warning(f"Query {name} does a full table scan: {detail}")
+        return scans
+
+    # Database health
+
+    def database_stats(self) -> dict[str, int]:
+        # Sizes in bytes of the database, its free pages, the page cache
+        # configured per connection and the write-ahead log
+        if self.engine.dialect.name != "sqlite":
+            return {}
+        with self.engine.connect() as connection:
+            def pragma(name: str) -> int:
+                return connection.exec_driver_sql(f"PRAGMA {name}").scalar() or 0
+
+            page_size = pragma("page_size")
+            cache_size = pragma("cache_size")
+            stats = {
+                "database_bytes": pragma("page_count") * page_size,
+                "freelist_bytes": pragma("freelist_count") * page_size,
+                # A negative cache_size is in KiB rather than pages
+                "page_cache_bytes": -cache_size * 1024 if cache_size < 0 else cache_size * page_size,
+            }
+        database = self.engine.url.database
+        wal = f"{database}-wal"
+        stats["wal_bytes"] = os.path.getsize(wal) if database and database != ":memory:" and os.path.exists(wal) else 0
+        return stats
 
     # CodeType CRUD
     
-    def create_code_type(self, type_name: str) -> CodeType | None:
-        session = self.Session()
+    def create_code_type(self, type_name: str, session: Optional[Session] = None) -> CodeType | None:
+        session = self._open(session)
         new_code_type = CodeType(type_name=type_name)
         try:
             session.add(new_code_type)
-            session.commit()
+            self._commit(session)
             return new_code_type
         except IntegrityError:
             session.rollback()
             logger.error(f"CodeType with type_name={type_name} already exists.")
             return None
         finally:
-            session.close()
+            self._close(session)
     
-    def read_code_type(self, type_id: int) -> Optional[CodeType]:
-        session = self.Session()
+    def read_code_type(self, type_id: int, session: Optional[Session] = None) -> Optional[CodeType]:
+        session = self._open(session)
         code_type: Optional[CodeType] = session.query(CodeType).filter_by(type_id=type_id).first()
-        session.close()
+        self._close(session)
         return code_type
     
-    def read_all_code_types(self) -> Optional[list[CodeType]]:
-        session = self.Session()
+    def read_all_code_types(self, session: Optional[Session] = None) -> Optional[list[CodeType]]:
+        session = self._open(session)
         code_types = session.query(CodeType).all()
-        session.close()
+        self._close(session)
         return code_types
     
-    def update_code_type(self, type_id: int, type_name: str) -> None:
-        session = self.Session()
+    def update_code_type(self, type_id: int, type_name: str, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         code_type: Optional[CodeType] = session.query(CodeType).filter_by(type_id=type_id).first()
         if code_type:
             try:
                 code_type.type_name = type_name
-                session.commit()
+                self._commit(session)
             except IntegrityError:
                 session.rollback()
                 logger.error(f"Failed to update CodeType to type_name={type_name} due to a unique constraint violation.")
-        session.close()
+        self._close(session)
     
-    def delete_code_type(self, type_id: int) -> None:
-        session = self.Session()
+    def delete_code_type(self, type_id: int, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         code_type: Optional[CodeType] = session.query(CodeType).filter_by(type_id=type_id).first()
         if code_type:
             session.delete(code_type)
-            session.commit()
-        session.close()
+            self._commit(session)
+        self._close(session)
 
     # Code CRUD
     
-    def create_code(self, term: str, description: str, type_id: int, reference: str, coordinates: str) -> Code | None:
-        session = self.Session()
+    def create_code(self, term: str, description: str, type_id: int, reference: str, coordinates: str, session: Optional[Session] = None) -> Code | None:
+        session = self._open(session)
         try:
             new_code = Code(term=term, description=description, type_id=type_id, reference=reference, coordinates=coordinates)
             session.add(new_code)
-            session.commit()
+            session.flush()
+            refresh_code_usage(session, [new_code.code_id])
+            self._commit(session)
             session.refresh(new_code)
             return new_code
         except IntegrityError:
@@ -117,31 +352,31 @@ class DatabaseManager:
             logger.error(f"Unexpected error in create_code: {str(e)}")
             raise
         finally:
-            session.close()
+            self._close(session)
     
-    def read_code(self, code_id: int) -> Optional[Code]:
-        session = self.Session()
+    def read_code(self, code_id: int, session: Optional[Session] = None) -> Optional[Code]:
+        session = self._open(session)
         code: Optional[Code] = (
             session.query(Code)
             .options(joinedload(Code.code_type))
             .filter_by(code_id=code_id)
             .first()
         )
-        session.close()
+        self._close(session)
         return code
 
-    def read_all_codes(self) -> Optional[list[Code]]:
-        session = self.Session()
+    def read_all_codes(self, session: Optional[Session] = None) -> Optional[list[Code]]:
+        session = self._open(session)
         codes = (
             session.query(Code)
             .options(joinedload(Code.code_type))
             .all()
         )
-        session.close()
+        self._close(session)
         return codes
 
-    def update_code(self, code_id: int, term: Optional[str] = None, description: Optional[str] = None, type_id: Optional[int] = None, reference: Optional[str] = None, coordinates: Optional[str] = None) -> None:
-        session = self.Session()
+    def update_code(self, code_id: int, term: Optional[str] = None, description: Optional[str] = None, type_id: Optional[int] = None, reference: Optional[str] = None, coordinates: Optional[str] = None, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         code: Optional[Code] = session.query(Code).filter_by(code_id=code_id).first()
         if code:
             try:
@@ -155,94 +390,95 @@ class DatabaseManager:
                     code.reference = reference
                 if coordinates is not None:
                     code.coordinates = coordinates
-                session.commit()
+                self._commit(session)
             except IntegrityError:
                 session.rollback()
                 logger.error("Failed to update Code due to a unique constraint violation.")
-        session.close()
+        self._close(session)
     
-    def delete_code(self, code_id: int) -> None:
-        session = self.Session()
+    def delete_code(self, code_id: int, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         code: Optional[Code] = session.query(Code).filter_by(code_id=code_id).first()
         if code:
-            session.delete(code)
-            session.commit()
-        session.close()
+            with track_code_usage(session, [code_id]):
+                session.delete(code)
+            self._commit(session)
+        self._close(session)
 
     # Series CRUD
 
-    def create_series(self, series_title: str) -> Series | None:
-        session = self.Session()
+    def create_series(self, series_title: str, session: Optional[Session] = None) -> Series | None:
+        session = self._open(session)
         new_series = Series(series_title=series_title)
         try:
             session.add(new_series)
-            session.commit()
+            self._commit(session)
             return new_series
         except IntegrityError:
             session.rollback()
             logger.error(f"Series with series_title={series_title} already exists.")
             return None
         finally:
-            session.close()
+            self._close(session)
 
-    def read_series(self, series_id: int) -> Optional[Series]:
-        session = self.Session()
+    def read_series(self, series_id: int, session: Optional[Session] = None) -> Optional[Series]:
+        session = self._open(session)
         series: Optional[Series] = session.query(Series).filter_by(series_id=series_id).first()
-        session.close()
+        self._close(session)
         return series
     
-    def read_all_series(self) -> Optional[list[Series]]:
-        session = self.Session()
+    def read_all_series(self, session: Optional[Session] = None) -> Optional[list[Series]]:
+        session = self._open(session)
         series = session.query(Series).all()
-        session.close()
+        self._close(session)
         return series
         
-    def update_series(self, series_id: int, series_title: Optional[str]) -> None:
-        session = self.Session()
+    def update_series(self, series_id: int, series_title: Optional[str], session: Optional[Session] = None) -> None:
+        session = self._open(session)
         series: Optional[Series] = session.query(Series).filter_by(series_id=series_id).first()
         if series:
             try:
                 if series_title is not None:
                     series.series_title = series_title
-                session.commit()
+                self._commit(session)
             except IntegrityError:
                 session.rollback()
                 logger.error("Failed to update Series due to a unique constraint violation.")
-        session.close()
+        self._close(session)
 
 
-    def delete_series(self, series_id: int) -> None:
-        session = self.Session()
+    def delete_series(self, series_id: int, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         series: Optional[Series] = session.query(Series).filter_by(series_id=series_id).first()
         if series:
             session.delete(series)
-            session.commit()
-        session.close()
+            self._commit(session)
+        self._close(session)
 
     # Segment CRUD
 
-    def create_segment(self, segment_id: int, segment_title: Optional[str]) -> Segment | None:
-        session = self.Session()
+    def create_segment(self, segment_id: int, segment_title: Optional[str], session: Optional[Session] = None) -> Segment | None:
+        session = self._open(session)
         new_segment = Segment(segment_id=segment_id, segment_title=segment_title)
         try:
             session.add(new_segment)
-            session.commit()
+            self._commit(session)
             return new_segment
         except IntegrityError:
             session.rollback()
             logger.error(f"Segment with segment_id={segment_id} or segment_title={segment_title} already exists.")
             return None
         finally:
-            session.close()
+            self._close(session)
     
-    def read_segment(self, segment_id: int) -> Optional[Segment]:
-        session = self.Session()
+    def read_segment(self, segment_id: int, session: Optional[Session] = None) -> Optional[Segment]:
+        session = self._open(session)
         segment: Optional[Segment] = session.query(Segment).filter_by(segment_id=segment_id).first()
-        session.close()
+        self._close(session)
         return segment
     
-    def read_all_segments(self) -> Optional[list[Segment]]:
-        session = self.Session()
+    def read_all_segments(self, session: Optional[Session] = None) -> Optional[list[Segment]]:
+        session = self._open(session)
         try:
             segments = (
                 session.query(Segment)
@@ -251,53 +487,53 @@ class DatabaseManager:
             )
             return segments
         finally:
-            session.close()
+            self._close(session)
     
-    def update_segment(self, segment_id: int, segment_title: Optional[str] = None) -> None:
-        session = self.Session()
+    def update_segment(self, segment_id: int, segment_title: Optional[str] = None, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         segment: Optional[Segment] = session.query(Segment).filter_by(segment_id=segment_id).first()
         if segment:
             try:
                 if segment_title:
                     segment.segment_title = segment_title
-                session.commit()
+                self._commit(session)
             except IntegrityError:
                 session.rollback()
                 logger.error("Failed to update Segment due to a unique constraint violation.")
-        session.close()
+        self._close(session)
     
-    def delete_segment(self, segment_id: int) -> None:
-        session = self.Session()
+    def delete_segment(self, segment_id: int, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         segment: Optional[Segment] = session.query(Segment).filter_by(segment_id=segment_id).first()
         if segment:
             session.delete(segment)
-            session.commit()
-        session.close()
+            self._commit(session)
+        self._close(session)
 
     # Element CRUD
     
-    def create_element(self, element_text: str, segment_id: int) -> Element | None:
-        session = self.Session()
+    def create_element(self, element_text: str, segment_id: int, session: Optional[Session] = None) -> Element | None:
+        session = self._open(session)
         new_element = Element(element_text=element_text, segment_id=segment_id)
         try:
             session.add(new_element)
-            session.commit()
+            self._commit(session)
             return new_element
         except IntegrityError:
             session.rollback()
             logger.error(f"Element for segment_id={segment_id} already exists.")
             return None
         finally:
-            session.close()
+            self._close(session)
     
-    def read_element(self, element_id: int) -> Optional[Element]:
-        session = self.Session()
+    def read_element(self, element_id: int, session: Optional[Session] = None) -> Optional[Element]:
+        session = self._open(session)
         element: Optional[Element] = session.query(Element).filter_by(element_id=element_id).first()
-        session.close()
+        self._close(session)
         return element
     
-    def read_all_elements(self) -> Optional[list[Element]]:
-        session = self.Session()
+    def read_all_elements(self, session: Optional[Session] = None) -> Optional[list[Element]]:
+        session = self._open(session)
         try:
             elements = (
                 session.query(Element)
@@ -312,59 +548,204 @@ class DatabaseManager:
             logger.error(f"Error reading all elements: {str(e)}")
             return None
         finally:
-            session.close()
+            self._close(session)
     
-    def read_elements_paginated(self, skip: int = 0, limit: int = 100) -> Optional[list[Element]]:
-        session = self.Session()
+    def read_elements_paginated(self, skip: int = 0, limit: int = 100, shape: str = "orm", session: Optional[Session] = None) -> Optional[Any]:
+        session = self._open(session)
         try:
-            elements = (
-                session.query(Element)
-                .options(
-                    joinedload(Element.segment).joinedload(Segment.series),
-                    joinedload(Element.annotations).joinedload(Annotation.code).joinedload(Code.code_type)
-                )
-                .offset(skip)
-                .limit(limit)
-                .all()
-            )
-            return elements
+            element_ids = list(session.execute(
+                select(Element.element_id).order_by(Element.element_id).offset(skip).limit(limit)
+            ).scalars())
+            return self._load_elements(session, element_ids, shape)
         except Exception as e:
             logger.error(f"Error reading elements with pagination: {str(e)}")
             return None
         finally:
-            session.close()
+            self._close(session)
 
-    def update_element(self, element_id: int, element_text: Optional[str] = None, segment_id: Optional[int] = None) -> None:
-        session = self.Session()
+    def _load_elements(self, session: Any, element_ids: list[int], shape: str = "orm") -> Any:
+        # Eager load full elements for an already paginated list of ids, in
+        # that order. shape "orm" returns Element objects, "dicts" plain dicts
+        # (see _element_dicts) and "compact" a normalized page (see _element_page).
+        if shape == "compact":
+            return self._element_page(session, element_ids)
+        if not element_ids:
+            return []
+        if shape == "dicts":
+            return self._element_dicts(session, element_ids)
+        elements = (
+            session.query(Element)
+            .options(
+                joinedload(Element.segment).joinedload(Segment.series),
+                joinedload(Element.annotations).joinedload(Annotation.code).joinedload(Code.code_type)
+            )
+            .filter(Element.element_id.in_(element_ids))
+            .all()
+        )
+        by_id = {element.element_id: element for element in elements}
+        return [by_id[element_id] for element_id in element_ids if element_id in by_id]
+
+    def _element_dicts(self, session: Any, element_ids: list[int]) -> list[dict[str, Any]]:
+        # The same elements as plain dicts shaped like ElementResponse, built
+        # from two column queries. Segments and codes repeat across a page and
+        # are assembled once, then shared.
+        segments: dict[Any, Any] = {None: None}
+        elements = {}
+        rows = session.execute(
+            select(Element.element_id, Element.element_text, Segment.segment_id, Segment.segment_title, Series.series_id, Series.series_title)
+            .outerjoin(Segment, Segment.segment_id == Element.segment_id)
+            .outerjoin(Series, Series.series_id == Segment.series_id)
+            .where(Element.element_id.in_(element_ids))
+        )
+        for element_id, element_text, segment_id, segment_title, series_id, series_title in rows:
+            if segment_id not in segments:
+                series = {"series_id": series_id, "series_title": series_title} if series_id is not None else None
+                segments[segment_id] = {"segment_id": segment_id, "segment_title": segment_title, "series": series}
+            elements[element_id] = {
+                "element_id": element_id,
+                "element_text": element_text,
+                "segment": segments[segment_id],
+                "annotations": [],
+            }
+
+        codes: dict[int, Any] = {}
+        code_types: dict[Any, Any] = {None: None}
+        rows = session.execute(
+            select(
+                Annotation.element_id, Annotation.annotation_id,
+                Code.code_id, Code.term, Code.description, Code.type_id, Code.reference, Code.coordinates,
+                CodeType.type_name,
+            )
+            .outerjoin(Code, Code.code_id == Annotation.code_id)
+            .outerjoin(CodeType, CodeType.type_id == Code.type_id)
+            .where(Annotation.element_id.in_(element_ids))
+            .order_by(Annotation.annotation_id)
+        )
+        for element_id, annotation_id, code_id, term, description, type_id, reference, coordinates, type_name in rows:
+            if code_id not in codes:
+                if type_id not in code_types:
+                    code_types[type_id] = {"type_id": type_id, "type_name": type_name} if type_name is not None else None
+                codes[code_id] = {
+                    "code_id": code_id,
+                    "term": term,
+                    "description": description,
+                    "type_id": type_id,
+                    "code_type": code_types[type_id],
+                    "reference": reference,
+                    "coordinates": coordinates,
+                } if code_id is not None else None
+            elements[element_id]["annotations"].append({"annotation_id": annotation_id, "code": codes[code_id]})
+
+        return [elements[element_id] for element_id in element_ids if element_id in elements]
+
+    def _element_page(self, session: Any, element_ids: list[int]) -> dict[str, Any]:
+        # Elements reference their segment and codes by id; each referenced
+        # segment, series, code and code type is sent once in a side table
+        elements = {
+            element_id: {"element_id": element_id, "element_text": element_text, "segment_id": segment_id, "annotation_ids": [], "code_ids": []}
+            for element_id, element_text, segment_id in session.execute(
+                select(Element.element_id, Element.element_text, Element.segment_id).where(Element.element_id.in_(element_ids))
+            )
+        }
+        rows = session.execute(
+            select(Annotation.element_id, Annotation.annotation_id, Annotation.code_id)
+            .where(Annotation.element_id.in_(element_ids))
+            .order_by(Annotation.annotation_id)
+        )
+        for element_id, annotation_id, code_id in rows:
+            elements[element_id]["annotation_ids"].append(annotation_id)
+            elements[element_id]["code_ids"].append(code_id)
+
+        code_ids = {code_id for element in elements.values() for code_id in element["code_ids"]}
+        codes = {
+            code_id: {"code_id": code_id, "term": term, "description": description, "type_id": type_id, "reference": reference, "coordinates": coordinates}
+            for code_id, term, description, type_id, reference, coordinates in session.execute(
+                select(Code.code_id, Code.term, Code.description, Code.type_id, Code.reference, Code.coordinates).where(Code.code_id.in_(code_ids))
+            )
+        }
+        code_types = {
+            type_id: {"type_id": type_id, "type_name": type_name}
+            for type_id, type_name in session.execute(
+                select(CodeType.type_id, CodeType.type_name).where(CodeType.type_id.in_({code["type_id"] for code in codes.values()}))
+            )
+        }
+        segment_ids = {element["segment_id"] for element in elements.values()}
+        segments = {
+            segment_id: {"segment_id": segment_id, "segment_title": segment_title, "series_id": series_id}
+            for segment_id, segment_title, series_id in session.execute(
+                select(Segment.segment_id, Segment.segment_title, Segment.series_id).where(Segment.segment_id.in_(segment_ids))
+            )
+        }
+        series = {
+            series_id: {"series_id": series_id, "series_title": series_title}
+            for series_id, series_title in session.execute(
+                select(Series.series_id, Series.series_title).where(Series.series_id.in_({segment["series_id"] for segment in segments.values()}))
+            )
+        }
+        return {
+            "elements": [elements[element_id] for element_id in element_ids if element_id in elements],
+            "codes": codes,
+            "code_types": code_types,
+            "segments": segments,
+            "series": series,
+        }
+
+    def read_elements_keyset(self, cursor: Optional[str] = None, limit: int = 100, shape: str = "orm", session: Optional[Session] = None) -> tuple[Any, Optional[str]]:
+        # Keyset variant of read_elements_paginated, see search_elements_keyset
+        after = decode_cursor(cursor) if cursor else None
+        session = self._open(session)
+        try:
+            query = session.query(Element.element_id)
+            if after:
+                query = query.filter(Element.element_id > int(after[0]))
+            element_ids = [row[0] for row in query.order_by(Element.element_id).limit(limit + 1)]
+            next_cursor = None
+            if len(element_ids) > limit:
+                element_ids = element_ids[:limit]
+                next_cursor = encode_cursor([element_ids[-1]])
+            return self._load_elements(session, element_ids, shape), next_cursor
+        finally:
+            self._close(session)
+
+    def update_element(self, element_id: int, element_text: Optional[str] = None, segment_id: Optional[int] = None, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         element: Optional[Element] = session.query(Element).filter_by(element_id=element_id).first()
         if element:
             try:
                 if element_text:
                     element.element_text = element_text
-                if segment_id:
-                    element.segment_id = segment_id
-                session.commit()
+                if segment_id and segment_id != element.segment_id:
+                    # The element's code pairs move to the other segment
+                    with track_cooccurrences(session, [element_id]), track_code_usage(session, element_ids=[element_id]):
+                        element.segment_id = segment_id
+                self._commit(session)
             except IntegrityError:
                 session.rollback()
                 logger.error("Failed to update Element due to a unique constraint violation.")
-        session.close()
+        self._close(session)
     
-    def delete_element(self, element_id: int) -> None:
-        session = self.Session()
+    def delete_element(self, element_id: int, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         element: Optional[Element] = session.query(Element).filter_by(element_id=element_id).first()
         if element:
-            session.delete(element)
-            session.commit()
-        session.close()
+            # Annotations have no cascade, delete them first rather than
+            # leave them behind without an element
+            with track_cooccurrences(session, [element_id]), track_code_usage(session, element_ids=[element_id]):
+                self._delete_annotations(session, Annotation.element_id == element_id)
+                session.delete(element)
+            self._commit(session)
+        self._close(session)
 
     # Annotation CRUD
         
-    def create_annotation(self, element_id: int, code_id: int) -> Annotation | None:
-        session = self.Session()
+    def create_annotation(self, element_id: int, code_id: int, session: Optional[Session] = None) -> Annotation | None:
+        session = self._open(session)
         try:
             new_annotation = Annotation(element_id=element_id, code_id=code_id)
-            session.add(new_annotation)
-            session.commit()
+            with track_cooccurrences(session, [element_id]), track_code_usage(session, element_ids=[element_id]):
+                session.add(new_annotation)
+            self._commit(session)
+            annotations_created.inc()
             
             # Fetch the annotation with its related code and code_type
             result = (
@@ -390,101 +771,646 @@ class DatabaseManager:
             logger.error(f"Error creating annotation: {str(e)}")
             return None
         finally:
-            session.close()
+            self._close(session)
         
-    def read_annotation(self, annotation_id: int) -> Optional[Annotation]:
-        session = self.Session()
+    def read_annotation(self, annotation_id: int, session: Optional[Session] = None) -> Optional[Annotation]:
+        session = self._open(session)
         annotation: Optional[Annotation] = session.query(Annotation).filter_by(annotation_id=annotation_id).first()
-        session.close()
+        self._close(session)
         return annotation
     
-    def read_all_annotations(self) -> Optional[list[Annotation]]:
-        session = self.Session()
+    def read_all_annotations(self, session: Optional[Session] = None) -> Optional[list[Annotation]]:
+        session = self._open(session)
         annotations = session.query(Annotation).all()
-        session.close()
+        self._close(session)
         return annotations
     
-    def update_annotation(self, annotation_id: int, element_id: Optional[int] = None, code_id: Optional[int] = None) -> None:
-        session = self.Session()
+    def update_annotation(self, annotation_id: int, element_id: Optional[int] = None, code_id: Optional[int] = None, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         annotation: Optional[Annotation] = session.query(Annotation).filter_by(annotation_id=annotation_id).first()
         if annotation:
             try:
-                if element_id:
-                    annotation.element_id = element_id
-                if code_id:
-                    annotation.code_id = code_id
-                session.commit()
+                element_ids = {annotation.element_id, element_id or annotation.element_id}
+                with track_cooccurrences(session, element_ids), track_code_usage(session, element_ids=element_ids):
+                    if element_id:
+                        annotation.element_id = element_id
+                    if code_id:
+                        annotation.code_id = code_id
+                self._commit(session)
             except IntegrityError:
                 session.rollback()
                 logger.error("Failed to update Annotation due to a unique constraint violation.")
-        session.close()
+        self._close(session)
     
-    def delete_annotation(self, annotation_id: int) -> None:
-        session = self.Session()
+    def delete_annotation(self, annotation_id: int, session: Optional[Session] = None) -> None:
+        session = self._open(session)
         annotation: Optional[Annotation] = session.query(Annotation).filter_by(annotation_id=annotation_id).first()
         if annotation:
-            session.delete(annotation)
-            session.commit()
-        session.close()
+            with track_cooccurrences(session, [annotation.element_id]), track_code_usage(session, element_ids=[annotation.element_id]):
+                session.delete(annotation)
+            self._commit(session)
+            annotations_deleted.inc()
+        self._close(session)
 
-# Merge codes
+# Batch annotations
 
-    def merge_codes(self, code_a_id: int, code_b_id: int) -> Code | None:
-        session = self.Session()
+    def create_batch_annotations(self, element_ids: list[int], code_ids: list[int], session: Optional[Session] = None) -> list[Annotation]:
+        # Annotate every element with every code in one INSERT ... SELECT over the
+        # cross product. Pairs that already exist, or that point at a missing
+        # element or code, are skipped. Returns only the annotations created.
+        if not element_ids or not code_ids:
+            return []
+        session = self._open(session)
         try:
-            # Get both codes
-            code_a = session.query(Code).filter_by(code_id=code_a_id).first()
-            code_b = session.query(Code).filter_by(code_id=code_b_id).first()
+            pairs = (
+                select(Element.element_id, Code.code_id)
+                .select_from(Element)
+                .join(Code, true())
+                .where(Element.element_id.in_(set(element_ids)), Code.code_id.in_(set(code_ids)))
+            )
+            stmt = (
+                insert(Annotation)
+                .from_select(["element_id", "code_id"], pairs)
+                .on_conflict_do_nothing(index_elements=["element_id", "code_id"])
+                .returning(Annotation.annotation_id)
+            )
+            with track_cooccurrences(session, element_ids), track_code_usage(session, element_ids=element_ids):
+                annotation_ids = session.execute(stmt).scalars().all()
+            self._commit(session)
+            annotations_created.inc(len(annotation_ids))
+            annotation_batch_sizes["create"].observe(len(element_ids) * len(code_ids))
 
-            if not code_a or not code_b:
-                logger.error(f"One or both codes (ID: {code_a_id}, {code_b_id}) do not exist.")
-                return None
+            if not annotation_ids:
+                return []
+            return (
+                session.query(Annotation)
+                .options(joinedload(Annotation.code).joinedload(Code.code_type))
+                .filter(Annotation.annotation_id.in_(annotation_ids))
+                .order_by(Annotation.annotation_id)
+                .all()
+            )
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error creating batch annotations: {str(e)}")
+            raise
+        finally:
+            self._close(session)
 
-            # Get all annotations for code_a
-            annotations_a = session.query(Annotation).filter_by(code_id=code_a_id).all()
+    def delete_batch_annotations(self, element_ids: list[int], code_ids: list[int], session: Optional[Session] = None) -> list[Annotation]:
+        # Remove every (element, code) annotation in one DELETE and return the
+        # removed rows, with their codes loaded, as detached Annotation objects.
+        if not element_ids or not code_ids:
+            return []
+        session = self._open(session)
+        try:
+            stmt = (
+                delete(Annotation)
+                .where(Annotation.element_id.in_(set(element_ids)), Annotation.code_id.in_(set(code_ids)))
+                .returning(Annotation.annotation_id, Annotation.element_id, Annotation.code_id)
+                .execution_options(synchronize_session=False)
+            )
+            with track_cooccurrences(session, element_ids), track_code_usage(session, element_ids=element_ids):
+                rows = session.execute(stmt).all()
+            self._commit(session)
+            annotations_deleted.inc(len(rows))
+            annotation_batch_sizes["delete"].observe(len(element_ids) * len(code_ids))
 
-            for annotation in annotations_a:
-                # Check if there's already an annotation for this element with code_b
-                existing_annotation = session.query(Annotation).filter(
-                    and_(Annotation.element_id == annotation.element_id,
-                         Annotation.code_id == code_b_id)
-                ).first()
+            codes = {
+                code.code_id: code
+                for code in session.query(Code)
+                .options(joinedload(Code.code_type))
+                .filter(Code.code_id.in_({row.code_id for row in rows}))
+            }
+            return [
+                Annotation(
+                    annotation_id=row.annotation_id,
+                    element_id=row.element_id,
+                    code_id=row.code_id,
+                    code=codes.get(row.code_id),
+                )
+                for row in sorted(rows, key=lambda row: row.annotation_id)
+            ]
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error deleting batch annotations: {str(e)}")
+            raise
+        finally:
+            self._close(session)
 
-                if existing_annotation:
-                    # If there's already an annotation, delete the one for code_a
-                    session.delete(annotation)
-                else:
-                    # If there's no existing annotation, update this one to point to code_b
-                    annotation.code_id = code_b_id
+    def create_annotation_pairs(self, pairs: list[tuple[int, int]], session: Optional[Session] = None) -> int:
+        # Insert arbitrary (element_id, code_id) pairs with one executemany,
+        # skipping existing ones. Returns the number of annotations created.
+        pairs = sorted(set(pairs))
+        if not pairs:
+            return 0
+        session = self._open(session)
+        try:
+            stmt = (
+                insert(Annotation)
+                .on_conflict_do_nothing(index_elements=["element_id", "code_id"])
+                .returning(Annotation.annotation_id)
+            )
+            element_ids = [element_id for element_id, _ in pairs]
+            with track_cooccurrences(session, element_ids), track_code_usage(session, element_ids=element_ids):
+                created = len(session.execute(stmt, [{"element_id": element_id, "code_id": code_id} for element_id, code_id in pairs]).all())
+            self._commit(session)
+            annotations_created.inc(created)
+            annotation_batch_sizes["create"].observe(len(pairs))
+            return created
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error creating annotation pairs: {str(e)}")
+            raise
+        finally:
+            self._close(session)
 
-            # Delete code_a
-            session.delete(code_a)
+# Bulk writes
+#
+# bulk_elements, bulk_codes and bulk_segments take lists of creates (column
+# values), partial updates (the primary key and the columns to change) and
+# deletes (primary keys), and return a BulkReport summary with one result
+# per item. Checks run against the database up front; the items that pass
+# are written with one statement per kind, executemany for updates and
+# creates, all in one transaction.
 
-            session.commit()
-            logger.info(f"Successfully merged Code {code_a_id} into Code {code_b_id}")
+    def _bulk_write(self, session: Session, model: Any, creates: list[dict[str, Any]], updates: list[dict[str, Any]], deletes: list[int]) -> list[int]:
+        # Returns the primary keys of the created rows, in order
+        key = inspect(model).primary_key[0]
+        if deletes:
+            session.execute(delete(model).where(key.in_(deletes)).execution_options(synchronize_session=False))
+        # ORM bulk UPDATE by primary key, one executemany per set of columns
+        by_columns: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+        for row in updates:
+            if len(row) > 1:
+                by_columns.setdefault(tuple(sorted(row)), []).append(row)
+        for rows in by_columns.values():
+            session.execute(update(model), rows)
+        if not creates:
+            return []
+        return list(session.execute(insert(model).returning(key, sort_by_parameter_order=True), creates).scalars())
+
+    def _bulk_commit(self, session: Session, name: str, write: Callable[[], list[int]]) -> list[int]:
+        try:
+            created_ids = write()
+            self._commit(session)
+            return created_ids
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error in bulk {name} write: {str(e)}")
+            raise
+        finally:
+            self._close(session)
+
+    def _delete_annotations(self, session: Session, condition: Any) -> None:
+        stmt = delete(Annotation).where(condition).returning(Annotation.annotation_id).execution_options(synchronize_session=False)
+        annotations_deleted.inc(len(session.execute(stmt).all()))
+
+    def bulk_elements(self, creates: Optional[list[dict[str, Any]]] = None, updates: Optional[list[dict[str, Any]]] = None, deletes: Optional[list[int]] = None, session: Optional[Session] = None) -> dict[str, Any]:
+        session = self._open(session)
+        creates = creates or []
+        updates = [changes(row) for row in updates or []]
+        deletes = deletes or []
+        referenced = {row["element_id"] for row in updates} | set(deletes)
+        existing = set(session.execute(select(Element.element_id).where(Element.element_id.in_(referenced))).scalars())
+        segment_ids = {row["segment_id"] for row in [*creates, *updates] if row.get("segment_id") is not None}
+        segments = set(session.execute(select(Segment.segment_id).where(Segment.segment_id.in_(segment_ids))).scalars())
+        report = BulkReport("element_id")
+
+        def check(op: str, index: int, element_id: Optional[int], row: dict[str, Any]) -> bool:
+            if op != "create" and element_id not in existing:
+                return report.reject(op, index, element_id, "not_found", "Element not found")
+            if row.get("segment_id") is not None and row["segment_id"] not in segments:
+                return report.reject(op, index, element_id, "not_found", f"Segment {row['segment_id']} not found")
+            if op == "delete":
+                existing.discard(element_id)
+            return True
+
+        deleted = [(index, element_id) for index, element_id in enumerate(deletes) if check("delete", index, element_id, {})]
+        updated = [(index, row) for index, row in enumerate(updates) if check("update", index, row["element_id"], row)]
+        created = [(index, row) for index, row in enumerate(creates) if check("create", index, None, row)]
+        deleted_ids = [element_id for _, element_id in deleted]
+        # Deleted elements take their annotations with them, and an element
+        # moved to another segment moves its code pairs
+        moved_ids = [row["element_id"] for _, row in updated if "segment_id" in row]
+
+        def write() -> list[int]:
+            with track_cooccurrences(session, deleted_ids + moved_ids), track_code_usage(session, element_ids=deleted_ids + moved_ids):
+                if deleted_ids:
+                    self._delete_annotations(session, Annotation.element_id.in_(deleted_ids))
+                return self._bulk_write(session, Element, [row for _, row in created], [row for _, row in updated], deleted_ids)
+
+        return report.done(deleted, updated, created, self._bulk_commit(session, "element", write))
+
+    def bulk_codes(self, creates: Optional[list[dict[str, Any]]] = None, updates: Optional[list[dict[str, Any]]] = None, deletes: Optional[list[int]] = None, session: Optional[Session] = None) -> dict[str, Any]:
+        session = self._open(session)
+        creates = creates or []
+        updates = [changes(row) for row in updates or []]
+        deletes = deletes or []
+        referenced = {row["code_id"] for row in updates} | set(deletes)
+        existing = set(session.execute(select(Code.code_id).where(Code.code_id.in_(referenced))).scalars())
+        type_ids = {row["type_id"] for row in [*creates, *updates] if row.get("type_id") is not None}
+        code_types = set(session.execute(select(CodeType.type_id).where(CodeType.type_id.in_(type_ids))).scalars())
+        terms = {row["term"] for row in [*creates, *updates] if "term" in row}
+        taken = UniqueValues(session.execute(select(Code.term, Code.code_id).where(or_(Code.term.in_(terms), Code.code_id.in_(referenced)))).tuples())
+        report = BulkReport("code_id")
+
+        def check(op: str, index: int, code_id: Optional[int], row: dict[str, Any]) -> bool:
+            if op != "create" and code_id not in existing:
+                return report.reject(op, index, code_id, "not_found", "Code not found")
+            if row.get("type_id") is not None and row["type_id"] not in code_types:
+                return report.reject(op, index, code_id, "not_found", f"Code type {row['type_id']} not found")
+            # Creates hold their term by position until they have an id
+            if "term" in row and not taken.claim(code_id or ("create", index), row["term"]):
+                return report.reject(op, index, code_id, "conflict", f"Code with term {row['term']!r} already exists")
+            if op == "delete":
+                taken.release(code_id)
+                existing.discard(code_id)
+            return True
+
+        deleted = [(index, code_id) for index, code_id in enumerate(deletes) if check("delete", index, code_id, {})]
+        updated = [(index, row) for index, row in enumerate(updates) if check("update", index, row["code_id"], row)]
+        created = [(index, row) for index, row in enumerate(creates) if check("create", index, None, row)]
+        deleted_ids = [code_id for _, code_id in deleted]
+
+        def write() -> list[int]:
+            element_ids: list[int] = []
+            if deleted_ids:
+                element_ids = list(session.execute(select(Annotation.element_id).where(Annotation.code_id.in_(deleted_ids)).distinct()).scalars())
+            with track_cooccurrences(session, element_ids), track_code_usage(session, deleted_ids):
+                if deleted_ids:
+                    self._delete_annotations(session, Annotation.code_id.in_(deleted_ids))
+                created_ids = self._bulk_write(session, Code, [row for _, row in created], [row for _, row in updated], deleted_ids)
+                refresh_code_usage(session, created_ids)
+                return created_ids
+
+        return report.done(deleted, updated, created, self._bulk_commit(session, "code", write))
+
+    def bulk_segments(self, creates: Optional[list[dict[str, Any]]] = None, updates: Optional[list[dict[str, Any]]] = None, deletes: Optional[list[int]] = None, session: Optional[Session] = None) -> dict[str, Any]:
+        # segment_id has no autoincrement: creates without one get the next
+        # free id. A segment that still has elements is not deleted.
+        session = self._open(session)
+        creates = creates or []
+        updates = [changes(row) for row in updates or []]
+        deletes = deletes or []
+        referenced = {row["segment_id"] for row in [*creates, *updates] if row.get("segment_id") is not None} | set(deletes)
+        existing = set(session.execute(select(Segment.segment_id).where(Segment.segment_id.in_(referenced))).scalars())
+        in_use = set(session.execute(select(Element.segment_id).where(Element.segment_id.in_(deletes)).distinct()).scalars())
+        series_ids = {row["series_id"] for row in [*creates, *updates] if row.get("series_id") is not None}
+        series = set(session.execute(select(Series.series_id).where(Series.series_id.in_(series_ids))).scalars())
+        titles = {row["segment_title"] for row in [*creates, *updates] if "segment_title" in row}
+        taken = UniqueValues(session.execute(select(Segment.segment_title, Segment.segment_id).where(or_(Segment.segment_title.in_(titles), Segment.segment_id.in_(referenced)))).tuples())
+        next_id = (session.execute(select(func.max(Segment.segment_id))).scalar() or 0) + 1
+        report = BulkReport("segment_id")
+
+        def check(op: str, index: int, segment_id: Optional[int], row: dict[str, Any]) -> bool:
+            if op == "create" and segment_id in existing:
+                return report.reject(op, index, segment_id, "conflict", f"Segment {segment_id} already exists")
+            if op != "create" and segment_id not in existing:
+                return report.reject(op, index, segment_id, "not_found", "Segment not found")
+            if op == "delete" and segment_id in in_use:
+                return report.reject(op, index, segment_id, "conflict", "Segment still has elements")
+            if row.get("series_id") is not None and row["series_id"] not in series:
+                return report.reject(op, index, segment_id, "not_found", f"Series {row['series_id']} not found")
+            if "segment_title" in row and not taken.claim(segment_id, row["segment_title"]):
+                return report.reject(op, index, segment_id, "conflict", f"Segment with title {row['segment_title']!r} already exists")
+            if op == "delete":
+                taken.release(segment_id)
+                existing.discard(segment_id)
+            if op == "create":
+                existing.add(segment_id)
+            return True
+
+        deleted = [(index, segment_id) for index, segment_id in enumerate(deletes) if check("delete", index, segment_id, {})]
+        updated = [(index, row) for index, row in enumerate(updates) if check("update", index, row["segment_id"], row)]
+        created = []
+        for index, row in enumerate(creates):
+            if row.get("segment_id") is None:
+                while next_id in existing:
+                    next_id += 1
+                row = {**row, "segment_id": next_id}
+            if check("create", index, row["segment_id"], row):
+                created.append((index, row))
+        deleted_ids = [segment_id for _, segment_id in deleted]
+        # Codes used in a segment moved to another series change series counts
+        moved_ids = [row["segment_id"] for _, row in updated if "series_id" in row]
+
+        def write() -> list[int]:
+            code_ids: list[int] = []
+            if moved_ids:
+                code_ids = list(session.execute(
+                    select(Annotation.code_id).join(Element, Element.element_id == Annotation.element_id).where(Element.segment_id.in_(moved_ids)).distinct()
+                ).scalars())
+            with track_code_usage(session, code_ids):
+                return self._bulk_write(session, Segment, [row for _, row in created], [row for _, row in updated], deleted_ids)
+
+        return report.done(deleted, updated, created, self._bulk_commit(session, "segment", write))
+
+# Autoannotation jobs
+
+    def create_autoannotation_job(self, model: str, element_ids: list[int], code_ids: list[int], batch_size: int, session: Optional[Session] = None) -> AutoannotationJob:
+        session = self._open(session)
+        try:
+            job = AutoannotationJob(
+                model=model,
+                element_ids=json.dumps(element_ids),
+                code_ids=json.dumps(code_ids),
+                batch_size=batch_size,
+                status="queued",
+                created_at=datetime.datetime.now(datetime.timezone.utc),
+            )
+            session.add(job)
+            self._commit(session)
+            session.refresh(job)
+            return job
+        finally:
+            self._close(session)
+
+    def read_autoannotation_job(self, job_id: int, session: Optional[Session] = None) -> Optional[AutoannotationJob]:
+        session = self._open(session)
+        job: Optional[AutoannotationJob] = session.query(AutoannotationJob).filter_by(job_id=job_id).first()
+        self._close(session)
+        return job
+
+    def read_all_autoannotation_jobs(self, session: Optional[Session] = None) -> list[AutoannotationJob]:
+        session = self._open(session)
+        jobs = session.query(AutoannotationJob).order_by(AutoannotationJob.job_id.desc()).all()
+        self._close(session)
+        return jobs
+
+    def count_autoannotation_jobs(self, session: Optional[Session] = None) -> dict[str, int]:
+        # Number of jobs per status
+        session = self._open(session)
+        rows = session.execute(select(AutoannotationJob.status, func.count()).group_by(AutoannotationJob.status)).all()
+        self._close(session)
+        return {status: count for status, count in rows}
+
+    def update_autoannotation_job(self, job_id: int, session: Optional[Session] = None, from_statuses: Optional[list[str]] = None, **values: Any) -> bool:
+        # With from_statuses, only a job in one of those statuses is updated.
+        # Returns whether the job was updated.
+        session = self._open(session)
+        try:
+            stmt = update(AutoannotationJob).where(AutoannotationJob.job_id == job_id)
+            if from_statuses is not None:
+                stmt = stmt.where(AutoannotationJob.status.in_(from_statuses))
+            updated = session.execute(stmt.values(**values).returning(AutoannotationJob.job_id)).first() is not None
+            self._commit(session)
+            return updated
+        finally:
+            self._close(session)
 
-            return code_b
+    def add_autoannotation_progress(self, job_id: int, session: Optional[Session] = None, **increments: Any) -> None:
+        # Atomically add to counters such as processed_elements or cost, so
+        # concurrent batches of one job do not overwrite each other
+        session = self._open(session)
+        try:
+            values = {name: getattr(AutoannotationJob, name) + amount for name, amount in increments.items()}
+            session.execute(update(AutoannotationJob).where(AutoannotationJob.job_id == job_id).values(**values))
+            self._commit(session)
+        finally:
+            self._close(session)
+
+    def read_prompt_cache(self, keys: list[str], session: Optional[Session] = None) -> dict[str, list[int]]:
+        session = self._open(session)
+        try:
+            found = read_cache(session, keys)
+            self._commit(session)
+            return found
+        finally:
+            self._close(session)
+
+    def write_prompt_cache(self, entries: dict[str, list[int]], max_entries: int = DEFAULT_MAX_ENTRIES, session: Optional[Session] = None) -> None:
+        session = self._open(session)
+        try:
+            write_cache(session, entries, max_entries)
+            self._commit(session)
+        finally:
+            self._close(session)
+
+    def read_element_ids(self, session: Optional[Session] = None) -> list[int]:
+        session = self._open(session)
+        try:
+            return list(session.execute(select(Element.element_id).order_by(Element.element_id)).scalars())
+        finally:
+            self._close(session)
+
+    def read_element_texts(self, element_ids: list[int], session: Optional[Session] = None) -> list[tuple[int, str]]:
+        # (element_id, element_text) without loading segments or annotations
+        session = self._open(session)
+        try:
+            rows = session.execute(
+                select(Element.element_id, Element.element_text)
+                .where(Element.element_id.in_(element_ids))
+                .order_by(Element.element_id)
+            )
+            return [(element_id, element_text) for element_id, element_text in rows]
+        finally:
+            self._close(session)
+
+    def read_code_terms(self, code_ids: Optional[list[int]] = None, session: Optional[Session] = None) -> list[tuple[int, str, Optional[str]]]:
+        # (code_id, term, description) of the given codes, or of all codes
+        session = self._open(session)
+        try:
+            query = select(Code.code_id, Code.term, Code.description).order_by(Code.code_id)
+            if code_ids:
+                query = query.where(Code.code_id.in_(code_ids))
+            return [(code_id, term, description) for code_id, term, description in session.execute(query)]
+        finally:
+            self._close(session)
+
+# Merge codes
+
+    def merge_codes(self, code_a_id: int, code_b_id: int, session: Optional[Session] = None) -> Code | None:
+        return self.merge_codes_batch([code_a_id], code_b_id, session)
+
+    def merge_codes_batch(self, source_code_ids: list[int], target_code_id: int, session: Optional[Session] = None) -> Code | None:
+        # Fold all source codes into the target with set-based statements in one
+        # transaction: drop source annotations that would duplicate a target
+        # annotation or another source annotation on the same element, repoint
+        # the rest to the target, then delete the source codes.
+        source_code_ids = sorted(set(source_code_ids) - {target_code_id})
+        session = self._open(session)
+        try:
+            target_code = session.query(Code).filter_by(code_id=target_code_id).first()
+            found = session.execute(select(Code.code_id).where(Code.code_id.in_(source_code_ids))).scalars().all()
+
+            if not target_code or not source_code_ids or len(found) != len(source_code_ids):
+                logger.error(f"Cannot merge codes {source_code_ids} into {target_code_id}: a code does not exist or there is nothing to merge.")
+                return None
+
+            element_ids = session.execute(
+                select(Annotation.element_id).where(Annotation.code_id.in_(source_code_ids))
+            ).scalars().all()
+
+            with track_cooccurrences(session, element_ids), track_code_usage(session, source_code_ids, element_ids):
+                other = aliased(Annotation)
+                duplicates = or_(
+                    Annotation.element_id.in_(select(other.element_id).where(other.code_id == target_code_id)),
+                    select(other.annotation_id)
+                    .where(
+                        other.element_id == Annotation.element_id,
+                        other.code_id.in_(source_code_ids),
+                        other.annotation_id < Annotation.annotation_id,
+                    )
+                    .exists(),
+                )
+                duplicates_deleted = len(session.execute(
+                    delete(Annotation)
+                    .where(Annotation.code_id.in_(source_code_ids), duplicates)
+                    .returning(Annotation.annotation_id)
+                    .execution_options(synchronize_session=False)
+                ).all())
+                session.execute(
+                    update(Annotation)
+                    .where(Annotation.code_id.in_(source_code_ids))
+                    .values(code_id=target_code_id)
+                    .execution_options(synchronize_session=False)
+                )
+                session.execute(
+                    delete(Code)
+                    .where(Code.code_id.in_(source_code_ids))
+                    .execution_options(synchronize_session=False)
+                )
+
+            self._commit(session)
+            annotations_deleted.inc(duplicates_deleted)
+            logger.info(f"Successfully merged Codes {source_code_ids} into Code {target_code_id}")
+
+            return (
+                session.query(Code)
+                .options(joinedload(Code.code_type))
+                .filter_by(code_id=target_code_id)
+                .first()
+            )
         except Exception as e:
             session.rollback()
             logger.error(f"Failed to merge codes: {str(e)}")
             return None
         finally:
-            session.close()
+            self._close(session)
+
+# Code co-occurrence
+
+    def rebuild_cooccurrences(self) -> None:
+        with self.engine.begin() as connection:
+            rebuild_cooccurrences(connection)
+
+    def read_cooccurrences(self, min_count: int = 1, series_ids: Optional[list[int]] = None, segment_ids: Optional[list[int]] = None, limit: int = 1000, session: Optional[Session] = None) -> list[Any]:
+        session = self._open(session)
+        try:
+            return read_cooccurrences(session, min_count, series_ids, segment_ids, limit)
+        finally:
+            self._close(session)
+
+# Code usage
+
+    def rebuild_code_usage(self) -> None:
+        with self.engine.begin() as connection:
+            rebuild_code_usage(connection)
+
+    def read_codes_by_usage(self, sort: str = "annotations", descending: bool = True, min_annotations: Optional[int] = None, max_annotations: Optional[int] = None, type_ids: Optional[list[int]] = None, skip: int = 0, limit: int = 100, session: Optional[Session] = None) -> list[Code]:
+        # A page of codes ordered by one of the USAGE_COLUMNS, walking its
+        # index instead of grouping annotations
+        column = USAGE_COLUMNS[sort]
+        session = self._open(session)
+        try:
+            query = (
+                session.query(Code)
+                .join(Code.usage)
+                .options(contains_eager(Code.usage), joinedload(Code.code_type))
+            )
+            if min_annotations is not None:
+                query = query.filter(CodeUsage.annotation_count >= min_annotations)
+            if max_annotations is not None:
+                query = query.filter(CodeUsage.annotation_count <= max_annotations)
+            if type_ids:
+                query = query.filter(Code.type_id.in_(type_ids))
+            order = [column.desc(), CodeUsage.code_id.desc()] if descending else [column, CodeUsage.code_id]
+            return query.order_by(*order).offset(skip).limit(limit).all()
+        finally:
+            self._close(session)
+
+# Code search
+
+    def search_codes(self, search_term: str = "", search_mode: str = "prefix", fields: str = "all", type_ids: Optional[list[int]] = None, cursor: Optional[str] = None, limit: int = 20, shape: str = "orm", session: Optional[Session] = None) -> tuple[Any, Optional[str]]:
+        # Typeahead over the codebook with keyset pagination.
+        #   prefix: every word of the term starts some word of the code, in
+        #     any order; results are listed by term
+        #   fuzzy: codes sharing three-character windows with the term, best
+        #     match first; terms under three characters fall back to prefix
+        # fields is "term" or "all" (term and description). shape "compact"
+        # returns only code_id and term, without loading codes and code types.
+        # Raises ValueError for a cursor that does not fit the search.
+        after = decode_cursor(cursor) if cursor else None
+        column_filter = "{term} : " if fields == "term" else ""
+        fuzzy = search_mode == "fuzzy" and CODES_TRIGRAM_TABLE in self.code_search and bool(to_trigram_query(search_term))
+        session = self._open(session)
+        try:
+            fts: ColumnClause[Any]
+            if fuzzy:
+                fts = literal_column(CODES_TRIGRAM_TABLE)
+                # Term matches weigh ten times description matches
+                rank = func.bm25(fts, 10.0, 1.0)
+                query = (
+                    select(Code.code_id, Code.term, rank)
+                    .join(codes_trigram, codes_trigram.c.rowid == Code.code_id)
+                    .where(fts.op("MATCH")(f"{column_filter}({to_trigram_query(search_term)})"))
+                )
+                if after:
+                    if len(after) != 2:
+                        raise ValueError(f"Invalid cursor for fuzzy search: {cursor}")
+                    last_rank, last_id = float(after[0]), int(after[1])
+                    query = query.where(or_(rank > last_rank, and_(rank == last_rank, Code.code_id > last_id)))
+                query = query.order_by(rank, Code.code_id)
+            else:
+                query = select(Code.code_id, Code.term)
+                fulltext_query = to_fulltext_query(search_term)
+                if fulltext_query and CODES_FTS_TABLE in self.code_search:
+                    fts = literal_column(CODES_FTS_TABLE)
+                    query = query.where(Code.code_id.in_(select(codes_fts.c.rowid).where(fts.op("MATCH")(f"{column_filter}({fulltext_query})"))))
+                elif search_term.strip():
+                    pattern = func.lower(f"{search_term.strip()}%")
+                    condition: ColumnElement[bool] = func.lower(Code.term).like(pattern)
+                    if fields != "term":
+                        condition = or_(condition, func.lower(Code.description).like(func.lower(f"%{search_term.strip()}%")))
+                    query = query.where(condition)
+                if after:
+                    if len(after) != 2:
+                        raise ValueError(f"Invalid cursor for prefix search: {cursor}")
+                    last_term, last_id = str(after[0]), int(after[1])
+                    query = query.where(or_(Code.term > last_term, and_(Code.term == last_term, Code.code_id > last_id)))
+                query = query.order_by(Code.term, Code.code_id)
+            if type_ids:
+                query = query.where(Code.type_id.in_(type_ids))
+
+            rows = session.execute(query.limit(limit + 1)).all()
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor([rows[-1][2], rows[-1][0]] if fuzzy else [rows[-1][1], rows[-1][0]])
+            if shape == "compact":
+                return [{"code_id": row[0], "term": row[1]} for row in rows], next_cursor
+            codes = {
+                code.code_id: code
+                for code in session.query(Code).options(joinedload(Code.code_type)).filter(Code.code_id.in_([row[0] for row in rows]))
+            }
+            return [codes[row[0]] for row in rows], next_cursor
+        finally:
+            self._close(session)
 
 # Get annotations for code
 
-    def get_annotations_for_code(self, code_id: int) -> list[Annotation]:
-        session = self.Session()
+    def get_annotations_for_code(self, code_id: int, session: Optional[Session] = None) -> list[Annotation]:
+        session = self._open(session)
         try:
             annotations = session.query(Annotation).filter_by(code_id=code_id).all()
             return annotations
         finally:
-            session.close()
+            self._close(session)
 
 # Get codes for element
 
-    def get_codes_for_element(self, element_id: int) -> list[Code]:
-        session = self.Session()
+    def get_codes_for_element(self, element_id: int, session: Optional[Session] = None) -> list[Code]:
+        session = self._open(session)
         try:
             codes = (
                 session.query(Code)
@@ -494,10 +1420,10 @@ class DatabaseManager:
             )
             return codes
         finally:
-            session.close()
+            self._close(session)
 
-    def get_annotations_for_element_and_code(self, element_id: int, code_id: int) -> list[Annotation]:
-        session = self.Session()
+    def get_annotations_for_element_and_code(self, element_id: int, code_id: int, session: Optional[Session] = None) -> list[Annotation]:
+        session = self._open(session)
         try:
             annotations = (
                 session.query(Annotation)
@@ -507,61 +1433,195 @@ class DatabaseManager:
             )
             return annotations
         finally:
-            session.close()
+            self._close(session)
 
 # Search elements by string
 
-    def search_elements(self, search_term: str, series_ids: list[int] = [], segment_ids: list[int] = [], code_ids: list[int] = [], skip: int = 0, limit: int = 100) -> Optional[list[Element]]:
-        session = self.Session()
+    def _use_fulltext(self, search_term: str, search_mode: str) -> bool:
+        # Terms without any word characters cannot be matched by FTS5
+        return search_mode == "fulltext" and self.fulltext_enabled and bool(to_fulltext_query(search_term))
+
+    def _filter_elements(self, query: Any, search_term: str, series_ids: list[int], segment_ids: list[int], code_ids: list[int], search_mode: str) -> Any:
+        if search_term:
+            if self._use_fulltext(search_term, search_mode):
+                match = literal_column(ELEMENTS_FTS_TABLE).op("MATCH")(to_fulltext_query(search_term))
+                query = query.filter(Element.element_id.in_(select(elements_fts.c.rowid).where(match)))
+            else:
+                query = query.filter(func.lower(Element.element_text).like(func.lower(f"%{search_term}%")))
+
+        if series_ids:
+            query = query.filter(Series.series_id.in_(series_ids))
+        if segment_ids:
+            query = query.filter(Segment.segment_id.in_(segment_ids))
+        if code_ids:
+            # A subquery rather than a join keeps one row per element
+            query = query.filter(Element.element_id.in_(select(Annotation.element_id).where(Annotation.code_id.in_(code_ids))))
+        return query
+
+    def search_elements(self, search_term: str, series_ids: list[int] = [], segment_ids: list[int] = [], code_ids: list[int] = [], skip: int = 0, limit: int = 100, search_mode: str = "like", order_by: str = "element_id", shape: str = "orm", session: Optional[Session] = None) -> Optional[Any]:
+        session = self._open(session)
         try:
             query = (
-                session.query(Element)
+                session.query(Element.element_id)
                 .join(Element.segment)
                 .join(Segment.series)
-                .outerjoin(Element.annotations)
             )
 
-            if search_term:
-                query = query.filter(func.lower(Element.element_text).like(func.lower(f"%{search_term}%")))
-
-            if series_ids:
-                query = query.filter(Series.series_id.in_(series_ids))
-            if segment_ids:
-                query = query.filter(Segment.segment_id.in_(segment_ids))
-            if code_ids:
-                query = query.filter(Annotation.code_id.in_(code_ids))
-
-            elements = (
-                query.options(
-                    joinedload(Element.segment).joinedload(Segment.series),
-                    joinedload(Element.annotations).joinedload(Annotation.code).joinedload(Code.code_type)
+            if order_by == "rank" and self._use_fulltext(search_term, search_mode):
+                # bm25 scores are negative, lower is a better match
+                fts: ColumnClause[Any] = literal_column(ELEMENTS_FTS_TABLE)
+                query = (
+                    query.join(elements_fts, elements_fts.c.rowid == Element.element_id)
+                    .filter(fts.op("MATCH")(to_fulltext_query(search_term)))
+                    .order_by(func.bm25(fts), Element.element_id)
                 )
-                .offset(skip)
-                .limit(limit)
-                .all()
-            )
-            return elements
+                query = self._filter_elements(query, "", series_ids, segment_ids, code_ids, search_mode)
+            else:
+                query = self._filter_elements(query, search_term, series_ids, segment_ids, code_ids, search_mode)
+                query = query.order_by(Element.element_id)
+
+            # Page over ids first, then load just that page
+            element_ids = [row[0] for row in query.offset(skip).limit(limit)]
+            return self._load_elements(session, element_ids, shape)
         except Exception as e:
             logger.error(f"Error searching elements: {str(e)}")
             return None
         finally:
-            session.close()
+            self._close(session)
 
-    def count_elements(self, search_term: str, series_ids: list[int] = [], segment_ids: list[int] = [], code_ids: list[int] = []) -> int:
-        session = self.Session()
+    def search_elements_keyset(self, search_term: str, series_ids: list[int] = [], segment_ids: list[int] = [], code_ids: list[int] = [], cursor: Optional[str] = None, limit: int = 100, search_mode: str = "like", order_by: str = "element_id", shape: str = "orm", session: Optional[Session] = None) -> tuple[Any, Optional[str]]:
+        # Keyset pagination: the cursor holds the sort key of the last element
+        # on the previous page, so every page is a seek instead of an OFFSET scan.
+        # The limit is applied to element ids before eager loading annotations.
+        # Raises ValueError for a cursor that does not fit the requested order.
+        after = decode_cursor(cursor) if cursor else None
+        ranked = order_by == "rank" and self._use_fulltext(search_term, search_mode)
+        session = self._open(session)
         try:
-            query = session.query(func.count(Element.element_id)).join(Element.segment).join(Segment.series).outerjoin(Element.annotations)
+            if ranked:
+                fts: ColumnClause[Any] = literal_column(ELEMENTS_FTS_TABLE)
+                rank = func.bm25(fts)
+                query = (
+                    session.query(Element.element_id, rank)
+                    .join(elements_fts, elements_fts.c.rowid == Element.element_id)
+                    .filter(fts.op("MATCH")(to_fulltext_query(search_term)))
+                    .join(Element.segment)
+                    .join(Segment.series)
+                )
+                query = self._filter_elements(query, "", series_ids, segment_ids, code_ids, search_mode)
+                if after:
+                    if len(after) != 2:
+                        raise ValueError(f"Invalid cursor for rank order: {cursor}")
+                    last_rank, last_id = float(after[0]), int(after[1])
+                    query = query.filter(or_(rank > last_rank, and_(rank == last_rank, Element.element_id > last_id)))
+                query = query.order_by(rank, Element.element_id)
+            else:
+                query = session.query(Element.element_id).join(Element.segment).join(Segment.series)
+                query = self._filter_elements(query, search_term, series_ids, segment_ids, code_ids, search_mode)
+                if after:
+                    if len(after) != 1:
+                        raise ValueError(f"Invalid cursor for element_id order: {cursor}")
+                    query = query.filter(Element.element_id > int(after[0]))
+                query = query.order_by(Element.element_id)
 
-            if search_term:
-                query = query.filter(func.lower(Element.element_text).like(func.lower(f"%{search_term}%")))
+            rows = query.limit(limit + 1).all()
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor([rows[-1][1], rows[-1][0]] if ranked else [rows[-1][0]])
+            elements = self._load_elements(session, [row[0] for row in rows], shape)
+            return elements, next_cursor
+        finally:
+            self._close(session)
 
-            if series_ids:
-                query = query.filter(Series.series_id.in_(series_ids))
-            if segment_ids:
-                query = query.filter(Segment.segment_id.in_(segment_ids))
-            if code_ids:
-                query = query.filter(Annotation.code_id.in_(code_ids))
+    def count_facets(self, search_term: str, series_ids: list[int] = [], segment_ids: list[int] = [], code_ids: list[int] = [], search_mode: str = "like", facets: list[str] = list(FACETS), session: Optional[Session] = None) -> dict[str, Any]:
+        # Total and per series, segment and code element counts for a search,
+        # in one query: the matching elements are materialized once and every
+        # facet is a GROUP BY over that set
+        session = self._open(session)
+        try:
+            matched_query = select(Element.element_id, Element.segment_id, Segment.series_id).join(Element.segment).join(Segment.series)
+            matched_query = self._filter_elements(matched_query, search_term, series_ids, segment_ids, code_ids, search_mode)
+            matched = matched_query.cte("matched").prefix_with("MATERIALIZED")
+
+            parts = [select(literal("total"), null(), func.count()).select_from(matched)]
+            if "series" in facets:
+                parts.append(select(literal("series"), matched.c.series_id, func.count()).group_by(matched.c.series_id))
+            if "segment" in facets:
+                parts.append(select(literal("segment"), matched.c.segment_id, func.count()).group_by(matched.c.segment_id))
+            if "code" in facets:
+                parts.append(
+                    select(literal("code"), Annotation.code_id, func.count())
+                    .select_from(matched)
+                    .join(Annotation, Annotation.element_id == matched.c.element_id)
+                    .group_by(Annotation.code_id)
+                )
+
+            result: dict[str, Any] = {"total": 0, **{facet: {} for facet in facets}}
+            for facet, key, count in session.execute(union_all(*parts)):
+                if facet == "total":
+                    result["total"] = count
+                else:
+                    result[facet][key] = count
+            return result
+        finally:
+            self._close(session)
+
+    def count_elements(self, search_term: str, series_ids: list[int] = [], segment_ids: list[int] = [], code_ids: list[int] = [], search_mode: str = "like", session: Optional[Session] = None) -> int:
+        session = self._open(session)
+        try:
+            query = session.query(func.count(Element.element_id)).join(Element.segment).join(Segment.series)
+
+            query = self._filter_elements(query, search_term, series_ids, segment_ids, code_ids, search_mode)
 
             return query.scalar()
+        finally:
+            self._close(session)
+
+# Streaming dumps
+
+    def stream_elements(self, search_term: str = "", series_ids: list[int] = [], segment_ids: list[int] = [], code_ids: list[int] = [], search_mode: str = "like", batch_size: int = 1000) -> Iterator[dict[str, Any]]:
+        # Matching elements as plain dicts, fetched batch_size rows at a time
+        # on a session of their own, which stays open until the caller has
+        # consumed or closed the iterator
+        element_code_ids = (
+            select(func.group_concat(Annotation.code_id))
+            .where(Annotation.element_id == Element.element_id)
+            .scalar_subquery()
+        )
+        query = (
+            select(Element.element_id, Element.element_text, Element.segment_id, Segment.series_id, element_code_ids)
+            .join(Element.segment)
+            .join(Segment.series)
+        )
+        query = self._filter_elements(query, search_term, series_ids, segment_ids, code_ids, search_mode)
+        session = self.Session()
+        try:
+            rows = session.execute(query.order_by(Element.element_id).execution_options(yield_per=batch_size))
+            for element_id, element_text, segment_id, series_id, annotated in rows:
+                yield {
+                    "element_id": element_id,
+                    "element_text": element_text,
+                    "segment_id": segment_id,
+                    "series_id": series_id,
+                    "code_ids": sorted(int(code_id) for code_id in annotated.split(",")) if annotated else [],
+                }
+        finally:
+            session.close()
+
+    def stream_annotations(self, search_term: str = "", series_ids: list[int] = [], segment_ids: list[int] = [], code_ids: list[int] = [], search_mode: str = "like", batch_size: int = 1000) -> Iterator[dict[str, Any]]:
+        # Annotations of the matching elements, limited to code_ids when given
+        query = select(Annotation.annotation_id, Annotation.element_id, Annotation.code_id)
+        if search_term or series_ids or segment_ids:
+            elements = select(Element.element_id).join(Element.segment).join(Segment.series)
+            elements = self._filter_elements(elements, search_term, series_ids, segment_ids, [], search_mode)
+            query = query.where(Annotation.element_id.in_(elements))
+        if code_ids:
+            query = query.where(Annotation.code_id.in_(code_ids))
+        session = self.Session()
+        try:
+            rows = session.execute(query.order_by(Annotation.annotation_id).execution_options(yield_per=batch_size))
+            for annotation_id, element_id, code_id in rows:
+                yield {"annotation_id": annotation_id, "element_id": element_id, "code_id": code_id}
         finally:
             session.close()
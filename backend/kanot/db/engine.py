@@ -0,0 +1,118 @@
+import os
+import time
+from typing import Any, Mapping, Optional
+
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, PoolProxiedConnection, QueuePool
+
+from ..instrumentation import pool_checkout_wait
+
+DEFAULT_DATABASE_URL = "sqlite:///local_database.db"
+
+# Starlette runs sync endpoints on a threadpool of 40 threads per uvicorn
+# worker, so one worker can hold up to 40 connections at once
+THREADPOOL_SIZE = 40
+
+# Defaults for a concurrent annotation workload: WAL lets readers proceed
+# while an annotation is written, NORMAL sync is safe with WAL, and
+# busy_timeout makes writers wait for the lock instead of failing with
+# "database is locked"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": "-65536",  # KiB, 64 MiB
+    "mmap_size": "268435456",  # 256 MiB
+    "temp_store": "MEMORY",
+    "busy_timeout": "5000",  # ms
+}
+
+# Async drivers for the sync URL schemes, used by the async endpoints
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+class TimedQueuePool(QueuePool):
+    # Records how long each checkout waited for a free connection, including
+    # opening a new one
+    def connect(self) -> PoolProxiedConnection:
+        start = time.perf_counter()
+        connection = super().connect()
+        pool_checkout_wait.observe(time.perf_counter() - start)
+        return connection
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    def connect(self) -> PoolProxiedConnection:
+        start = time.perf_counter()
+        connection = super().connect()
+        pool_checkout_wait.observe(time.perf_counter() - start)
+        return connection
+
+def database_url(environ: Mapping[str, str] = os.environ) -> str:
+    return environ.get("KANOT_DATABASE_URL", DEFAULT_DATABASE_URL)
+
+def sqlite_pragmas(environ: Mapping[str, str] = os.environ) -> dict[str, str]:
+    # Each pragma can be overridden with KANOT_SQLITE_<NAME>, e.g. KANOT_SQLITE_CACHE_SIZE
+    return {
+        name: environ.get(f"KANOT_SQLITE_{name.upper()}", value)
+        for name, value in SQLITE_PRAGMAS.items()
+    }
+
+def pool_options(environ: Mapping[str, str] = os.environ) -> dict[str, Any]:
+    pool_size = int(environ.get("KANOT_DB_POOL_SIZE", 10))
+    return {
+        "pool_size": pool_size,
+        "max_overflow": int(environ.get("KANOT_DB_MAX_OVERFLOW", max(THREADPOOL_SIZE - pool_size, 0))),
+        "pool_timeout": float(environ.get("KANOT_DB_POOL_TIMEOUT", 30)),
+        "poolclass": TimedQueuePool,
+    }
+
+def create_database_engine(url: Optional[str] = None, environ: Mapping[str, str] = os.environ, **kwargs: Any) -> Engine:
+    url = url or database_url(environ)
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite":
+        return create_engine(url, **{**pool_options(environ), **kwargs})
+
+    in_memory = parsed.database in (None, "", ":memory:")
+    options: dict[str, Any] = {} if in_memory else pool_options(environ)
+    # Sessions from the request dependency are used from several threadpool threads
+    options["connect_args"] = {"check_same_thread": False}
+    engine = create_engine(url, **{**options, **kwargs})
+
+    pragmas = sqlite_pragmas(environ)
+    if in_memory:
+        pragmas.pop("journal_mode")
+        pragmas.pop("mmap_size")
+    _set_pragmas_on_connect(engine, pragmas)
+    return engine
+
+def _set_pragmas_on_connect(engine: Engine, pragmas: dict[str, str]) -> None:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    if parsed.drivername in ASYNC_DRIVERS:
+        parsed = parsed.set(drivername=ASYNC_DRIVERS[parsed.drivername])
+    return parsed.render_as_string(hide_password=False)
+
+def create_async_database_engine(url: Optional[str] = None, environ: Mapping[str, str] = os.environ, **kwargs: Any) -> Optional[AsyncEngine]:
+    # The async counterpart of create_database_engine, on the same database
+    # and settings. None when there is no async engine to share it with: an
+    # in-memory SQLite database exists once per connection, and aiosqlite or
+    # asyncpg may not be installed.
+    url = url or database_url(environ)
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return None
+    options = {**pool_options(environ), "poolclass": TimedAsyncAdaptedQueuePool}
+    try:
+        engine = create_async_engine(async_database_url(url), **{**options, **kwargs})
+    except ImportError:
+        return None
+    if parsed.get_backend_name() == "sqlite":
+        _set_pragmas_on_connect(engine.sync_engine, sqlite_pragmas(environ))
+    return engine
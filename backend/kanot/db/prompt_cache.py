@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+from .schema import PromptCacheEntry
+
+# Entries kept before the least recently used are evicted, about 100 bytes each
+DEFAULT_MAX_ENTRIES = int(os.environ.get("KANOT_PROMPT_CACHE_SIZE", 1_000_000))
+
+# Keys per statement, well below SQLite's bound parameter limit
+CHUNK_SIZE = 10000
+
+def _digest(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def codebook_hash(codes: Iterable[tuple[int, str, Optional[str]]]) -> str:
+    # Any edit to a term or description of the prompted codes changes the hash
+    return _digest(json.dumps(sorted([code_id, term, description or ""] for code_id, term, description in codes)))
+
+def cache_key(model: str, template: str, codebook: str, element_text: str) -> str:
+    return _digest(model, template, codebook, " ".join(element_text.split()))
+
+def read_cache(connection: Any, keys: list[str]) -> dict[str, list[int]]:
+    # Cached code ids per key; hits are marked as recently used
+    found: dict[str, list[int]] = {}
+    for start in range(0, len(keys), CHUNK_SIZE):
+        chunk = keys[start:start + CHUNK_SIZE]
+        rows = connection.execute(
+            select(PromptCacheEntry.key, PromptCacheEntry.code_ids).where(PromptCacheEntry.key.in_(chunk))
+        )
+        found.update({key: json.loads(code_ids) for key, code_ids in rows})
+    hits = list(found)
+    for start in range(0, len(hits), CHUNK_SIZE):
+        connection.execute(
+            update(PromptCacheEntry)
+            .where(PromptCacheEntry.key.in_(hits[start:start + CHUNK_SIZE]))
+            .values(last_used=time.time())
+        )
+    return found
+
+def write_cache(connection: Any, entries: dict[str, list[int]], max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+    if not entries:
+        return
+    now = time.time()
+    stmt = insert(PromptCacheEntry)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"code_ids": stmt.excluded.code_ids, "last_used": stmt.excluded.last_used},
+    )
+    connection.execute(
+        stmt, [{"key": key, "code_ids": json.dumps(code_ids), "last_used": now} for key, code_ids in entries.items()]
+    )
+    evict(connection, max_entries)
+
+def evict(connection: Any, max_entries: int = DEFAULT_MAX_ENTRIES) -> int:
+    # Drop the least recently used entries beyond max_entries
+    excess = connection.execute(select(func.count()).select_from(PromptCacheEntry)).scalar() - max_entries
+    if excess <= 0:
+        return 0
+    oldest = select(PromptCacheEntry.key).order_by(PromptCacheEntry.last_used).limit(excess)
+    connection.execute(delete(PromptCacheEntry).where(PromptCacheEntry.key.in_(oldest)))
+    return excess
@@ -1,6 +1,21 @@
 from typing import Any
 
-from sqlalchemy import Column, Engine, ForeignKey, Integer, Text, UniqueConstraint
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Engine,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    Text,
+    UniqueConstraint,
+    column,
+    inspect,
+    table,
+    text,
+)
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, relationship
 
 # Define the base class for declarative models
@@ -18,10 +33,11 @@ class Code(Base):
     code_id: Any = Column(Integer, primary_key=True, autoincrement=True)
     term: Any = Column(Text, unique=True, nullable=False)
     description: Any = Column(Text)
-    type_id: Any = Column(Integer, ForeignKey('code_types.type_id'))
+    type_id: Any = Column(Integer, ForeignKey('code_types.type_id'), index=True)
     reference: Any = Column(Text)
     coordinates: Any = Column(Text)
     code_type = relationship("CodeType")
+    usage = relationship("CodeUsage", primaryjoin="Code.code_id == foreign(CodeUsage.code_id)", uselist=False, viewonly=True)
 
     def __repr__(self):
         return f"Code(code_id={self.code_id}, term={self.term}, description={self.description}, type_id={self.type_id}, reference={self.reference}, coordinates={self.coordinates})"
@@ -35,14 +51,14 @@ class Segment(Base):
     __tablename__ = 'segments'
     segment_id: Any = Column(Integer, primary_key=True)
     segment_title: Any = Column(Text, unique=True, nullable=False)
-    series_id: Any = Column(Integer, ForeignKey('series.series_id'))
+    series_id: Any = Column(Integer, ForeignKey('series.series_id'), index=True)
     series = relationship("Series")
 
 class Element(Base):
     __tablename__ = 'elements'
     element_id: Any = Column(Integer, primary_key=True, autoincrement=True)
     element_text: Any = Column(Text, nullable=False, default="")
-    segment_id: Any = Column(Integer, ForeignKey('segments.segment_id'))
+    segment_id: Any = Column(Integer, ForeignKey('segments.segment_id'), index=True)
     segment = relationship("Segment")
     annotations = relationship("Annotation", back_populates="element")
 
@@ -56,13 +72,215 @@ class Annotation(Base): # type: ignore
     code_id: Any = Column(Integer, ForeignKey('codes.code_id'))
     element = relationship("Element", back_populates="annotations")
     code = relationship("Code")
-    __table_args__ = (UniqueConstraint('element_id', 'code_id', name='_element_code_uc'),)
+    __table_args__ = (
+        UniqueConstraint('element_id', 'code_id', name='_element_code_uc'),
+        # The unique constraint covers lookups by element, this covers lookups by code
+        Index('ix_annotations_code_id_element_id', 'code_id', 'element_id'),
+    )
 
     def __repr__(self):
         return f"Annotation(annotation_id={self.annotation_id}, element_id={self.element_id}, code_id={self.code_id})"
 
+# Number of elements per segment annotated with both codes of a pair, with
+# code_a_id < code_b_id. Elements without a segment are not counted.
+class CodeCooccurrence(Base):
+    __tablename__ = 'code_cooccurrences'
+    code_a_id: Any = Column(Integer, primary_key=True)
+    code_b_id: Any = Column(Integer, primary_key=True)
+    segment_id: Any = Column(Integer, primary_key=True, index=True)
+    count: Any = Column(Integer, nullable=False, default=0)
+
+# Annotations per code and the distinct segments and series they are in,
+# one row per code, so codes can be sorted and filtered by usage without
+# grouping annotations. Codes without annotations have a row of zeros.
+class CodeUsage(Base):
+    __tablename__ = 'code_usage'
+    code_id: Any = Column(Integer, primary_key=True)
+    annotation_count: Any = Column(Integer, nullable=False, default=0, index=True)
+    segment_count: Any = Column(Integer, nullable=False, default=0, index=True)
+    series_count: Any = Column(Integer, nullable=False, default=0, index=True)
+
+# Annotations per code and segment, for codes annotated in that segment.
+# code_usage counts a segment, and the segment's series, while its row here
+# exists, so those counts only change when a row is added or removed.
+class CodeSegmentUsage(Base):
+    __tablename__ = 'code_segment_usage'
+    code_id: Any = Column(Integer, primary_key=True)
+    segment_id: Any = Column(Integer, primary_key=True)
+    count: Any = Column(Integer, nullable=False, default=0)
+
+# LLM autoannotation job. element_ids and code_ids are JSON lists, an empty
+# list means all elements or all codes.
+class AutoannotationJob(Base):
+    __tablename__ = 'autoannotation_jobs'
+    job_id: Any = Column(Integer, primary_key=True, autoincrement=True)
+    status: Any = Column(Text, nullable=False, default="queued", index=True)
+    model: Any = Column(Text, nullable=False)
+    element_ids: Any = Column(Text, nullable=False, default="[]")
+    code_ids: Any = Column(Text, nullable=False, default="[]")
+    batch_size: Any = Column(Integer, nullable=False, default=20)
+    total_elements: Any = Column(Integer, nullable=False, default=0)
+    processed_elements: Any = Column(Integer, nullable=False, default=0)
+    annotations_created: Any = Column(Integer, nullable=False, default=0)
+    model_calls: Any = Column(Integer, nullable=False, default=0)
+    prompt_tokens: Any = Column(Integer, nullable=False, default=0)
+    completion_tokens: Any = Column(Integer, nullable=False, default=0)
+    cache_hits: Any = Column(Integer, nullable=False, default=0)
+    cache_misses: Any = Column(Integer, nullable=False, default=0)
+    cost: Any = Column(Float, nullable=False, default=0.0)
+    error: Any = Column(Text)
+    created_at: Any = Column(DateTime)
+    started_at: Any = Column(DateTime)
+    finished_at: Any = Column(DateTime)
+
+# Model answers per element, keyed by a hash of the model, prompt template,
+# codebook and element text. last_used drives LRU eviction.
+class PromptCacheEntry(Base):
+    __tablename__ = 'prompt_cache'
+    key: Any = Column(Text, primary_key=True)
+    code_ids: Any = Column(Text, nullable=False)
+    last_used: Any = Column(Float, nullable=False, index=True)
+
+# Rows of each import source already written, so interrupted imports can resume
+class ImportCheckpoint(Base):
+    __tablename__ = 'import_checkpoints'
+    source: Any = Column(Text, primary_key=True)
+    rows_done: Any = Column(Integer, nullable=False, default=0)
+
+# Full-text index over element_text. This is an external content FTS5 table
+# (it stores only the index, the text stays in elements) kept in sync by triggers,
+# so every insert path, including bulk_insert_mappings, updates it.
+ELEMENTS_FTS_TABLE = "elements_fts"
+
+elements_fts = table(ELEMENTS_FTS_TABLE, column("rowid"), column("element_text"))
+
+_fulltext_ddl = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {ELEMENTS_FTS_TABLE} USING fts5(
+        element_text,
+        content='elements',
+        content_rowid='element_id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS elements_fts_ai AFTER INSERT ON elements BEGIN
+        INSERT INTO {ELEMENTS_FTS_TABLE}(rowid, element_text) VALUES (new.element_id, new.element_text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS elements_fts_ad AFTER DELETE ON elements BEGIN
+        INSERT INTO {ELEMENTS_FTS_TABLE}({ELEMENTS_FTS_TABLE}, rowid, element_text) VALUES ('delete', old.element_id, old.element_text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS elements_fts_au AFTER UPDATE OF element_text ON elements BEGIN
+        INSERT INTO {ELEMENTS_FTS_TABLE}({ELEMENTS_FTS_TABLE}, rowid, element_text) VALUES ('delete', old.element_id, old.element_text);
+        INSERT INTO {ELEMENTS_FTS_TABLE}(rowid, element_text) VALUES (new.element_id, new.element_text);
+    END""",
+]
+
+# Code search for typeahead over large codebooks, on term and description:
+# a word index for prefix matches and a trigram index for substring and
+# fuzzy matches. Both are external content tables over codes, kept in sync
+# by triggers like the element index.
+CODES_FTS_TABLE = "codes_fts"
+CODES_TRIGRAM_TABLE = "codes_trigram"
+
+codes_fts = table(CODES_FTS_TABLE, column("rowid"), column("term"), column("description"))
+codes_trigram = table(CODES_TRIGRAM_TABLE, column("rowid"), column("term"), column("description"))
+
+def _code_search_ddl(name: str, tokenize: str) -> list[str]:
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(
+            term,
+            description,
+            content='codes',
+            content_rowid='code_id',
+            {tokenize}
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON codes BEGIN
+            INSERT INTO {name}(rowid, term, description) VALUES (new.code_id, new.term, new.description);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON codes BEGIN
+            INSERT INTO {name}({name}, rowid, term, description) VALUES ('delete', old.code_id, old.term, old.description);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF term, description ON codes BEGIN
+            INSERT INTO {name}({name}, rowid, term, description) VALUES ('delete', old.code_id, old.term, old.description);
+            INSERT INTO {name}(rowid, term, description) VALUES (new.code_id, new.term, new.description);
+        END""",
+    ]
+
+_code_search_tables = {
+    # Prefix indexes make one- and two-letter prefix queries a lookup
+    CODES_FTS_TABLE: "tokenize='unicode61 remove_diacritics 2', prefix='1 2'",
+    # The trigram tokenizer needs SQLite 3.34
+    CODES_TRIGRAM_TABLE: "tokenize='trigram'",
+}
+
+def has_fulltext_index(engine: Engine) -> bool:
+    return ELEMENTS_FTS_TABLE in inspect(engine).get_table_names()
+
+def create_fulltext_index(engine: Engine) -> bool:
+    if engine.dialect.name != "sqlite":
+        return False
+    existed = has_fulltext_index(engine)
+    try:
+        with engine.begin() as connection:
+            for statement in _fulltext_ddl:
+                connection.execute(text(statement))
+            if not existed:
+                # Index elements that were loaded before the FTS table existed
+                connection.execute(text(f"INSERT INTO {ELEMENTS_FTS_TABLE}({ELEMENTS_FTS_TABLE}) VALUES ('rebuild')"))
+    except OperationalError:
+        # SQLite built without FTS5, search falls back to LIKE
+        return False
+    return True
+
+def code_search_indexes(engine: Engine) -> set[str]:
+    return set(_code_search_tables) & set(inspect(engine).get_table_names())
+
+def create_code_search_indexes(engine: Engine) -> set[str]:
+    # Returns the code search tables available, either may be missing on an
+    # older SQLite build
+    if engine.dialect.name != "sqlite":
+        return set()
+    for name, tokenize in _code_search_tables.items():
+        existed = name in code_search_indexes(engine)
+        try:
+            with engine.begin() as connection:
+                for statement in _code_search_ddl(name, tokenize):
+                    connection.execute(text(statement))
+                if not existed:
+                    connection.execute(text(f"INSERT INTO {name}({name}) VALUES ('rebuild')"))
+        except OperationalError:
+            pass
+    return code_search_indexes(engine)
+
+def drop_code_search_indexes(engine: Engine):
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as connection:
+        for name in _code_search_tables:
+            for trigger in (f"{name}_ai", f"{name}_ad", f"{name}_au"):
+                connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+            connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+
+def drop_fulltext_index(engine: Engine):
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as connection:
+        for trigger in ("elements_fts_ai", "elements_fts_ad", "elements_fts_au"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {ELEMENTS_FTS_TABLE}"))
+
+def create_indexes(engine: Engine):
+    # create_all skips tables that already exist, so add indexes introduced
+    # after a database was first created
+    for schema_table in Base.metadata.sorted_tables:
+        for index in schema_table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
 def create_database(engine: Engine):
     Base.metadata.create_all(engine)
+    create_indexes(engine)
+    create_fulltext_index(engine)
+    create_code_search_indexes(engine)
 
 def drop_database(engine: Engine):
+    drop_fulltext_index(engine)
+    drop_code_search_indexes(engine)
     Base.metadata.drop_all(engine)
\ No newline at end of file
@@ -0,0 +1,16 @@
+from sqlalchemy import Engine, insert, select
+
+from .schema import Series
+
+def series_id_for_title(engine: Engine, series_title: str) -> int:
+    # The id of the series with this title, created if there is none. Series
+    # titles are not unique, the oldest series with the title is used.
+    with engine.begin() as connection:
+        series_id = connection.execute(
+            select(Series.series_id).where(Series.series_title == series_title).order_by(Series.series_id)
+        ).scalar()
+        if series_id is None:
+            series_id = connection.execute(
+                insert(Series).values(series_title=series_title).returning(Series.series_id)
+            ).scalar_one()
+    return series_id
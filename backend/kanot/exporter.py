@@ -0,0 +1,236 @@
+import gzip
+import json
+import logging
+import re
+import shutil
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import IO, Any, Iterator
+
+from sqlalchemy import Engine, func, select, text
+
+from .db.schema import (
+    ELEMENTS_FTS_TABLE,
+    Annotation,
+    Code,
+    CodeCooccurrence,
+    CodeType,
+    Element,
+    Segment,
+    Series,
+    has_fulltext_index,
+)
+
+logger = logging.getLogger("kanot")
+
+# Rows fetched per round trip, export memory is bounded by this and not by
+# corpus size
+DEFAULT_BATCH_SIZE = 5000
+COMPRESSIONS = {"gzip": ".gz", "brotli": ".br", "none": ""}
+SEARCH_INDEX_TOKENIZER = "unicode61 remove_diacritics 2"
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+class _BrotliWriter:
+    # Text file interface over a streaming brotli compressor
+    def __init__(self, path: Path):
+        import brotli  # type: ignore
+
+        self.file = open(path, "wb")
+        self.compressor = brotli.Compressor(mode=brotli.MODE_TEXT)
+
+    def write(self, data: str) -> None:
+        self.file.write(self.compressor.process(data.encode()))
+
+    def close(self) -> None:
+        self.file.write(self.compressor.finish())
+        self.file.close()
+
+@contextmanager
+def _open(out_dir: Path, name: str, compression: str, files: list[str]) -> Iterator[Any]:
+    relative = name + ".json" + COMPRESSIONS[compression]
+    path = out_dir / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    file: Any
+    if compression == "gzip":
+        file = gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+    elif compression == "brotli":
+        file = _BrotliWriter(path)
+    else:
+        file = open(path, "w", encoding="utf-8")
+    try:
+        yield file
+    finally:
+        file.close()
+    files.append(relative)
+
+def _write_items(file: IO[str], items: Iterator[str], open_: str = "[", close: str = "]") -> int:
+    # Write an array or object one item at a time
+    file.write(open_)
+    count = 0
+    for item in items:
+        if count:
+            file.write(",")
+        file.write(item)
+        count += 1
+    file.write(close)
+    return count
+
+def _stream(connection: Any, query: Any, batch_size: int) -> Iterator[Any]:
+    # Server-side cursor: rows are fetched batch_size at a time
+    yield from connection.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+
+def _segment_elements(connection: Any, batch_size: int) -> Iterator[Any]:
+    # Elements in segment order, each with its code ids. The correlated
+    # subquery walks the annotations index per element, avoiding a GROUP BY
+    # sort over the whole corpus.
+    code_ids = (
+        select(func.group_concat(Annotation.code_id))
+        .where(Annotation.element_id == Element.element_id)
+        .scalar_subquery()
+    )
+    query = (
+        select(Element.segment_id, Element.element_id, Element.element_text, code_ids)
+        .order_by(Element.segment_id, Element.element_id)
+    )
+    return _stream(connection, query, batch_size)
+
+def _element_row(row: Any) -> str:
+    _, element_id, element_text, code_ids = row
+    codes = sorted(int(code_id) for code_id in code_ids.split(",")) if code_ids else []
+    return _dumps([element_id, element_text, codes])
+
+def _write_segments(connection: Any, out_dir: Path, compression: str, batch_size: int, files: list[str]) -> list[dict[str, Any]]:
+    # One shard per segment: {segment_id, segment_title, series_id, elements:
+    # [[element_id, element_text, [code_id, ...]], ...]}
+    segments = {
+        segment_id: {"segment_id": segment_id, "segment_title": title, "series_id": series_id}
+        for segment_id, title, series_id in connection.execute(
+            select(Segment.segment_id, Segment.segment_title, Segment.series_id).order_by(Segment.segment_id)
+        )
+    }
+    written = []
+    for segment_id, rows in groupby(_segment_elements(connection, batch_size), key=itemgetter(0)):
+        meta = segments.get(segment_id, {"segment_id": segment_id, "segment_title": None, "series_id": None})
+        name = f"segments/{'none' if segment_id is None else segment_id}"
+        with _open(out_dir, name, compression, files) as file:
+            file.write(_dumps(meta)[:-1] + ',"elements":')
+            count = _write_items(file, (_element_row(row) for row in rows))
+            file.write("}")
+        written.append({**meta, "elements": count, "file": files[-1]})
+    return written
+
+def _write_codes(connection: Any, out_dir: Path, compression: str, batch_size: int, files: list[str]) -> int:
+    annotation_count = (
+        select(func.count()).where(Annotation.code_id == Code.code_id).scalar_subquery()
+    )
+    query = (
+        select(Code.code_id, Code.term, Code.description, Code.type_id, CodeType.type_name, Code.reference, Code.coordinates, annotation_count)
+        .outerjoin(CodeType, CodeType.type_id == Code.type_id)
+        .order_by(Code.code_id)
+    )
+    fields = ("code_id", "term", "description", "type_id", "type_name", "reference", "coordinates", "annotations")
+    with _open(out_dir, "codes", compression, files) as file:
+        return _write_items(file, (_dumps(dict(zip(fields, row))) for row in _stream(connection, query, batch_size)))
+
+def _write_code_counts(connection: Any, out_dir: Path, compression: str, batch_size: int, files: list[str]) -> None:
+    # {code_id: {segment_id: annotations}}, written one code at a time
+    query = (
+        select(Annotation.code_id, Element.segment_id, func.count())
+        .join(Element, Element.element_id == Annotation.element_id)
+        .group_by(Annotation.code_id, Element.segment_id)
+        .order_by(Annotation.code_id, Element.segment_id)
+    )
+
+    def codes() -> Iterator[str]:
+        for code_id, rows in groupby(_stream(connection, query, batch_size), key=itemgetter(0)):
+            yield f'"{code_id}":' + _dumps({str(segment_id): count for _, segment_id, count in rows})
+
+    with _open(out_dir, "code_counts", compression, files) as file:
+        _write_items(file, codes(), "{", "}")
+
+def _write_cooccurrence(connection: Any, out_dir: Path, compression: str, batch_size: int, files: list[str]) -> None:
+    # [code_a_id, code_b_id, count] summed over segments, in primary key order
+    query = (
+        select(CodeCooccurrence.code_a_id, CodeCooccurrence.code_b_id, func.sum(CodeCooccurrence.count))
+        .group_by(CodeCooccurrence.code_a_id, CodeCooccurrence.code_b_id)
+        .order_by(CodeCooccurrence.code_a_id, CodeCooccurrence.code_b_id)
+    )
+    with _open(out_dir, "cooccurrence", compression, files) as file:
+        _write_items(file, (_dumps(list(row)) for row in _stream(connection, query, batch_size)))
+
+def _shard_name(term: str) -> str:
+    first = term[:1]
+    return first if re.fullmatch(r"[0-9a-z]", first) else "_"
+
+def _write_search_index(connection: Any, out_dir: Path, compression: str, batch_size: int, files: list[str]) -> list[str]:
+    # Inverted index {term: [element ids, delta encoded]} sharded by the
+    # first character of the term. fts5vocab yields postings in term order,
+    # so only one term is held in memory at a time.
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS temp.export_vocab USING fts5vocab(main, {ELEMENTS_FTS_TABLE}, instance)"
+    ))
+    postings = _stream(connection, text("SELECT term, doc FROM temp.export_vocab"), batch_size)
+
+    def terms(rows: Iterator[Any]) -> Iterator[str]:
+        for term, docs in groupby(rows, key=itemgetter(0)):
+            ids = [doc for doc, _ in groupby(doc for _, doc in docs)]
+            deltas = [ids[0]] + [b - a for a, b in zip(ids, ids[1:])]
+            yield f"{_dumps(term)}:{_dumps(deltas)}"
+
+    shards = []
+    try:
+        for name, rows in groupby(postings, key=lambda row: _shard_name(row[0])):
+            with _open(out_dir, f"search/{name}", compression, files) as file:
+                _write_items(file, terms(rows), "{", "}")
+            shards.append(name)
+    finally:
+        connection.execute(text("DROP TABLE IF EXISTS temp.export_vocab"))
+    return shards
+
+def export_project(engine: Engine, out_dir: str | Path, compression: str = "gzip", batch_size: int = DEFAULT_BATCH_SIZE, clean: bool = True) -> dict[str, Any]:
+    # Write the project as static JSON for the dashboard: a manifest, one
+    # shard per segment, codes with counts, co-occurrence and a search index
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(COMPRESSIONS)}")
+    out_dir = Path(out_dir)
+    if clean and out_dir.exists():
+        shutil.rmtree(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    files: list[str] = []
+
+    with engine.connect() as connection:
+        series = [
+            {"series_id": series_id, "series_title": title}
+            for series_id, title in connection.execute(select(Series.series_id, Series.series_title).order_by(Series.series_id))
+        ]
+        segments = _write_segments(connection, out_dir, compression, batch_size, files)
+        logger.info(f"Exported {sum(s['elements'] for s in segments)} elements in {len(segments)} segments")
+        codes = _write_codes(connection, out_dir, compression, batch_size, files)
+        _write_code_counts(connection, out_dir, compression, batch_size, files)
+        _write_cooccurrence(connection, out_dir, compression, batch_size, files)
+        search_shards = []
+        if has_fulltext_index(engine):
+            search_shards = _write_search_index(connection, out_dir, compression, batch_size, files)
+        else:
+            logger.warning("No full-text index, exporting without a search index")
+
+    manifest = {
+        "compression": compression,
+        "series": series,
+        "segments": segments,
+        "codes": codes,
+        "elements": sum(s["elements"] for s in segments),
+        "search_index": {
+            "tokenizer": SEARCH_INDEX_TOKENIZER,
+            "encoding": "delta",
+            "shards": {name: f"search/{name}.json{COMPRESSIONS[compression]}" for name in search_shards},
+        },
+        "files": files,
+    }
+    (out_dir / "manifest.json").write_text(_dumps(manifest), encoding="utf-8")
+    logger.info(f"Exported {len(files)} files to {out_dir}")
+    return manifest
@@ -0,0 +1,215 @@
+import logging
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import pandas as pd
+from sqlalchemy import Engine, select
+from sqlalchemy.dialects.sqlite import insert
+
+from .db.code_usage import rebuild_code_usage
+from .db.cooccurrence import rebuild_cooccurrences
+from .db.series import series_id_for_title
+from .db.schema import (
+    Annotation,
+    Code,
+    CodeType,
+    Element,
+    ImportCheckpoint,
+    Segment,
+)
+
+logger = logging.getLogger("kanot")
+
+# Column names used by the Conflicted glossary and transcript exports, mapped
+# to kanot columns. Files that already use kanot column names pass unchanged.
+GLOSSARY_COLUMNS = {
+    'Glossary ID': 'code_id',
+    'Term': 'term',
+    'Description': 'description',
+    'Type': 'type',
+    'Read more': 'reference',
+    'Lat/Long': 'coordinates',
+}
+
+TRANSCRIPT_COLUMNS = {
+    'Text ID': 'element_id',
+    'Text': 'element_text',
+    'Episode ID': 'segment_id',
+    'Episode': 'segment_title',
+    'Glossary IDs': 'code_ids',
+}
+
+DEFAULT_BATCH_SIZE = 5000
+
+def read_chunks(path: str | Path, batch_size: int = DEFAULT_BATCH_SIZE, skip_rows: int = 0) -> Iterator[pd.DataFrame]:
+    # Stream a CSV or JSONL file as DataFrames of at most batch_size rows,
+    # skipping the first skip_rows records
+    path = Path(path)
+    if path.suffix.lower() in (".jsonl", ".ndjson"):
+        reader: Any = pd.read_json(path, lines=True, chunksize=batch_size, dtype=False)
+    else:
+        reader = pd.read_csv(path, chunksize=batch_size, dtype=str)
+    with reader:
+        for chunk in reader:
+            if skip_rows >= len(chunk):
+                skip_rows -= len(chunk)
+                continue
+            yield chunk.iloc[skip_rows:]
+            skip_rows = 0
+
+def explode_code_ids(elements: pd.DataFrame) -> pd.DataFrame:
+    # One (element_id, code_id) row per code in the ';'-separated code_ids column
+    if 'code_ids' not in elements:
+        return pd.DataFrame({'element_id': pd.Series(dtype=int), 'code_id': pd.Series(dtype=int)})
+    codes = elements.set_index('element_id')['code_ids'].explode().dropna()
+    codes = codes.astype(str).str.split(';').explode().str.strip()
+    codes = pd.to_numeric(codes[codes != ''], errors='coerce').dropna().astype(int)
+    annotations = codes.rename('code_id').reset_index()
+    return annotations.drop_duplicates()
+
+def _records(df: pd.DataFrame) -> list[dict[str, Any]]:
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+def _upsert(table: Any, index_elements: list[str], upsert: bool) -> Any:
+    stmt = insert(table)
+    update_columns = [c.name for c in table.columns if c.name not in index_elements]
+    if not upsert or not update_columns:
+        return stmt.on_conflict_do_nothing(index_elements=index_elements)
+    # Only touch rows that changed, so unchanged elements do not churn the FTS index
+    changed = None
+    for name in update_columns:
+        condition = table.c[name].is_distinct_from(stmt.excluded[name])
+        changed = condition if changed is None else changed | condition
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={name: stmt.excluded[name] for name in update_columns},
+        where=changed,
+    )
+
+def _checkpoint_source(kind: str, path: str | Path) -> str:
+    return f"{kind}:{Path(path).resolve()}"
+
+def _read_checkpoint(engine: Engine, source: str) -> int:
+    with engine.connect() as connection:
+        rows_done = connection.execute(
+            select(ImportCheckpoint.rows_done).where(ImportCheckpoint.source == source)
+        ).scalar()
+    return rows_done or 0
+
+def _write_checkpoint(connection: Any, source: str, rows_done: int) -> None:
+    stmt = insert(ImportCheckpoint).values(source=source, rows_done=rows_done)
+    connection.execute(stmt.on_conflict_do_update(index_elements=['source'], set_={'rows_done': rows_done}))
+
+def _code_type_ids(connection: Any, type_names: list[str], cache: dict[str, int]) -> dict[str, int]:
+    missing = [name for name in type_names if name not in cache]
+    if missing:
+        connection.execute(
+            insert(CodeType).on_conflict_do_nothing(index_elements=['type_name']),
+            [{'type_name': name} for name in missing],
+        )
+        rows = connection.execute(
+            select(CodeType.type_name, CodeType.type_id).where(CodeType.type_name.in_(missing))
+        )
+        cache.update({type_name: type_id for type_name, type_id in rows})
+    return cache
+
+def _skip_term_conflicts(connection: Any, codes: pd.DataFrame) -> pd.DataFrame:
+    # Terms are unique but upserts match on code_id only. A row whose term is
+    # held by another code, in the database or earlier in the file, is skipped
+    # and logged instead of aborting the import.
+    holders = dict(connection.execute(
+        select(Code.term, Code.code_id).where(Code.term.in_(codes['term'].unique().tolist()))
+    ).all())
+    keep = []
+    for code_id, term in zip(codes['code_id'], codes['term']):
+        holder = holders.setdefault(term, code_id)
+        if holder != code_id:
+            logger.warning(f"Skipped code {code_id}: term '{term}' is already used by code {holder}")
+        keep.append(holder == code_id)
+    return codes[keep]
+
+def _segment_title_conflicts(connection: Any, segments: pd.DataFrame) -> dict[int, int]:
+    # Segment titles are unique but upserts match on segment_id only. A
+    # segment whose title is held by another segment, in the database or
+    # earlier in the file, is mapped to that segment and logged instead of
+    # aborting the import.
+    holders = dict(connection.execute(
+        select(Segment.segment_title, Segment.segment_id).where(Segment.segment_title.in_(segments['segment_title'].unique().tolist()))
+    ).all())
+    remap = {}
+    for segment_id, segment_title in zip(segments['segment_id'], segments['segment_title']):
+        holder = holders.setdefault(segment_title, segment_id)
+        if holder != segment_id:
+            logger.warning(f"Imported the elements of segment {segment_id} into segment {holder}: title '{segment_title}' is already used by segment {holder}")
+            remap[segment_id] = holder
+    return remap
+
+def import_glossary(engine: Engine, path: str | Path, batch_size: int = DEFAULT_BATCH_SIZE, upsert: bool = True, resume: bool = False) -> int:
+    source = _checkpoint_source("glossary", path)
+    rows_done = _read_checkpoint(engine, source) if resume else 0
+    stmt = _upsert(Code.__table__, ['code_id'], upsert)
+    type_ids: dict[str, int] = {}
+    imported = 0
+
+    for chunk in read_chunks(path, batch_size, skip_rows=rows_done):
+        codes = chunk.rename(columns=GLOSSARY_COLUMNS)
+        codes = codes[codes['term'].notna()]
+        codes['code_id'] = pd.to_numeric(codes['code_id']).astype(int)
+        with engine.begin() as connection:
+            codes = _skip_term_conflicts(connection, codes)
+            if 'type' in codes:
+                type_names = codes['type'].dropna().astype(str).unique().tolist()
+                _code_type_ids(connection, type_names, type_ids)
+                codes['type_id'] = codes['type'].map(type_ids)
+            columns = [c for c in ('code_id', 'term', 'description', 'type_id', 'reference', 'coordinates') if c in codes]
+            if len(codes):
+                connection.execute(stmt, _records(codes[columns]))
+            rows_done += len(chunk)
+            _write_checkpoint(connection, source, rows_done)
+        imported += len(codes)
+        logger.info(f"Imported {imported} codes from {path}")
+
+    with engine.begin() as connection:
+        rebuild_code_usage(connection)
+
+    return imported
+
+def import_transcripts(engine: Engine, path: str | Path, series_title: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE, upsert: bool = True, resume: bool = False) -> int:
+    source = _checkpoint_source("transcripts", path)
+    rows_done = _read_checkpoint(engine, source) if resume else 0
+    series_id = series_id_for_title(engine, series_title or Path(path).stem)
+    segment_stmt = _upsert(Segment.__table__, ['segment_id'], upsert)
+    element_stmt = _upsert(Element.__table__, ['element_id'], upsert)
+    annotation_stmt = _upsert(Annotation.__table__, ['element_id', 'code_id'], upsert=False)
+    imported = 0
+
+    for chunk in read_chunks(path, batch_size, skip_rows=rows_done):
+        elements = chunk.rename(columns=TRANSCRIPT_COLUMNS)
+        elements = elements[elements['element_text'].notna()]
+        elements['element_id'] = pd.to_numeric(elements['element_id']).astype(int)
+        elements['segment_id'] = pd.to_numeric(elements['segment_id']).astype(int)
+        annotations = explode_code_ids(elements)
+
+        with engine.begin() as connection:
+            if 'segment_title' in elements:
+                segments = elements[['segment_id', 'segment_title']].drop_duplicates('segment_id')
+                remap = _segment_title_conflicts(connection, segments)
+                segments = segments[~segments['segment_id'].isin(remap)].assign(series_id=series_id)
+                if len(segments):
+                    connection.execute(segment_stmt, _records(segments))
+                elements = elements.assign(segment_id=elements['segment_id'].replace(remap))
+            if len(elements):
+                connection.execute(element_stmt, _records(elements[['element_id', 'element_text', 'segment_id']]))
+            if len(annotations):
+                connection.execute(annotation_stmt, _records(annotations))
+            rows_done += len(chunk)
+            _write_checkpoint(connection, source, rows_done)
+        imported += len(elements)
+        logger.info(f"Imported {imported} elements from {path}")
+
+    # Bulk writes bypass incremental maintenance, recount in one pass instead
+    with engine.begin() as connection:
+        rebuild_cooccurrences(connection)
+        rebuild_code_usage(connection)
+
+    return imported
@@ -0,0 +1,231 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Any, Mapping, Optional
+
+from sqlalchemy import Engine, event
+
+logger = logging.getLogger("kanot")
+
+# Statements slower than this are logged with their parameters
+SLOW_QUERY_MS = float(os.environ.get("KANOT_SLOW_QUERY_MS", 100))
+# Requests issuing more statements than this are logged, which is how an
+# N+1 loop over a page of elements shows up
+QUERY_COUNT_WARNING = int(os.environ.get("KANOT_QUERY_COUNT_WARNING", 50))
+# Longest repr of statement parameters in the slow query log
+MAX_PARAMETERS_LENGTH = 500
+
+# Upper bounds in seconds and in statements, like Prometheus buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Annotations per batch request, elements times codes
+BATCH_SIZE_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+# Pool checkouts are normally a few microseconds; anything in the upper
+# buckets means requests are queueing for a connection
+WAIT_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+class RequestStats:
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+# Set by the middleware for the duration of a request. Starlette copies the
+# context into the threadpool that runs sync endpoints, and the stats object
+# is shared, so statements executed there are counted too.
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("current_request", default=None)
+
+def _format_parameters(parameters: Any) -> str:
+    text = repr(parameters)
+    if len(text) > MAX_PARAMETERS_LENGTH:
+        return text[:MAX_PARAMETERS_LENGTH] + "..."
+    return text
+
+def instrument_engine(engine: Engine, slow_query_ms: float = SLOW_QUERY_MS) -> None:
+    # Time every statement, add it to the current request and log slow ones
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.sql_time += elapsed
+        if elapsed * 1000 >= slow_query_ms:
+            logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {' '.join(statement.split())} parameters: {_format_parameters(parameters)}")
+
+class Counter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        # The last count is for observations above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> tuple[list[int], int, float]:
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    def quantile(self, q: float) -> float:
+        counts, count, _ = self.snapshot()
+        return self._quantile(counts, count, q)
+
+    def _quantile(self, counts: list[int], count: int, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation, so an
+        # estimate that errs on the slow side
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> dict[str, Any]:
+        counts, count, total = self.snapshot()
+        return {
+            "count": count,
+            "sum": total,
+            "buckets": {str(bound): n for bound, n in zip(self.buckets, counts)} | {"+Inf": counts[-1]},
+            "p50": self._quantile(counts, count, 0.5),
+            "p95": self._quantile(counts, count, 0.95),
+            "p99": self._quantile(counts, count, 0.99),
+        }
+
+class EndpointMetrics:
+    def __init__(self) -> None:
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.sql_duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.errors = 0
+        self.max_queries = 0
+
+class RequestMetrics:
+    # Histograms per endpoint, keyed by method and route path such as
+    # "GET /elements/{element_id}" so ids do not make a key each
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.endpoints: dict[str, EndpointMetrics] = {}
+
+    def observe(self, endpoint: str, stats: RequestStats, status_code: int) -> None:
+        with self._lock:
+            metrics = self.endpoints.get(endpoint)
+            if metrics is None:
+                metrics = self.endpoints[endpoint] = EndpointMetrics()
+            metrics.max_queries = max(metrics.max_queries, stats.queries)
+            if status_code >= 500:
+                metrics.errors += 1
+        metrics.duration.observe(stats.elapsed)
+        metrics.sql_duration.observe(stats.sql_time)
+        metrics.queries.observe(stats.queries)
+
+    def items(self) -> list[tuple[str, EndpointMetrics]]:
+        with self._lock:
+            return sorted(self.endpoints.items())
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            endpoint: {
+                "duration": metrics.duration.to_dict(),
+                "sql_duration": metrics.sql_duration.to_dict(),
+                "queries": metrics.queries.to_dict(),
+                "max_queries": metrics.max_queries,
+                "errors": metrics.errors,
+            }
+            for endpoint, metrics in self.items()
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.endpoints.clear()
+
+request_metrics = RequestMetrics()
+
+# Write and database counters, exported by /metrics
+annotations_created = Counter()
+annotations_deleted = Counter()
+annotation_batch_sizes = {"create": Histogram(BATCH_SIZE_BUCKETS), "delete": Histogram(BATCH_SIZE_BUCKETS)}
+pool_checkout_wait = Histogram(WAIT_BUCKETS)
+
+def server_timing(stats: RequestStats) -> str:
+    total = stats.elapsed * 1000
+    sql = stats.sql_time * 1000
+    return f'db;dur={sql:.1f};desc="{stats.queries} queries", app;dur={total - sql:.1f}, total;dur={total:.1f}'
+
+def endpoint_name(scope: Mapping[str, Any]) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None) or "unmatched"
+    return f"{scope['method']} {path}"
+
+class RequestTimingMiddleware:
+    # Plain ASGI middleware: adds Server-Timing to the response headers and
+    # records the request once the last body chunk is sent, so streamed
+    # responses include the statements run while streaming
+    def __init__(self, app: Any, metrics: RequestMetrics = request_metrics, query_count_warning: int = QUERY_COUNT_WARNING):
+        self.app = app
+        self.metrics = metrics
+        self.query_count_warning = query_count_warning
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status_code = 500
+        recorded = False
+
+        def record() -> None:
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            endpoint = endpoint_name(scope)
+            self.metrics.observe(endpoint, stats, status_code)
+            if stats.queries > self.query_count_warning:
+                logger.warning(f"{endpoint} ran {stats.queries} queries in {stats.elapsed * 1000:.1f} ms")
+
+        async def send_with_timing(message: dict[str, Any]) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"server-timing", server_timing(stats).encode())]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            record()
+            current_request.reset(token)
@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import random
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+logger = logging.getLogger("kanot")
+
+# Code lines are rendered as "<code_id>: <term> - <description>" and element
+# lines as "[<element_id>] <element_text>", see build_prompt
+CODE_LINE = re.compile(r"^(\d+): (.*?)(?: - .*)?$")
+ELEMENT_LINE = re.compile(r"^\[(\d+)\] (.*)$")
+
+PROMPT_TEMPLATE = """You annotate transcript excerpts with codes from a glossary.
+
+Codes:
+{codes}
+
+Excerpts:
+{elements}
+
+Answer with a JSON object that maps each excerpt id to a list of code ids that apply to it."""
+
+class TransientModelError(Exception):
+    # Rate limits, timeouts and other failures worth retrying
+    pass
+
+def build_prompt(codes: list[tuple[int, str, Optional[str]]], elements: list[tuple[int, str]]) -> str:
+    code_lines = "\n".join(
+        f"{code_id}: {term} - {description}" if description else f"{code_id}: {term}"
+        for code_id, term, description in codes
+    )
+    element_lines = "\n".join(f"[{element_id}] {' '.join(text.split())}" for element_id, text in elements)
+    return PROMPT_TEMPLATE.format(codes=code_lines, elements=element_lines)
+
+def parse_response(text: str) -> dict[int, list[int]]:
+    # Models like to wrap JSON in prose or code fences, take the outermost object
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"No JSON object in model response: {text[:200]!r}")
+    data = json.loads(text[start:end + 1])
+    return {int(element_id): [int(code_id) for code_id in code_ids] for element_id, code_ids in data.items()}
+
+def count_tokens(text: str) -> int:
+    # Rough estimate, about four characters per token for English text
+    return max(1, len(text) // 4)
+
+class ModelClient(ABC):
+    model_name = "model"
+    # USD per 1000 tokens
+    prompt_cost = 0.0
+    completion_cost = 0.0
+
+    @abstractmethod
+    def complete(self, prompt: str) -> tuple[str, int, int]:
+        # Returns (text, prompt_tokens, completion_tokens)
+        ...
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.prompt_cost + completion_tokens * self.completion_cost) / 1000
+
+class FakeModelClient(ModelClient):
+    # Deterministic stand-in for tests and offline benchmarks: assigns every
+    # code whose term occurs in the excerpt text, case-insensitively
+    model_name = "fake"
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def complete(self, prompt: str) -> tuple[str, int, int]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise TransientModelError("Simulated rate limit")
+
+        codes: list[tuple[int, str]] = []
+        elements: list[tuple[int, str]] = []
+        for line in prompt.splitlines():
+            element = ELEMENT_LINE.match(line)
+            if element:
+                elements.append((int(element.group(1)), element.group(2).lower()))
+                continue
+            code = CODE_LINE.match(line)
+            if code:
+                codes.append((int(code.group(1)), code.group(2).lower()))
+
+        result = {
+            str(element_id): [code_id for code_id, term in codes if term and term in text]
+            for element_id, text in elements
+        }
+        text = json.dumps(result)
+        return text, count_tokens(prompt), count_tokens(text)
+
+class OpenAIModelClient(ModelClient):
+    # Prices for gpt-4o-mini, override for other models
+    prompt_cost = 0.00015
+    completion_cost = 0.0006
+
+    def __init__(self, model_name: str = "gpt-4o-mini", prompt_cost: Optional[float] = None, completion_cost: Optional[float] = None, timeout: float = 60):
+        from langchain_openai import ChatOpenAI
+
+        self.model_name = model_name
+        if prompt_cost is not None:
+            self.prompt_cost = prompt_cost
+        if completion_cost is not None:
+            self.completion_cost = completion_cost
+        self.chat = ChatOpenAI(model=model_name, temperature=0, timeout=timeout, max_retries=0)
+
+    def complete(self, prompt: str) -> tuple[str, int, int]:
+        try:
+            message: Any = self.chat.invoke(prompt)
+        except Exception as e:
+            # The openai client raises RateLimitError, APITimeoutError and
+            # APIConnectionError for failures that go away on retry
+            if type(e).__name__ in ("RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError"):
+                raise TransientModelError(str(e)) from e
+            raise
+        usage = getattr(message, "usage_metadata", None) or {}
+        prompt_tokens = usage.get("input_tokens") or count_tokens(prompt)
+        completion_tokens = usage.get("output_tokens") or count_tokens(message.content)
+        return message.content, prompt_tokens, completion_tokens
+
+def create_model_client(model: str) -> ModelClient:
+    # "fake" selects the local stand-in, anything else is an OpenAI chat model
+    if model == "fake":
+        return FakeModelClient(latency=float(os.environ.get("KANOT_FAKE_MODEL_LATENCY", 0)))
+    return OpenAIModelClient(model)
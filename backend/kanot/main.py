@@ -1,20 +1,32 @@
 from __future__ import annotations
 
+import datetime
+import io
 import logging
+import os
+import tempfile
 import traceback
 from logging.config import dictConfig
-from typing import List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
 
-from fastapi import Depends, FastAPI, HTTPException, Query, Response
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from sqlalchemy import create_engine
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, TypeAdapter
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from .autoannotate import AutoannotationRunner, cache_hit_rate, elements_per_second
+from .db.async_crud import AsyncDatabaseManager
 from .db.crud import DatabaseManager
+from .db.engine import create_async_database_engine, create_database_engine
+from .exporter import COMPRESSIONS, export_project
+from .instrumentation import RequestTimingMiddleware, instrument_engine, request_metrics
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render as render_metrics
+from .serialization import FastJSONResponse, dumps
+from .transcripts import DEFAULT_MAX_CHARS, guess_format, ingest_transcript
 
 # Define logging configuration
 log_config = {
@@ -55,24 +67,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create database engine
-DATABASE_URL = "sqlite:///local_database.db"
-from pathlib import Path
+# Query count, SQL time and total time per request, as a Server-Timing
+# header and per-endpoint histograms
+app.add_middleware(RequestTimingMiddleware)
 
-logger.info(f"Local sqlite database on : {Path(DATABASE_URL).resolve()}")
+# Create database engine, configured from KANOT_DATABASE_URL and friends
+engine = create_database_engine()
+instrument_engine(engine)
 
-engine = create_engine(DATABASE_URL)
+logger.info(f"Database: {engine.url.render_as_string(hide_password=True)}")
 
 # Create DatabaseManager instance
 db_manager = DatabaseManager(engine)
-
-# Dependency to get database session
+db_manager.check_query_plans()
+
+# Background autoannotation worker pool. Jobs queued before a restart are
+# picked up again.
+autoannotation_runner = AutoannotationRunner(db_manager)
+autoannotation_runner.recover()
+
+# Interactive endpoints are async and run their DatabaseManager calls on an
+# AsyncEngine over the same database, so they do not queue for threadpool
+# threads behind exports and streams
+async_engine = create_async_database_engine()
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine)
+else:
+    logger.warning("No async database driver for this database, async endpoints run on the threadpool.")
+async_db = AsyncDatabaseManager(db_manager, async_engine)
+
+@app.on_event("shutdown")
+def stop_autoannotation_runner():
+    autoannotation_runner.shutdown(wait=False)
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    await async_db.dispose()
+
+# Dependency to get a request-scoped session for the remaining sync
+# endpoints. Handlers pass it to every DatabaseManager call so a write and
+# its read-back share one transaction, committed when the request finishes.
 def get_db():
-    session = db_manager.Session()
-    try:
+    with db_manager.unit_of_work() as session:
         yield session
-    finally:
-        session.close()
 
 # Pydantic models
 class CodeTypeBase(BaseModel):
@@ -121,6 +158,22 @@ class CodeResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CodeUsageResponse(BaseModel):
+    annotation_count: int
+    segment_count: int
+    series_count: int
+
+    class Config:
+        from_attributes = True
+
+class CodeWithUsageResponse(CodeResponse):
+    usage: Optional[CodeUsageResponse] = None
+
+# Typeahead projection of a code
+class CodeTerm(BaseModel):
+    code_id: int
+    term: str
+
 class SeriesBase(BaseModel):
     series_id: int
     series_title: str
@@ -199,6 +252,45 @@ class BatchAnnotationRemove(BaseModel):
     element_ids: List[int]
     code_ids: List[int]
 
+class MergeCodesBatch(BaseModel):
+    source_code_ids: List[int]
+    target_code_id: int
+
+class AutoannotationJobCreate(BaseModel):
+    # Empty lists mean all elements or all codes
+    element_ids: List[int] = []
+    code_ids: List[int] = []
+    model: str = "gpt-4o-mini"
+    batch_size: int = 20
+
+class AutoannotationJobResponse(BaseModel):
+    job_id: int
+    status: str
+    model: str
+    batch_size: int
+    total_elements: int
+    processed_elements: int
+    annotations_created: int
+    model_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    cache_hits: int
+    cache_misses: int
+    cache_hit_rate: float
+    cost: float
+    elements_per_second: float
+    error: Optional[str]
+    created_at: Optional[datetime.datetime]
+    started_at: Optional[datetime.datetime]
+    finished_at: Optional[datetime.datetime]
+
+    class Config:
+        from_attributes = True
+
+class ExportRequest(BaseModel):
+    name: str = "dashboard"
+    compression: str = "gzip"
+
 class AnnotationUpdate(BaseModel):
     element_id: Optional[int] = None
     code_id: Optional[int] = None
@@ -211,45 +303,149 @@ class AnnotationResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+class SearchElementsResponse(BaseModel):
+    elements: List[ElementResponse]
+    total_count: int
+    facets: Dict[str, Dict[int, int]]
+
+# Compact page: elements reference codes and segments by id, and each
+# referenced row is sent once in a side table
+class CompactElement(BaseModel):
+    element_id: int
+    element_text: Optional[str] = None
+    segment_id: Optional[int] = None
+    annotation_ids: List[int]
+    code_ids: List[int]
+
+class CompactCode(BaseModel):
+    code_id: int
+    term: str
+    description: Optional[str] = None
+    type_id: Optional[int] = None
+    reference: Optional[str] = None
+    coordinates: Optional[str] = None
+
+class CompactSegment(BaseModel):
+    segment_id: int
+    segment_title: Optional[str] = None
+    series_id: Optional[int] = None
+
+class CompactElementsResponse(BaseModel):
+    elements: List[CompactElement]
+    codes: Dict[int, CompactCode]
+    code_types: Dict[int, CodeTypeResponse]
+    segments: Dict[int, CompactSegment]
+    series: Dict[int, SeriesResponse]
+    total_count: Optional[int] = None
+    facets: Optional[Dict[str, Dict[int, int]]] = None
+
+class CooccurrenceResponse(BaseModel):
+    code_a_id: int
+    code_b_id: int
+    count: int
+
+    class Config:
+        from_attributes = True
         
+# Bulk writes: creates, partial updates and deletes in one transaction
+class ElementBulkUpdate(ElementUpdate):
+    element_id: int
+
+class ElementBulk(BaseModel):
+    create: List[ElementCreate] = []
+    update: List[ElementBulkUpdate] = []
+    delete: List[int] = []
+
+class CodeBulkUpdate(CodeUpdate):
+    code_id: int
+
+class CodeBulk(BaseModel):
+    create: List[CodeCreate] = []
+    update: List[CodeBulkUpdate] = []
+    delete: List[int] = []
+
+class SegmentBulkCreate(BaseModel):
+    # Without a segment_id the next free one is used
+    segment_id: Optional[int] = None
+    segment_title: str
+    series_id: Optional[int] = None
+
+class SegmentBulkUpdate(BaseModel):
+    segment_id: int
+    segment_title: Optional[str] = None
+    series_id: Optional[int] = None
+
+class SegmentBulk(BaseModel):
+    create: List[SegmentBulkCreate] = []
+    update: List[SegmentBulkUpdate] = []
+    delete: List[int] = []
+
+# Serve a rarely changing list from the DatabaseManager read cache. An
+# unchanged list costs a 304 without touching the database or serializing.
+async def cached_response(request: Request, key: str, response_model: Any, read: Callable[[Session], Any]) -> Response:
+    adapter = TypeAdapter(response_model)
+    etag, body = await async_db.run(
+        lambda db: db_manager.read_cached(key, lambda: adapter.dump_json(adapter.validate_python(read(db), from_attributes=True)))
+    )
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Items, counting creates, updates and deletes together, in one bulk request
+BULK_MAX_ITEMS = int(os.environ.get("KANOT_BULK_MAX_ITEMS", 5000))
+
+async def run_bulk(bulk: Union[ElementBulk, CodeBulk, SegmentBulk], write: Callable[..., Dict[str, Any]]) -> Dict[str, Any]:
+    items = len(bulk.create) + len(bulk.update) + len(bulk.delete)
+    if items > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Bulk requests take at most {BULK_MAX_ITEMS} items, got {items}")
+    creates = [item.model_dump() for item in bulk.create]
+    updates = [item.model_dump() for item in bulk.update]
+    return await async_db.run(lambda db: write(creates, updates, bulk.delete, session=db))
+
 # API endpoints
 
 # CodeType endpoints
 @app.post("/code_types/", response_model=CodeTypeResponse)
-def create_code_type(code_type: CodeTypeCreate, db: Session = Depends(get_db)):
-    new_code_type = db_manager.create_code_type(code_type.type_name)
-    return new_code_type
+async def create_code_type(code_type: CodeTypeCreate):
+    return await async_db.run(lambda db: db_manager.create_code_type(code_type.type_name, session=db), CodeTypeResponse)
 
 @app.get("/code_types/", response_model=List[CodeTypeResponse])
-def read_code_types(db: Session = Depends(get_db)):
-    code_types = db_manager.read_all_code_types()
-    return code_types
+async def read_code_types(request: Request):
+    return await cached_response(request, "code_types", List[CodeTypeResponse], lambda db: db_manager.read_all_code_types(session=db))
 
 @app.get("/code_types/{type_id}", response_model=CodeTypeResponse)
-def read_code_type(type_id: int, db: Session = Depends(get_db)):
-    code_type = db_manager.read_code_type(type_id)
+async def read_code_type(type_id: int):
+    code_type = await async_db.run(lambda db: db_manager.read_code_type(type_id, session=db), CodeTypeResponse)
     if code_type is None:
         raise HTTPException(status_code=404, detail="Code type not found")
     return code_type
 
 @app.put("/code_types/{type_id}", response_model=CodeTypeResponse)
-def update_code_type(type_id: int, code_type: CodeTypeCreate, db: Session = Depends(get_db)):
-    db_manager.update_code_type(type_id, code_type.type_name)
-    updated_code_type = db_manager.read_code_type(type_id)
+async def update_code_type(type_id: int, code_type: CodeTypeCreate):
+    def update(db: Session) -> Any:
+        db_manager.update_code_type(type_id, code_type.type_name, session=db)
+        return db_manager.read_code_type(type_id, session=db)
+
+    updated_code_type = await async_db.run(update, CodeTypeResponse)
     if updated_code_type is None:
         raise HTTPException(status_code=404, detail="Code type not found")
     return updated_code_type
 
 @app.delete("/code_types/{type_id}")
-def delete_code_type(type_id: int, db: Session = Depends(get_db)):
-    db_manager.delete_code_type(type_id)
+async def delete_code_type(type_id: int):
+    await async_db.run(lambda db: db_manager.delete_code_type(type_id, session=db))
     return {"message": "Code type deleted successfully"}
 
 # Code endpoints
 @app.post("/codes/", response_model=CodeResponse)
-def create_code(code: CodeCreate, db: Session = Depends(get_db)):
+async def create_code(code: CodeCreate):
     try:
-        new_code = db_manager.create_code(code.term, code.description, code.type_id, code.reference, code.coordinates)
+        new_code = await async_db.run(
+            lambda db: db_manager.create_code(code.term, code.description, code.type_id, code.reference, code.coordinates, session=db),
+            CodeResponse,
+        )
         if new_code is None:
             return JSONResponse(
                 status_code=400,
@@ -278,209 +474,295 @@ def create_code(code: CodeCreate, db: Session = Depends(get_db)):
             content={"message": "An unexpected error occurred"}
         )
 
-@app.get("/codes/", response_model=List[CodeResponse])
-def read_codes(db: Session = Depends(get_db)):
-    codes = db_manager.read_all_codes()
+@app.get("/codes/", response_model=List[CodeWithUsageResponse])
+async def read_codes(
+    request: Request,
+    sort: Optional[str] = Query(None, pattern="^(annotations|segments|series)$", description="Sort by usage, returns a page of codes with their usage counts"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    min_annotations: Optional[int] = Query(None, ge=0),
+    max_annotations: Optional[int] = Query(None, ge=0),
+    type_ids: Optional[str] = Query(None),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    # Without usage parameters, every code from the read cache. Usage changes
+    # with every annotation, so usage pages are not cached.
+    if sort is None and min_annotations is None and max_annotations is None and not type_ids:
+        return await cached_response(request, "codes", List[CodeResponse], lambda db: db_manager.read_all_codes(session=db))
+    type_id_list = [int(id) for id in type_ids.split(",")] if type_ids else []
+    return await async_db.run(
+        lambda db: db_manager.read_codes_by_usage(sort or "annotations", order == "desc", min_annotations, max_annotations, type_id_list, skip, limit, session=db),
+        List[CodeWithUsageResponse],
+    )
+
+@app.get("/codes/search", response_model=Union[List[CodeResponse], List[CodeTerm]])
+async def search_codes(
+    response: Response,
+    q: str = Query("", description="Words to match; empty lists codes by term"),
+    mode: str = Query("prefix", pattern="^(prefix|fuzzy)$", description="prefix matches word starts, fuzzy tolerates typos and matches inside words"),
+    fields: str = Query("all", pattern="^(term|all)$", description="Match the term only, or the term and description"),
+    type_ids: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Keyset pagination cursor from X-Next-Cursor"),
+    format: str = Query("full", pattern="^(full|compact)$", description="compact returns only code_id and term"),
+):
+    type_id_list = [int(id) for id in type_ids.split(",")] if type_ids else []
+    shape = "compact" if format == "compact" else "orm"
+
+    def search(db: Session) -> tuple[Any, Optional[str]]:
+        try:
+            codes, next_cursor = db_manager.search_codes(q, mode, fields, type_id_list, cursor, limit, shape, session=db)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if shape == "orm":
+            codes = TypeAdapter(List[CodeResponse]).validate_python(codes, from_attributes=True)
+        return codes, next_cursor
+
+    codes, next_cursor = await async_db.run(search)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if format == "compact":
+        return FastJSONResponse(codes, headers=dict(response.headers))
     return codes
 
 @app.get("/codes/{code_id}", response_model=CodeResponse)
-def read_code(code_id: int, db: Session = Depends(get_db)):
-    code = db_manager.read_code(code_id)
+async def read_code(code_id: int):
+    code = await async_db.run(lambda db: db_manager.read_code(code_id, session=db), CodeResponse)
     if code is None:
         raise HTTPException(status_code=404, detail="Code not found")
     return code
 
 @app.put("/codes/{code_id}", response_model=CodeResponse)
-def update_code(code_id: int, code: CodeUpdate, db: Session = Depends(get_db)):
-    db_manager.update_code(code_id, code.term, code.description, code.type_id, code.reference, code.coordinates)
-    updated_code = db_manager.read_code(code_id)
+async def update_code(code_id: int, code: CodeUpdate):
+    def update(db: Session) -> Any:
+        db_manager.update_code(code_id, code.term, code.description, code.type_id, code.reference, code.coordinates, session=db)
+        return db_manager.read_code(code_id, session=db)
+
+    updated_code = await async_db.run(update, CodeResponse)
     if updated_code is None:
         raise HTTPException(status_code=404, detail="Code not found")
     return updated_code
 
 @app.delete("/codes/{code_id}")
-def delete_code(code_id: int, db: Session = Depends(get_db)):
-    db_manager.delete_code(code_id)
+async def delete_code(code_id: int):
+    await async_db.run(lambda db: db_manager.delete_code(code_id, session=db))
     return {"message": "Code deleted successfully"}
 
+@app.post("/codes/bulk")
+async def bulk_codes(bulk: CodeBulk):
+    return await run_bulk(bulk, db_manager.bulk_codes)
+
 # Series endpoints
 @app.post("/series/", response_model=SeriesResponse)
-def create_series(series: SeriesCreate, db: Session = Depends(get_db)):
-    new_series = db_manager.create_series(series.series_title)
-    return new_series
+async def create_series(series: SeriesCreate):
+    return await async_db.run(lambda db: db_manager.create_series(series.series_title, session=db), SeriesResponse)
 
 @app.get("/series/", response_model=List[SeriesResponse])
-def read_all_series(db: Session = Depends(get_db)):
-    series = db_manager.read_all_series()
-    return series
+async def read_all_series(request: Request):
+    return await cached_response(request, "series", List[SeriesResponse], lambda db: db_manager.read_all_series(session=db))
 
 @app.get("/series/{series_id}", response_model=SeriesResponse)
-def read_series(series_id: int, db: Session = Depends(get_db)):
-    series = db_manager.read_series(series_id)
+async def read_series(series_id: int):
+    series = await async_db.run(lambda db: db_manager.read_series(series_id, session=db), SeriesResponse)
     if series is None:
         raise HTTPException(status_code=404, detail="Series not found")
     return series
 
 @app.put("/series/{series_id}", response_model=SeriesResponse)
-def update_series(series_id: int, series: SeriesUpdate, db: Session = Depends(get_db)):
-    db_manager.update_series(series_id, series.series_title)
-    updated_series = db_manager.read_series(series_id)
+async def update_series(series_id: int, series: SeriesUpdate):
+    def update(db: Session) -> Any:
+        db_manager.update_series(series_id, series.series_title, session=db)
+        return db_manager.read_series(series_id, session=db)
+
+    updated_series = await async_db.run(update, SeriesResponse)
     if updated_series is None:
         raise HTTPException(status_code=404, detail="Series not found")
     return updated_series
 
 @app.delete("/series/{series_id}")
-def delete_series(series_id: int, db: Session = Depends(get_db)):
-    db_manager.delete_series(series_id)
+async def delete_series(series_id: int):
+    await async_db.run(lambda db: db_manager.delete_series(series_id, session=db))
     return {"message": "Series deleted successfully"}
 
 # Segment endpoints
 @app.post("/segments/", response_model=SegmentResponse)
-def create_segment(segment: SegmentCreate, db: Session = Depends(get_db)):
-    new_segment = db_manager.create_segment(segment.segment_id, segment.segment_title)
-    return new_segment
+async def create_segment(segment: SegmentCreate):
+    return await async_db.run(lambda db: db_manager.create_segment(segment.segment_id, segment.segment_title, session=db), SegmentResponse)
 
 @app.get("/segments/", response_model=List[SegmentResponse])
-def read_segments(db: Session = Depends(get_db)):
-    segments = db_manager.read_all_segments()
-    return segments
+async def read_segments(request: Request):
+    return await cached_response(request, "segments", List[SegmentResponse], lambda db: db_manager.read_all_segments(session=db))
 
 @app.get("/segments/{segment_id}", response_model=SegmentResponse)
-def read_segment(segment_id: int, db: Session = Depends(get_db)):
-    segment = db_manager.read_segment(segment_id)
+async def read_segment(segment_id: int):
+    segment = await async_db.run(lambda db: db_manager.read_segment(segment_id, session=db), SegmentResponse)
     if segment is None:
         raise HTTPException(status_code=404, detail="Segment not found")
     return segment
 
 @app.put("/segments/{segment_id}", response_model=SegmentResponse)
-def update_segment(segment_id: int, segment: SegmentUpdate, db: Session = Depends(get_db)):
-    db_manager.update_segment(segment_id, segment.segment_title)
-    updated_segment = db_manager.read_segment(segment_id)
+async def update_segment(segment_id: int, segment: SegmentUpdate):
+    def update(db: Session) -> Any:
+        db_manager.update_segment(segment_id, segment.segment_title, session=db)
+        return db_manager.read_segment(segment_id, session=db)
+
+    updated_segment = await async_db.run(update, SegmentResponse)
     if updated_segment is None:
         raise HTTPException(status_code=404, detail="Segment not found")
     return updated_segment
 
 @app.delete("/segments/{segment_id}")
-def delete_segment(segment_id: int, db: Session = Depends(get_db)):
-    db_manager.delete_segment(segment_id)
+async def delete_segment(segment_id: int):
+    await async_db.run(lambda db: db_manager.delete_segment(segment_id, session=db))
     return {"message": "Segment deleted successfully"}
 
+@app.post("/segments/bulk")
+async def bulk_segments(bulk: SegmentBulk):
+    return await run_bulk(bulk, db_manager.bulk_segments)
+
 # Element endpoints
 @app.post("/elements/", response_model=ElementResponse)
-def create_element(element: ElementCreate, db: Session = Depends(get_db)):
-    new_element = db_manager.create_element(element.element_text, element.segment_id)
-    return new_element
+async def create_element(element: ElementCreate):
+    return await async_db.run(lambda db: db_manager.create_element(element.element_text, element.segment_id, session=db), ElementResponse)
 
-@app.get("/elements/", response_model=List[ElementResponse])
-def read_elements(
+@app.get("/elements/", response_model=Union[List[ElementResponse], CompactElementsResponse])
+async def read_elements(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Keyset pagination cursor from X-Next-Cursor, pass an empty value for the first page"),
+    format: str = Query("full", pattern="^(full|compact)$", description="compact returns code and segment ids with side tables instead of nested objects"),
 ):
-    elements = db_manager.read_elements_paginated(skip=skip, limit=limit)
-    return elements
+    shape = "compact" if format == "compact" else "dicts"
+    if cursor is not None:
+        try:
+            elements, next_cursor = await async_db.run(lambda db: db_manager.read_elements_keyset(cursor=cursor, limit=limit, shape=shape, session=db))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return FastJSONResponse(elements, headers=dict(response.headers))
+    elements = await async_db.run(lambda db: db_manager.read_elements_paginated(skip=skip, limit=limit, shape=shape, session=db))
+    if elements is None:
+        raise HTTPException(status_code=500, detail="Error reading elements")
+    return FastJSONResponse(elements)
 
 @app.get("/elements/{element_id}", response_model=ElementResponse)
-def read_element(element_id: int, db: Session = Depends(get_db)):
-    element = db_manager.read_element(element_id)
+async def read_element(element_id: int):
+    element = await async_db.run(lambda db: db_manager.read_element(element_id, session=db), ElementResponse)
     if element is None:
         raise HTTPException(status_code=404, detail="Element not found")
     return element
 
 @app.put("/elements/{element_id}", response_model=ElementResponse)
-def update_element(element_id: int, element: ElementUpdate, db: Session = Depends(get_db)):
-    db_manager.update_element(element_id, element.element_text, element.segment_id)
-    updated_element = db_manager.read_element(element_id)
+async def update_element(element_id: int, element: ElementUpdate):
+    def update(db: Session) -> Any:
+        db_manager.update_element(element_id, element.element_text, element.segment_id, session=db)
+        return db_manager.read_element(element_id, session=db)
+
+    updated_element = await async_db.run(update, ElementResponse)
     if updated_element is None:
         raise HTTPException(status_code=404, detail="Element not found")
     return updated_element
 
 @app.delete("/elements/{element_id}")
-def delete_element(element_id: int, db: Session = Depends(get_db)):
-    db_manager.delete_element(element_id)
+async def delete_element(element_id: int):
+    await async_db.run(lambda db: db_manager.delete_element(element_id, session=db))
     return {"message": "Element deleted successfully"}
 
+@app.post("/elements/bulk")
+async def bulk_elements(bulk: ElementBulk):
+    return await run_bulk(bulk, db_manager.bulk_elements)
+
 # Annotation endpoints
 @app.post("/annotations/", response_model=AnnotationResponse)
-def create_annotation(annotation: AnnotationCreate, db: Session = Depends(get_db)):
-    new_annotation = db_manager.create_annotation(annotation.element_id, annotation.code_id)
+async def create_annotation(annotation: AnnotationCreate):
+    new_annotation = await async_db.run(lambda db: db_manager.create_annotation(annotation.element_id, annotation.code_id, session=db), AnnotationResponse)
     if new_annotation is None:
         raise HTTPException(status_code=400, detail="Failed to create annotation")
     return new_annotation
 
 @app.post("/batch_annotations/", response_model=List[AnnotationResponse])
-def create_batch_annotations(batch_data: BatchAnnotationCreate, db: Session = Depends(get_db)):
-    new_annotations: List[AnnotationResponse] = []
-    for element_id in batch_data.element_ids:
-        for code_id in batch_data.code_ids:
-            annotation = db_manager.create_annotation(element_id, code_id)
-            if annotation:
-                new_annotations.append(annotation)
-    
-    return new_annotations
+async def create_batch_annotations(batch_data: BatchAnnotationCreate):
+    try:
+        return await async_db.run(
+            lambda db: db_manager.create_batch_annotations(batch_data.element_ids, batch_data.code_ids, session=db), List[AnnotationResponse]
+        )
+    except Exception as e:
+        logger.error(f"Error in batch annotation creation: {str(e)}")
+        raise HTTPException(status_code=500, detail="An error occurred during batch annotation creation")
 
 @app.delete("/batch_annotations/", response_model=List[AnnotationResponse])
-def remove_batch_annotations(batch_data: BatchAnnotationRemove, db: Session = Depends(get_db)):
+async def remove_batch_annotations(batch_data: BatchAnnotationRemove):
     try:
-        removed_annotations: List[AnnotationResponse] = []
-        for element_id in batch_data.element_ids:
-            for code_id in batch_data.code_ids:
-                # Get annotations for the specific element and code
-                annotations = db_manager.get_annotations_for_element_and_code(element_id, code_id)
-                for annotation in annotations:
-                    # Remove the annotation
-                    db_manager.delete_annotation(annotation.annotation_id)
-                    # Append to the list of removed annotations
-                    removed_annotations.append(AnnotationResponse(
-                        annotation_id=annotation.annotation_id,
-                        element_id=annotation.element_id,
-                        code_id=annotation.code_id,
-                        code=annotation.code
-                    ))
-        
-        return removed_annotations
+        return await async_db.run(
+            lambda db: db_manager.delete_batch_annotations(batch_data.element_ids, batch_data.code_ids, session=db), List[AnnotationResponse]
+        )
     except Exception as e:
         logger.error(f"Error in batch annotation removal: {str(e)}")
         raise HTTPException(status_code=500, detail="An error occurred during batch annotation removal")
 
 @app.get("/annotations/", response_model=List[AnnotationResponse])
-def read_annotations(db: Session = Depends(get_db)):
-    annotations = db_manager.read_all_annotations()
-    return annotations
+async def read_annotations():
+    return await async_db.run(lambda db: db_manager.read_all_annotations(session=db), List[AnnotationResponse])
 
 @app.get("/annotations/{annotation_id}", response_model=AnnotationResponse)
-def read_annotation(annotation_id: int, db: Session = Depends(get_db)):
-    annotation = db_manager.read_annotation(annotation_id)
+async def read_annotation(annotation_id: int):
+    annotation = await async_db.run(lambda db: db_manager.read_annotation(annotation_id, session=db), AnnotationResponse)
     if annotation is None:
         raise HTTPException(status_code=404, detail="Annotation not found")
     return annotation
 
 @app.put("/annotations/{annotation_id}", response_model=AnnotationResponse)
-def update_annotation(annotation_id: int, annotation: AnnotationUpdate, db: Session = Depends(get_db)):
-    db_manager.update_annotation(annotation_id, annotation.element_id, annotation.code_id)
-    updated_annotation = db_manager.read_annotation(annotation_id)
+async def update_annotation(annotation_id: int, annotation: AnnotationUpdate):
+    def update(db: Session) -> Any:
+        db_manager.update_annotation(annotation_id, annotation.element_id, annotation.code_id, session=db)
+        return db_manager.read_annotation(annotation_id, session=db)
+
+    updated_annotation = await async_db.run(update, AnnotationResponse)
     if updated_annotation is None:
         raise HTTPException(status_code=404, detail="Annotation not found")
     return updated_annotation
 
 @app.delete("/annotations/{annotation_id}")
-def delete_annotation(annotation_id: int, db: Session = Depends(get_db)):
-    db_manager.delete_annotation(annotation_id)
+async def delete_annotation(annotation_id: int):
+    await async_db.run(lambda db: db_manager.delete_annotation(annotation_id, session=db))
     return {"message": "Annotation deleted successfully"}
 
 # Additional endpoints
 @app.post("/merge_codes/")
-def merge_codes(code_a_id: int, code_b_id: int, db: Session = Depends(get_db)):
-    merged_code = db_manager.merge_codes(code_a_id, code_b_id)
+async def merge_codes(code_a_id: int, code_b_id: int):
+    merged_code = await async_db.run(lambda db: db_manager.merge_codes(code_a_id, code_b_id, session=db), CodeResponse)
     return {"message": f"Successfully merged Code {code_a_id} into Code {code_b_id}: \n {merged_code}"}
 
+@app.post("/merge_codes/batch", response_model=CodeResponse)
+async def merge_codes_batch(merge_data: MergeCodesBatch):
+    merged_code = await async_db.run(
+        lambda db: db_manager.merge_codes_batch(merge_data.source_code_ids, merge_data.target_code_id, session=db), CodeResponse
+    )
+    if merged_code is None:
+        raise HTTPException(status_code=400, detail="Failed to merge codes")
+    return merged_code
+
 @app.get("/annotations_for_code/{code_id}", response_model=List[AnnotationResponse])
-def get_annotations_for_code(code_id: int, db: Session = Depends(get_db)):
-    annotations = db_manager.get_annotations_for_code(code_id)
-    return annotations
+async def get_annotations_for_code(code_id: int):
+    return await async_db.run(lambda db: db_manager.get_annotations_for_code(code_id, session=db), List[AnnotationResponse])
+
+@app.get("/cooccurrence/", response_model=List[CooccurrenceResponse])
+async def read_cooccurrence(
+    min_count: int = Query(1, ge=1),
+    series_ids: Optional[str] = Query(None),
+    segment_ids: Optional[str] = Query(None),
+    limit: int = Query(1000, ge=1, le=100000),
+):
+    series_id_list = [int(id) for id in series_ids.split(",")] if series_ids else []
+    segment_id_list = [int(id) for id in segment_ids.split(",")] if segment_ids else []
+    return await async_db.run(
+        lambda db: db_manager.read_cooccurrences(min_count, series_id_list, segment_id_list, limit, session=db), List[CooccurrenceResponse]
+    )
 
-@app.get("/search_elements/", response_model=List[ElementResponse])
-def search_elements(
+@app.get("/search_elements/", response_model=Union[List[ElementResponse], SearchElementsResponse, CompactElementsResponse])
+async def search_elements(
     response: Response,
     search_term: str = Query("", min_length=0),
     series_ids: Optional[str] = Query(None),
@@ -488,27 +770,213 @@ def search_elements(
     code_ids: Optional[str] = Query(None),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db)
+    search_mode: str = Query("like", pattern="^(fulltext|like)$"),
+    order_by: str = Query("element_id", pattern="^(element_id|rank)$"),
+    cursor: Optional[str] = Query(None, description="Keyset pagination cursor from X-Next-Cursor, pass an empty value for the first page"),
+    facets: Optional[str] = Query(None, pattern="^(series|segment|code)(,(series|segment|code))*$", description="Comma separated facets to count, wraps the response in an object"),
+    format: str = Query("full", pattern="^(full|compact)$", description="compact returns code and segment ids with side tables instead of nested objects"),
 ):
+    shape = "compact" if format == "compact" else "dicts"
     series_id_list = [int(id) for id in series_ids.split(",")] if series_ids else []
     segment_id_list = [int(id) for id in segment_ids.split(",")] if segment_ids else []
     code_id_list = [int(id) for id in code_ids.split(",")] if code_ids else []
 
-    elements = db_manager.search_elements(
-        search_term, series_id_list, segment_id_list, code_id_list, skip, limit
-    )
-    if elements is None:
-        raise HTTPException(status_code=500, detail="Error searching elements")
-    
-    # Get total count for pagination
-    total_count = db_manager.count_elements(search_term, series_id_list, segment_id_list, code_id_list)
-    
+    def search(db: Session) -> tuple[Any, Optional[str], int, Optional[dict[str, Any]]]:
+        next_cursor = None
+        if cursor is not None:
+            try:
+                elements, next_cursor = db_manager.search_elements_keyset(
+                    search_term, series_id_list, segment_id_list, code_id_list, cursor, limit, search_mode, order_by, shape=shape, session=db
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        else:
+            elements = db_manager.search_elements(
+                search_term, series_id_list, segment_id_list, code_id_list, skip, limit, search_mode, order_by, shape=shape, session=db
+            )
+            if elements is None:
+                raise HTTPException(status_code=500, detail="Error searching elements")
+
+        # Get total count for pagination, along with the facet counts if requested
+        facet_counts = None
+        if facets:
+            facet_counts = db_manager.count_facets(
+                search_term, series_id_list, segment_id_list, code_id_list, search_mode, facets.split(","), session=db
+            )
+            total_count = facet_counts.pop("total")
+        else:
+            total_count = db_manager.count_elements(search_term, series_id_list, segment_id_list, code_id_list, search_mode, session=db)
+        return elements, next_cursor, total_count, facet_counts
+
+    elements, next_cursor, total_count, facet_counts = await async_db.run(search)
+
     # Add pagination headers
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     response.headers["X-Total-Count"] = str(total_count)
     response.headers["X-Limit"] = str(limit)
     response.headers["X-Skip"] = str(skip)
     
-    return elements
+    # Elements are plain dicts shaped like the response models, encoded directly
+    if format == "compact":
+        page = {**elements, "total_count": total_count}
+        if facet_counts is not None:
+            page["facets"] = facet_counts
+        return FastJSONResponse(page, headers=dict(response.headers))
+    if facet_counts is not None:
+        return FastJSONResponse({"elements": elements, "total_count": total_count, "facets": facet_counts}, headers=dict(response.headers))
+    return FastJSONResponse(elements, headers=dict(response.headers))
+
+def job_response(job: Any) -> AutoannotationJobResponse:
+    rates = {"elements_per_second": elements_per_second(job), "cache_hit_rate": cache_hit_rate(job)}
+    return AutoannotationJobResponse.model_validate(
+        {**{c: getattr(job, c) for c in AutoannotationJobResponse.model_fields if c not in rates}, **rates}
+    )
+
+@app.post("/autoannotate/jobs", response_model=AutoannotationJobResponse, status_code=202)
+def create_autoannotation_job(job_data: AutoannotationJobCreate, db: Session = Depends(get_db)):
+    if not 1 <= job_data.batch_size <= 500:
+        raise HTTPException(status_code=400, detail="batch_size must be between 1 and 500")
+    job = db_manager.create_autoannotation_job(
+        job_data.model, job_data.element_ids, job_data.code_ids, job_data.batch_size, session=db
+    )
+    # The worker reads the job with its own session, make it visible first
+    db.commit()
+    autoannotation_runner.submit(job.job_id)
+    return job_response(job)
+
+@app.get("/autoannotate/jobs", response_model=List[AutoannotationJobResponse])
+def read_autoannotation_jobs(db: Session = Depends(get_db)):
+    return [job_response(job) for job in db_manager.read_all_autoannotation_jobs(session=db)]
+
+@app.get("/autoannotate/jobs/{job_id}", response_model=AutoannotationJobResponse)
+def read_autoannotation_job(job_id: int, db: Session = Depends(get_db)):
+    job = db_manager.read_autoannotation_job(job_id, session=db)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job)
+
+@app.post("/autoannotate/jobs/{job_id}/cancel", response_model=AutoannotationJobResponse)
+def cancel_autoannotation_job(job_id: int, db: Session = Depends(get_db)):
+    job = db_manager.read_autoannotation_job(job_id, session=db)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not autoannotation_runner.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job is already {job.status}")
+    # The runner commits "cancelling", or "cancelled" for a job nothing is
+    # working on, in its own session. Read the job again outside this
+    # request's transaction to see it.
+    return job_response(db_manager.read_autoannotation_job(job_id))
+
+# Newline-delimited JSON, encoded and sent a chunk of rows at a time
+def ndjson_response(rows: Iterator[dict[str, Any]], chunk_size: int = 500) -> StreamingResponse:
+    def chunks() -> Iterator[bytes]:
+        lines = []
+        for row in rows:
+            lines.append(dumps(row))
+            if len(lines) >= chunk_size:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+
+    return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+@app.get("/stream/elements")
+def stream_elements(
+    search_term: str = Query("", min_length=0),
+    series_ids: Optional[str] = Query(None),
+    segment_ids: Optional[str] = Query(None),
+    code_ids: Optional[str] = Query(None),
+    search_mode: str = Query("like", pattern="^(fulltext|like)$"),
+):
+    series_id_list = [int(id) for id in series_ids.split(",")] if series_ids else []
+    segment_id_list = [int(id) for id in segment_ids.split(",")] if segment_ids else []
+    code_id_list = [int(id) for id in code_ids.split(",")] if code_ids else []
+    return ndjson_response(db_manager.stream_elements(search_term, series_id_list, segment_id_list, code_id_list, search_mode))
+
+@app.get("/stream/annotations")
+def stream_annotations(
+    search_term: str = Query("", min_length=0),
+    series_ids: Optional[str] = Query(None),
+    segment_ids: Optional[str] = Query(None),
+    code_ids: Optional[str] = Query(None),
+    search_mode: str = Query("like", pattern="^(fulltext|like)$"),
+):
+    series_id_list = [int(id) for id in series_ids.split(",")] if series_ids else []
+    segment_id_list = [int(id) for id in segment_ids.split(",")] if segment_ids else []
+    code_id_list = [int(id) for id in code_ids.split(",")] if code_ids else []
+    return ndjson_response(db_manager.stream_annotations(search_term, series_id_list, segment_id_list, code_id_list, search_mode))
+
+# Transcript bodies up to this size stay in memory while they are ingested,
+# larger ones are spooled to a temporary file
+TRANSCRIPT_SPOOL_SIZE = 8 * 1024 * 1024
+
+@app.post("/transcripts/", status_code=201)
+async def upload_transcript(
+    request: Request,
+    segment_title: str = Query(..., min_length=1),
+    series_title: str = Query(..., min_length=1),
+    filename: Optional[str] = Query(None, description="Name of the uploaded file, used to guess the format"),
+    format: Optional[str] = Query(None, pattern="^(txt|srt|vtt|csv)$"),
+    split: str = Query("sentence", pattern="^(sentence|turn|line)$"),
+    max_chars: int = Query(DEFAULT_MAX_CHARS, ge=50, le=100000),
+):
+    # The request body is the transcript file itself, UTF-8 encoded. The
+    # whole body is buffered first, in memory up to TRANSCRIPT_SPOOL_SIZE and
+    # on disk past that, then split and inserted a line at a time on the
+    # threadpool. Writes go through the threadpool too, once the spool has
+    # rolled over to disk they block.
+    spool = tempfile.SpooledTemporaryFile(max_size=TRANSCRIPT_SPOOL_SIZE)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(spool.write, chunk)
+        spool.seek(0)
+        lines = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        result = await run_in_threadpool(
+            ingest_transcript,
+            engine,
+            lines,
+            segment_title,
+            series_title,
+            format or guess_format(filename or ""),
+            split,
+            max_chars,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        spool.close()
+    db_manager.invalidate_read_cache()
+    return result
+
+# Static dashboard exports are written below this directory
+EXPORT_DIR = os.environ.get("KANOT_EXPORT_DIR", "export")
+
+@app.post("/export/")
+def export_dashboard(export_data: ExportRequest):
+    if not export_data.name.replace("-", "").replace("_", "").isalnum():
+        raise HTTPException(status_code=400, detail="Export name may only contain letters, digits, '-' and '_'")
+    if export_data.compression not in COMPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"Compression must be one of {', '.join(COMPRESSIONS)}")
+    try:
+        return export_project(engine, os.path.join(EXPORT_DIR, export_data.name), export_data.compression)
+    except Exception as e:
+        logger.error(f"Error exporting project: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error exporting project")
+
+@app.get("/stats/requests")
+def read_request_stats():
+    return request_metrics.to_dict()
+
+@app.delete("/stats/requests")
+def reset_request_stats():
+    request_metrics.reset()
+    return {"message": "Request statistics reset"}
+
+@app.get("/metrics")
+def read_metrics():
+    return Response(content=render_metrics(db_manager), media_type=METRICS_CONTENT_TYPE)
 
 
 if __name__ == "__main__":
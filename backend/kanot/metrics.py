@@ -0,0 +1,92 @@
+# Prometheus text exposition of the counters and histograms kept by
+# instrumentation.py. Everything on the request path is an in-memory
+# increment; database sizes and job counts are only read when /metrics is
+# scraped.
+from typing import Any, Iterator
+
+from .db.crud import DatabaseManager
+from .instrumentation import (
+    Counter,
+    Histogram,
+    annotation_batch_sizes,
+    annotations_created,
+    annotations_deleted,
+    pool_checkout_wait,
+    request_metrics,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _labels(labels: dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+def _header(name: str, kind: str, help: str) -> Iterator[str]:
+    yield f"# HELP {name} {help}"
+    yield f"# TYPE {name} {kind}"
+
+def _histogram(name: str, histogram: Histogram, **labels: Any) -> Iterator[str]:
+    counts, count, total = histogram.snapshot()
+    cumulative = 0
+    for bound, bucket_count in zip(histogram.buckets, counts):
+        cumulative += bucket_count
+        yield f"{name}_bucket{_labels({**labels, 'le': bound})} {cumulative}"
+    yield f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {count}"
+    yield f"{name}_sum{_labels(labels)} {total}"
+    yield f"{name}_count{_labels(labels)} {count}"
+
+def _counter(name: str, counter: Counter, help: str) -> Iterator[str]:
+    yield from _header(name, "counter", help)
+    yield f"{name} {counter.value}"
+
+def _gauges(name: str, help: str, values: dict[str, Any], label: str) -> Iterator[str]:
+    yield from _header(name, "gauge", help)
+    for key, value in sorted(values.items()):
+        yield f"{name}{_labels({label: key})} {value}"
+
+def collect(db_manager: DatabaseManager) -> Iterator[str]:
+    endpoints = [(endpoint.split(" ", 1), metrics) for endpoint, metrics in request_metrics.items()]
+
+    yield from _header("kanot_http_request_duration_seconds", "histogram", "Request latency per route")
+    for (method, route), metrics in endpoints:
+        yield from _histogram("kanot_http_request_duration_seconds", metrics.duration, method=method, route=route)
+    yield from _header("kanot_http_request_sql_seconds", "histogram", "Time spent executing SQL per request")
+    for (method, route), metrics in endpoints:
+        yield from _histogram("kanot_http_request_sql_seconds", metrics.sql_duration, method=method, route=route)
+    yield from _header("kanot_http_request_queries", "histogram", "SQL statements per request")
+    for (method, route), metrics in endpoints:
+        yield from _histogram("kanot_http_request_queries", metrics.queries, method=method, route=route)
+    yield from _header("kanot_http_request_errors_total", "counter", "Requests answered with a 5xx status")
+    for (method, route), metrics in endpoints:
+        yield f"kanot_http_request_errors_total{_labels({'method': method, 'route': route})} {metrics.errors}"
+
+    yield from _counter("kanot_annotations_created_total", annotations_created, "Annotations created")
+    yield from _counter("kanot_annotations_deleted_total", annotations_deleted, "Annotations deleted")
+    yield from _header("kanot_annotation_batch_size", "histogram", "Element and code pairs per batch annotation request")
+    for operation, histogram in sorted(annotation_batch_sizes.items()):
+        yield from _histogram("kanot_annotation_batch_size", histogram, operation=operation)
+
+    yield from _header("kanot_db_pool_checkout_wait_seconds", "histogram", "Time waiting for a pooled database connection")
+    yield from _histogram("kanot_db_pool_checkout_wait_seconds", pool_checkout_wait)
+    pool = db_manager.engine.pool
+    if hasattr(pool, "checkedout"):
+        yield from _gauges("kanot_db_pool_connections", "Pooled connections by state", {
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+        }, "state")
+
+    stats = db_manager.database_stats()
+    if stats:
+        yield from _gauges("kanot_sqlite_bytes", "SQLite database, free page, page cache and write-ahead log sizes", {
+            name.removesuffix("_bytes"): value for name, value in stats.items()
+        }, "kind")
+
+    jobs = db_manager.count_autoannotation_jobs()
+    if jobs:
+        yield from _gauges("kanot_autoannotation_jobs", "Autoannotation jobs by status; queued is the queue depth", jobs, "status")
+
+def render(db_manager: DatabaseManager) -> str:
+    return "\n".join(collect(db_manager)) + "\n"
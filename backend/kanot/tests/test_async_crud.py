@@ -0,0 +1,54 @@
+import asyncio
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+
+from ..db.async_crud import AsyncDatabaseManager
+from ..db.crud import DatabaseManager
+from ..db.engine import create_async_database_engine, create_database_engine
+
+
+class CodeTypeModel(BaseModel):
+    type_id: int
+    type_name: str
+
+    class Config:
+        from_attributes = True
+
+@pytest.fixture(params=["async", "threadpool"])
+def async_db(request, tmp_path):
+    url = f"sqlite:///{tmp_path / 'kanot.db'}"
+    db_manager = DatabaseManager(create_database_engine(url, environ={}))
+    engine = create_async_database_engine(url, environ={}) if request.param == "async" else None
+    manager = AsyncDatabaseManager(db_manager, engine)
+    yield manager
+    asyncio.run(manager.dispose())
+
+def test_run_commits_and_validates(async_db: AsyncDatabaseManager) -> None:
+    db_manager = async_db.db_manager
+    created = asyncio.run(async_db.run(lambda db: db_manager.create_code_type("Person", session=db), CodeTypeModel))
+    assert created == CodeTypeModel(type_id=1, type_name="Person")
+    # Visible to the sync manager once the unit of work has committed
+    assert db_manager.read_code_type(1).type_name == "Person"
+    assert asyncio.run(async_db.run(lambda db: db_manager.read_code_type(2, session=db), Optional[CodeTypeModel])) is None
+
+def test_run_rolls_back_on_error(async_db: AsyncDatabaseManager) -> None:
+    db_manager = async_db.db_manager
+
+    def failing(db):
+        db_manager.create_code_type("Place", session=db)
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(async_db.run(failing))
+    assert db_manager.read_all_code_types() == []
+
+def test_writes_invalidate_read_cache(async_db: AsyncDatabaseManager) -> None:
+    db_manager = async_db.db_manager
+    version = db_manager.data_version
+    asyncio.run(async_db.run(lambda db: db_manager.create_code_type("Event", session=db)))
+    assert db_manager.data_version == version + 1
+
+def test_no_async_engine_for_in_memory_database() -> None:
+    assert create_async_database_engine("sqlite:///:memory:", environ={}) is None
@@ -0,0 +1,147 @@
+import json
+import threading
+from pathlib import Path
+
+import pytest
+
+from ..autoannotate import AutoannotationRunner
+from ..db.crud import DatabaseManager
+from ..db.engine import create_database_engine
+from ..llm import FakeModelClient, ModelClient, TransientModelError, build_prompt, parse_response
+
+
+@pytest.fixture
+def db_manager(tmp_path: Path) -> DatabaseManager:
+    # Workers use their own connections, so the database has to be a file
+    db_manager = DatabaseManager(create_database_engine(f"sqlite:///{tmp_path / 'kanot.db'}"))
+    db_manager.create_code_type("Type")
+    db_manager.create_series("Series")
+    db_manager.create_segment(1, "Segment")
+    db_manager.create_code("Conflict", None, 1, None, None)
+    db_manager.create_code("Peace", None, 1, None, None)
+    for text in ["A conflict broke out", "Peace was made", "Conflict and peace", "Nothing here"]:
+        db_manager.create_element(text, 1)
+    return db_manager
+
+def run_job(db_manager: DatabaseManager, client: ModelClient, batch_size: int = 2, **options) -> int:
+    runner = AutoannotationRunner(db_manager, client_factory=lambda model: client, base_delay=0, **options)
+    job = db_manager.create_autoannotation_job("fake", [], [], batch_size)
+    runner.submit(job.job_id)
+    runner.wait(job.job_id)
+    runner.shutdown()
+    return job.job_id
+
+def annotation_pairs(db_manager: DatabaseManager) -> set[tuple[int, int]]:
+    return {(a.element_id, a.code_id) for a in db_manager.read_all_annotations()}
+
+def test_prompt_round_trip() -> None:
+    prompt = build_prompt([(1, "Conflict", "Armed struggle")], [(3, "A conflict\nbroke out")])
+    assert "1: Conflict - Armed struggle" in prompt
+    assert "[3] A conflict broke out" in prompt
+    text, _, _ = FakeModelClient().complete(prompt)
+    assert parse_response("Sure:\n```json\n" + text + "\n```") == {3: [1]}
+
+def test_job_annotates_all_elements(db_manager: DatabaseManager) -> None:
+    job_id = run_job(db_manager, FakeModelClient())
+    job = db_manager.read_autoannotation_job(job_id)
+    assert job.status == "completed"
+    assert job.total_elements == 4
+    assert job.processed_elements == 4
+    assert job.model_calls == 2
+    assert job.annotations_created == 4
+    assert job.prompt_tokens > 0
+    assert annotation_pairs(db_manager) == {(1, 1), (2, 2), (3, 1), (3, 2)}
+    assert len(db_manager.read_cooccurrences()) == 1
+
+def test_job_is_idempotent(db_manager: DatabaseManager) -> None:
+    run_job(db_manager, FakeModelClient())
+    job_id = run_job(db_manager, FakeModelClient())
+    assert db_manager.read_autoannotation_job(job_id).annotations_created == 0
+    assert len(annotation_pairs(db_manager)) == 4
+
+def test_job_retries_transient_errors(db_manager: DatabaseManager) -> None:
+    class Flaky(FakeModelClient):
+        def complete(self, prompt: str):
+            if self.calls < 2:
+                self.calls += 1
+                raise TransientModelError("Rate limited")
+            return super().complete(prompt)
+
+    job_id = run_job(db_manager, Flaky(), batch_size=4)
+    job = db_manager.read_autoannotation_job(job_id)
+    assert job.status == "completed"
+    assert job.model_calls == 3
+    assert len(annotation_pairs(db_manager)) == 4
+
+def test_job_fails_after_retries(db_manager: DatabaseManager) -> None:
+    job_id = run_job(db_manager, FakeModelClient(failure_rate=1.0), max_retries=2)
+    job = db_manager.read_autoannotation_job(job_id)
+    assert job.status == "failed"
+    assert "rate limit" in job.error
+    assert annotation_pairs(db_manager) == set()
+
+def test_cancel_job(db_manager: DatabaseManager) -> None:
+    started = threading.Event()
+    release = threading.Event()
+
+    class Blocking(FakeModelClient):
+        def complete(self, prompt: str):
+            started.set()
+            release.wait(5)
+            return super().complete(prompt)
+
+    runner = AutoannotationRunner(db_manager, client_factory=lambda model: Blocking(), max_concurrency=1)
+    job = db_manager.create_autoannotation_job("fake", [], [], 1)
+    runner.submit(job.job_id)
+    assert started.wait(5)
+    assert runner.cancel(job.job_id)
+    assert db_manager.read_autoannotation_job(job.job_id).status == "cancelling"
+    release.set()
+    runner.wait(job.job_id)
+    runner.shutdown()
+
+    job = db_manager.read_autoannotation_job(job.job_id)
+    assert job.status == "cancelled"
+    assert job.processed_elements == 1
+    assert not runner.cancel(job.job_id)
+
+def test_job_limits_elements_and_codes(db_manager: DatabaseManager) -> None:
+    runner = AutoannotationRunner(db_manager, client_factory=lambda model: FakeModelClient())
+    job = db_manager.create_autoannotation_job("fake", [1, 3], [2], 10)
+    assert json.loads(job.element_ids) == [1, 3]
+    runner.submit(job.job_id)
+    runner.wait(job.job_id)
+    runner.shutdown()
+    assert annotation_pairs(db_manager) == {(3, 2)}
+
+def test_recover_fails_interrupted_jobs(db_manager: DatabaseManager) -> None:
+    running = db_manager.create_autoannotation_job("fake", [], [], 10)
+    queued = db_manager.create_autoannotation_job("fake", [], [], 10)
+    db_manager.update_autoannotation_job(running.job_id, status="running")
+
+    runner = AutoannotationRunner(db_manager, client_factory=lambda model: FakeModelClient())
+    runner.recover()
+    runner.wait(queued.job_id)
+    runner.shutdown()
+    assert db_manager.read_autoannotation_job(running.job_id).status == "failed"
+    assert db_manager.read_autoannotation_job(queued.job_id).status == "completed"
+
+def test_rerun_hits_prompt_cache(db_manager: DatabaseManager) -> None:
+    run_job(db_manager, FakeModelClient())
+    client = FakeModelClient()
+    job_id = run_job(db_manager, client)
+    job = db_manager.read_autoannotation_job(job_id)
+    assert client.calls == 0
+    assert (job.cache_hits, job.cache_misses, job.model_calls) == (4, 0, 0)
+
+    # A codebook edit invalidates the cached answers
+    db_manager.update_code(2, description="Absence of war")
+    job_id = run_job(db_manager, client)
+    job = db_manager.read_autoannotation_job(job_id)
+    assert (job.cache_hits, job.cache_misses, job.model_calls) == (0, 4, 2)
+
+def test_prompt_cache_evicts_least_recently_used(db_manager: DatabaseManager) -> None:
+    db_manager.write_prompt_cache({"a": [1], "b": [2]}, max_entries=2)
+    db_manager.read_prompt_cache(["a"])
+    db_manager.write_prompt_cache({"c": [3]}, max_entries=2)
+    assert db_manager.read_prompt_cache(["a", "b", "c"]) == {"a": [1], "c": [3]}
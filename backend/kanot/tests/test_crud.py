@@ -2,7 +2,8 @@ import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.engine import Engine
 
-from ..db.crud import DatabaseManager
+from ..db.crud import DatabaseManager, to_fulltext_query
+from ..db.schema import CodeSegmentUsage, CodeUsage, Segment, Series
 
 
 @pytest.fixture
@@ -13,6 +14,7 @@ def db_engine() -> Engine:
 def db_manager(db_engine: Engine) -> DatabaseManager:
     return DatabaseManager(db_engine)
 
+
 # CodeType tests
 
 def test_create_code_type(db_manager: DatabaseManager) -> None:
@@ -48,6 +50,7 @@ def test_delete_code_type(db_manager: DatabaseManager) -> None:
     code_type = db_manager.read_code_type(1)
     assert code_type is None
 
+
 # Code tests
 
 def test_create_code(db_manager: DatabaseManager) -> None:
@@ -88,6 +91,7 @@ def test_delete_code(db_manager: DatabaseManager) -> None:
     code = db_manager.read_code(1)
     assert code is None
 
+
 # Segment tests
 
 def test_create_segment(db_manager: DatabaseManager) -> None:
@@ -123,6 +127,7 @@ def test_delete_segment(db_manager: DatabaseManager) -> None:
     segment = db_manager.read_segment("EP001")
     assert segment is None
 
+
 # Element tests
 
 def test_create_element(db_manager: DatabaseManager) -> None:
@@ -163,6 +168,7 @@ def test_delete_element(db_manager: DatabaseManager) -> None:
     element = db_manager.read_element(1)
     assert element is None
 
+
 # Annotation tests
 
 def test_create_annotation(db_manager: DatabaseManager) -> None:
@@ -236,6 +242,7 @@ def test_delete_annotation(db_manager: DatabaseManager) -> None:
     annotation = db_manager.read_annotation(1)
     assert annotation is None
 
+
 # Merge codes test
 
 def test_merge_codes(db_manager: DatabaseManager) -> None:
@@ -275,6 +282,7 @@ def test_merge_codes(db_manager: DatabaseManager) -> None:
     element_ids = set(annotation.element_id for annotation in annotations)
     assert element_ids == {1, 2}
 
+
 # Integrity error handling test
 
 def test_integrity_error_handling(db_manager: DatabaseManager) -> None:
@@ -291,4 +299,580 @@ def test_integrity_error_handling(db_manager: DatabaseManager) -> None:
     db_manager.create_element("Test element", "EP001")  # Should not raise an exception, but print a message
 
     db_manager.create_annotation(1, 1)
-    db_manager.create_annotation(1, 1)  # Should not raise an exception, but print a message
\ No newline at end of file
+    db_manager.create_annotation(1, 1)  # Should not raise an exception, but print a message
+
+
+# Search tests
+
+@pytest.fixture
+def search_db(db_manager: DatabaseManager) -> DatabaseManager:
+    session = db_manager.Session()
+    session.add(Series(series_id=1, series_title="Test Series"))
+    session.add(Segment(segment_id=1, segment_title="Test Segment", series_id=1))
+    session.commit()
+    session.close()
+    db_manager.create_element("The conflict started in the north", 1)
+    db_manager.create_element("Peace talks about the conflicted region", 1)
+    db_manager.create_element("Nothing to see here", 1)
+    db_manager.create_element("conflict conflict conflict", 1)
+    return db_manager
+
+def test_to_fulltext_query() -> None:
+    assert to_fulltext_query("conflict") == '"conflict"*'
+    assert to_fulltext_query('"peace talks" north') == '"peace talks" "north"*'
+    assert to_fulltext_query('ab"c AND') == '"abc"* "AND"*'
+    assert to_fulltext_query(" ?! ") == ""
+
+def test_search_elements_fulltext(search_db: DatabaseManager) -> None:
+    assert search_db.fulltext_enabled
+    elements = search_db.search_elements("confl", search_mode="fulltext")
+    assert [element.element_id for element in elements] == [1, 2, 4]
+    assert search_db.count_elements("confl", search_mode="fulltext") == 3
+
+def test_search_elements_fulltext_phrase(search_db: DatabaseManager) -> None:
+    elements = search_db.search_elements('"peace talks"', search_mode="fulltext")
+    assert [element.element_id for element in elements] == [2]
+    assert search_db.search_elements('"talks peace"', search_mode="fulltext") == []
+
+def test_search_elements_fulltext_rank(search_db: DatabaseManager) -> None:
+    elements = search_db.search_elements("conflict", search_mode="fulltext", order_by="rank")
+    assert elements[0].element_id == 4
+    assert {element.element_id for element in elements} == {1, 2, 4}
+
+def test_search_elements_like(search_db: DatabaseManager) -> None:
+    elements = search_db.search_elements("onflict")
+    assert [element.element_id for element in elements] == [1, 2, 4]
+    assert search_db.count_elements("onflict") == 3
+    assert search_db.search_elements("onflict", search_mode="fulltext") == []
+
+def test_fulltext_index_follows_element_writes(search_db: DatabaseManager) -> None:
+    search_db.update_element(3, element_text="A new conflict")
+    search_db.delete_element(1)
+    elements = search_db.search_elements("conflict", search_mode="fulltext")
+    assert [element.element_id for element in elements] == [2, 3, 4]
+
+
+# Batch annotation tests
+
+def test_create_batch_annotations(db_manager: DatabaseManager) -> None:
+    db_manager.create_code_type("Test Type")
+    db_manager.create_code("Code A", "Description A", 1, "Reference A", "Coordinates A")
+    db_manager.create_code("Code B", "Description B", 1, "Reference B", "Coordinates B")
+    db_manager.create_element("Test element 1", 1)
+    db_manager.create_element("Test element 2", 1)
+    db_manager.create_annotation(1, 1)
+
+    annotations = db_manager.create_batch_annotations([1, 2, 3], [1, 2])
+    assert {(a.element_id, a.code_id) for a in annotations} == {(1, 2), (2, 1), (2, 2)}
+    assert all(a.code is not None and a.code.code_type.type_name == "Test Type" for a in annotations)
+    assert len(db_manager.read_all_annotations()) == 4
+    assert db_manager.create_batch_annotations([1, 2], [1, 2]) == []
+
+def test_delete_batch_annotations(db_manager: DatabaseManager) -> None:
+    db_manager.create_code_type("Test Type")
+    db_manager.create_code("Code A", "Description A", 1, "Reference A", "Coordinates A")
+    db_manager.create_code("Code B", "Description B", 1, "Reference B", "Coordinates B")
+    db_manager.create_element("Test element 1", 1)
+    db_manager.create_element("Test element 2", 1)
+    db_manager.create_batch_annotations([1, 2], [1, 2])
+
+    removed = db_manager.delete_batch_annotations([1, 2], [2])
+    assert {(a.element_id, a.code_id) for a in removed} == {(1, 2), (2, 2)}
+    assert all(a.code is not None and a.code.term == "Code B" for a in removed)
+    remaining = db_manager.read_all_annotations()
+    assert {(a.element_id, a.code_id) for a in remaining} == {(1, 1), (2, 1)}
+
+
+# Keyset pagination tests
+
+def test_read_elements_keyset(db_manager: DatabaseManager) -> None:
+    for i in range(5):
+        db_manager.create_element(f"Test element {i}", 1)
+    pages = []
+    cursor = None
+    while True:
+        elements, cursor = db_manager.read_elements_keyset(cursor=cursor, limit=2)
+        pages.append([element.element_id for element in elements])
+        if cursor is None:
+            break
+    assert pages == [[1, 2], [3, 4], [5]]
+
+def test_search_elements_keyset_limits_distinct_elements(search_db: DatabaseManager) -> None:
+    search_db.create_code_type("Test Type")
+    search_db.create_code("Code A", "Description A", 1, "Reference A", "Coordinates A")
+    search_db.create_code("Code B", "Description B", 1, "Reference B", "Coordinates B")
+    search_db.create_batch_annotations([1, 2, 4], [1, 2])
+
+    elements, cursor = search_db.search_elements_keyset("", code_ids=[1, 2], limit=2)
+    assert [element.element_id for element in elements] == [1, 2]
+    assert all(len(element.annotations) == 2 for element in elements)
+    elements, cursor = search_db.search_elements_keyset("", code_ids=[1, 2], cursor=cursor, limit=2)
+    assert [element.element_id for element in elements] == [4]
+    assert cursor is None
+    assert search_db.count_elements("", code_ids=[1, 2]) == 3
+
+def test_search_elements_keyset_rank(search_db: DatabaseManager) -> None:
+    ranked = search_db.search_elements("conflict", search_mode="fulltext", order_by="rank")
+    element_ids = []
+    cursor = None
+    while True:
+        elements, cursor = search_db.search_elements_keyset("conflict", cursor=cursor, limit=1, search_mode="fulltext", order_by="rank")
+        element_ids += [element.element_id for element in elements]
+        if cursor is None:
+            break
+    assert element_ids == [element.element_id for element in ranked]
+
+def test_search_elements_keyset_invalid_cursor(search_db: DatabaseManager) -> None:
+    with pytest.raises(ValueError):
+        search_db.search_elements_keyset("conflict", cursor="not-a-cursor")
+    _, cursor = search_db.search_elements_keyset("conflict", limit=1)
+    with pytest.raises(ValueError):
+        search_db.search_elements_keyset("conflict", cursor=cursor, search_mode="fulltext", order_by="rank")
+
+
+# Query plan tests
+
+def test_check_query_plans(db_manager: DatabaseManager) -> None:
+    assert db_manager.check_query_plans() == []
+
+def test_check_query_plans_reports_missing_index(db_engine: Engine) -> None:
+    db_manager = DatabaseManager(db_engine)
+    with db_engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_elements_segment_id")
+    assert db_manager.check_query_plans() == ["elements_by_segment"]
+
+    # Reopening the database restores the index
+    db_manager = DatabaseManager(db_engine)
+    assert db_manager.check_query_plans() == []
+
+
+# Co-occurrence tests
+
+def cooccurrences(db_manager: DatabaseManager, **filters) -> dict[tuple[int, int], int]:
+    return {(row.code_a_id, row.code_b_id): row.count for row in db_manager.read_cooccurrences(**filters)}
+
+@pytest.fixture
+def cooccurrence_db(db_manager: DatabaseManager) -> DatabaseManager:
+    session = db_manager.Session()
+    session.add_all([Series(series_id=1, series_title="Series 1"), Series(series_id=2, series_title="Series 2")])
+    session.add_all([
+        Segment(segment_id=1, segment_title="Segment 1", series_id=1),
+        Segment(segment_id=2, segment_title="Segment 2", series_id=2),
+    ])
+    session.commit()
+    session.close()
+    db_manager.create_code_type("Test Type")
+    for term in ("Code A", "Code B", "Code C"):
+        db_manager.create_code(term, "Description", 1, "Reference", "Coordinates")
+    db_manager.create_element("Test element 1", 1)
+    db_manager.create_element("Test element 2", 1)
+    db_manager.create_element("Test element 3", 2)
+    return db_manager
+
+def test_cooccurrences_incremental(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_annotation(1, 1)
+    db.create_annotation(1, 2)
+    db.create_batch_annotations([2, 3], [1, 2, 3])
+    assert cooccurrences(db) == {(1, 2): 3, (1, 3): 2, (2, 3): 2}
+    assert cooccurrences(db, min_count=3) == {(1, 2): 3}
+    assert cooccurrences(db, series_ids=[2]) == {(1, 2): 1, (1, 3): 1, (2, 3): 1}
+    assert cooccurrences(db, segment_ids=[1]) == {(1, 2): 2, (1, 3): 1, (2, 3): 1}
+
+    db.delete_batch_annotations([3], [3])
+    db.delete_annotation(1)
+    assert cooccurrences(db) == {(1, 2): 2, (1, 3): 1, (2, 3): 1}
+
+    db.merge_codes(3, 2)
+    assert cooccurrences(db) == {(1, 2): 2}
+
+    db.update_annotation(2, element_id=3)
+    assert cooccurrences(db) == {(1, 2): 2}
+
+    expected = cooccurrences(db)
+    db.rebuild_cooccurrences()
+    assert cooccurrences(db) == expected
+
+def test_cooccurrences_follow_element_move_and_delete(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_batch_annotations([1, 2], [1, 2])
+    db.update_element(1, segment_id=2)
+    assert cooccurrences(db, segment_ids=[2]) == {(1, 2): 1}
+    expected = cooccurrences(db)
+    db.rebuild_cooccurrences()
+    assert cooccurrences(db) == expected
+
+    db.delete_element(2)
+    assert cooccurrences(db, segment_ids=[1]) == {}
+    assert [a.element_id for a in db.read_all_annotations()] == [1, 1]
+    expected = cooccurrences(db)
+    db.rebuild_cooccurrences()
+    assert cooccurrences(db) == expected
+
+def test_cooccurrences_rebuilt_for_existing_database(cooccurrence_db: DatabaseManager, db_engine: Engine) -> None:
+    cooccurrence_db.create_batch_annotations([1, 2], [1, 2])
+    with db_engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE code_cooccurrences")
+    db = DatabaseManager(db_engine)
+    assert cooccurrences(db) == {(1, 2): 2}
+
+def test_merge_codes_batch(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_code("Code D", "Description", 1, "Reference", "Coordinates")
+    db.create_batch_annotations([1], [1, 2, 3])
+    db.create_batch_annotations([2], [2, 3])
+    db.create_batch_annotations([3], [3, 4])
+
+    merged = db.merge_codes_batch([2, 3], 1)
+    assert merged is not None
+    assert merged.term == "Code A" and merged.code_type.type_name == "Test Type"
+    assert db.read_code(2) is None and db.read_code(3) is None
+    annotations = db.read_all_annotations()
+    assert sorted((a.element_id, a.code_id) for a in annotations) == [(1, 1), (2, 1), (3, 1), (3, 4)]
+    assert cooccurrences(db) == {(1, 4): 1}
+
+def test_merge_codes_batch_missing_code(cooccurrence_db: DatabaseManager) -> None:
+    assert cooccurrence_db.merge_codes_batch([2, 99], 1) is None
+    assert cooccurrence_db.merge_codes_batch([1], 1) is None
+    assert cooccurrence_db.read_code(2) is not None
+
+
+# Unit of work tests
+
+def test_unit_of_work_commits_at_end(db_manager: DatabaseManager) -> None:
+    with db_manager.unit_of_work() as session:
+        db_manager.create_code_type("Test Type", session=session)
+        db_manager.create_code("Test Code", "Description", 1, "Reference", "Coordinates", session=session)
+        db_manager.update_code(1, term="Updated Code", session=session)
+        code = db_manager.read_code(1, session=session)
+        assert code.term == "Updated Code"
+    assert code.code_type.type_name == "Test Type"
+    assert db_manager.read_code(1).term == "Updated Code"
+
+def test_unit_of_work_rolls_back_on_error(db_manager: DatabaseManager) -> None:
+    with pytest.raises(RuntimeError):
+        with db_manager.unit_of_work() as session:
+            db_manager.create_code_type("Test Type", session=session)
+            raise RuntimeError()
+    assert db_manager.read_all_code_types() == []
+
+
+# Facet tests
+
+def test_count_facets(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_batch_annotations([1, 2, 3], [1, 2])
+    db.create_annotation(3, 3)
+
+    facets = db.count_facets("")
+    assert facets == {
+        "total": 3,
+        "series": {1: 2, 2: 1},
+        "segment": {1: 2, 2: 1},
+        "code": {1: 3, 2: 3, 3: 1},
+    }
+    assert db.count_elements("") == 3
+
+    facets = db.count_facets("element", code_ids=[3], facets=["code"])
+    assert facets == {"total": 1, "code": {1: 1, 2: 1, 3: 1}}
+
+
+# Read cache tests
+
+def test_data_version_bumped_by_cached_writes(db_manager: DatabaseManager) -> None:
+    version = db_manager.data_version
+    db_manager.create_code_type("Test Type")
+    db_manager.create_code("Code A", "Description A", 1, "Reference A", "Coordinates A")
+    db_manager.create_code("Code B", "Description B", 1, "Reference B", "Coordinates B")
+    assert db_manager.data_version == version + 3
+
+    version = db_manager.data_version
+    db_manager.create_element("Test element", 1)
+    db_manager.create_annotation(1, 1)
+    db_manager.read_all_codes()
+    db_manager.create_code("Code A", "Duplicate", 1, "Reference", "Coordinates")
+    assert db_manager.data_version == version
+
+    db_manager.merge_codes(1, 2)
+    assert db_manager.data_version == version + 1
+
+    with db_manager.unit_of_work() as session:
+        db_manager.update_code(2, term="Code C", session=session)
+        assert db_manager.data_version == version + 1
+    assert db_manager.data_version == version + 2
+
+def test_read_cached(db_manager: DatabaseManager) -> None:
+    builds = []
+    def build() -> bytes:
+        builds.append(1)
+        return str(len(db_manager.read_all_code_types())).encode()
+
+    etag, body = db_manager.read_cached("code_types", build)
+    assert db_manager.read_cached("code_types", build) == (etag, body)
+    assert len(builds) == 1
+
+    db_manager.create_code_type("Test Type")
+    new_etag, body = db_manager.read_cached("code_types", build)
+    assert new_etag != etag and body == b"1"
+    assert len(builds) == 2
+
+
+# Streaming tests
+
+def test_stream_elements(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_batch_annotations([1, 3], [2, 1])
+    rows = list(db.stream_elements(batch_size=2))
+    assert rows == [
+        {"element_id": 1, "element_text": "Test element 1", "segment_id": 1, "series_id": 1, "code_ids": [1, 2]},
+        {"element_id": 2, "element_text": "Test element 2", "segment_id": 1, "series_id": 1, "code_ids": []},
+        {"element_id": 3, "element_text": "Test element 3", "segment_id": 2, "series_id": 2, "code_ids": [1, 2]},
+    ]
+    assert [row["element_id"] for row in db.stream_elements(series_ids=[1], code_ids=[1])] == [1]
+    assert [row["element_id"] for row in db.stream_elements("element 2")] == [2]
+
+def test_stream_annotations(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_batch_annotations([1, 2, 3], [1, 2])
+    pairs = lambda **filters: [(row["element_id"], row["code_id"]) for row in db.stream_annotations(**filters)]
+    assert len(pairs()) == 6
+    assert sorted(pairs(segment_ids=[2])) == [(3, 1), (3, 2)]
+    assert sorted(pairs(series_ids=[1], code_ids=[2])) == [(1, 2), (2, 2)]
+
+def test_element_dicts_match_orm(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_batch_annotations([1, 3], [1, 2])
+    elements = db.search_elements("", limit=10)
+    dicts = db.search_elements("", limit=10, shape="dicts")
+    assert [d["element_id"] for d in dicts] == [e.element_id for e in elements] == [1, 2, 3]
+    assert dicts[0]["segment"] == {"segment_id": 1, "segment_title": "Segment 1", "series": {"series_id": 1, "series_title": "Series 1"}}
+    assert dicts[1]["annotations"] == []
+    assert [a["code"]["term"] for a in dicts[2]["annotations"]] == ["Code A", "Code B"]
+    assert dicts[2]["annotations"][0]["code"]["code_type"] == {"type_id": 1, "type_name": "Test Type"}
+    # Repeated codes are built once and shared
+    assert dicts[0]["annotations"][0]["code"] is dicts[2]["annotations"][0]["code"]
+
+    page, _ = db.read_elements_keyset(None, limit=2, shape="dicts")
+    assert page == dicts[:2]
+    assert db.read_elements_paginated(skip=1, limit=1, shape="dicts") == dicts[1:2]
+
+def test_compact_element_page(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_batch_annotations([1, 3], [1, 2])
+    page = db.search_elements("", limit=10, shape="compact")
+    assert page["elements"][0] == {"element_id": 1, "element_text": "Test element 1", "segment_id": 1, "annotation_ids": [1, 2], "code_ids": [1, 2]}
+    assert page["elements"][1]["code_ids"] == []
+    assert sorted(page["codes"]) == [1, 2]
+    assert page["codes"][1]["term"] == "Code A"
+    assert page["code_types"] == {1: {"type_id": 1, "type_name": "Test Type"}}
+    assert page["segments"][2] == {"segment_id": 2, "segment_title": "Segment 2", "series_id": 2}
+    assert sorted(page["series"]) == [1, 2]
+
+    keyset, _ = db.search_elements_keyset("element 3", cursor=None, shape="compact")
+    assert [e["element_id"] for e in keyset["elements"]] == [3]
+    assert list(keyset["segments"]) == [2]
+    assert db.read_elements_paginated(skip=10, shape="compact")["elements"] == []
+
+
+# Bulk write tests
+
+def statuses(result: dict) -> list[tuple[str, int, str]]:
+    return [(r["op"], r["index"], r["status"]) for r in result["results"]]
+
+def test_bulk_elements(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_batch_annotations([1, 2, 3], [1, 2])
+    result = db.bulk_elements(
+        creates=[{"element_text": "New", "segment_id": 2}, {"element_text": "Lost", "segment_id": 9}],
+        updates=[{"element_id": 1, "element_text": "Edited", "segment_id": 2}, {"element_id": 2, "element_text": None}, {"element_id": 3}],
+        deletes=[3, 42],
+    )
+    assert statuses(result) == [
+        ("delete", 0, "ok"), ("delete", 1, "not_found"),
+        ("update", 0, "ok"), ("update", 1, "ok"), ("update", 2, "not_found"),
+        ("create", 0, "ok"), ("create", 1, "not_found"),
+    ]
+    assert (result["created"], result["updated"], result["deleted"], result["failed"]) == (1, 2, 1, 3)
+    assert [(e.element_id, e.element_text, e.segment_id) for e in db.read_all_elements()] == [
+        (1, "Edited", 2), (2, "Test element 2", 1), (result["results"][5]["element_id"], "New", 2),
+    ]
+    # Annotations of deleted elements go too, code pairs follow moved elements
+    assert sorted(a.element_id for a in db.read_all_annotations()) == [1, 1, 2, 2]
+    assert cooccurrences(db, segment_ids=[2]) == {(1, 2): 1}
+    expected = cooccurrences(db)
+    db.rebuild_cooccurrences()
+    assert cooccurrences(db) == expected
+
+def test_bulk_codes_unique_terms(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    version = db.data_version
+    db.create_batch_annotations([1], [2, 3])
+    result = db.bulk_codes(
+        creates=[
+            {"term": "Code A", "type_id": 1},
+            {"term": "Code D", "type_id": 1},
+            {"term": "Code D", "type_id": 1},
+            {"term": "Code E", "type_id": 7},
+        ],
+        # Code B is deleted and Code C renamed, freeing both terms
+        updates=[{"code_id": 3, "term": "Code B"}, {"code_id": 1, "term": "Code C", "description": "Changed"}],
+        deletes=[2],
+    )
+    assert statuses(result) == [
+        ("delete", 0, "ok"),
+        ("update", 0, "ok"), ("update", 1, "ok"),
+        ("create", 0, "ok"), ("create", 1, "ok"), ("create", 2, "conflict"), ("create", 3, "not_found"),
+    ]
+    assert [(c.code_id, c.term, c.description) for c in db.read_all_codes()] == [
+        (1, "Code C", "Changed"), (3, "Code B", "Description"), (4, "Code A", None), (5, "Code D", None),
+    ]
+    assert [a.code_id for a in db.read_all_annotations()] == [3]
+    assert cooccurrences(db) == {}
+    assert db.data_version == version + 1
+
+def test_bulk_segments(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_segment(3, "Empty")
+    # New ids continue after the highest one, deleted ids are not reused
+    result = db.bulk_segments(
+        creates=[{"segment_title": "Segment 2"}, {"segment_title": "New", "series_id": 2}, {"segment_id": 1, "segment_title": "Taken id"}],
+        updates=[{"segment_id": 2, "segment_title": "Renamed"}],
+        deletes=[1, 3],
+    )
+    assert statuses(result) == [
+        ("delete", 0, "conflict"), ("delete", 1, "ok"),
+        ("update", 0, "ok"),
+        ("create", 0, "ok"), ("create", 1, "ok"), ("create", 2, "conflict"),
+    ]
+    assert [(s.segment_id, s.segment_title, s.series_id) for s in db.read_all_segments()] == [
+        (1, "Segment 1", 1), (2, "Renamed", 2), (4, "Segment 2", None), (5, "New", 2),
+    ]
+
+def test_bulk_write_rolls_back_on_error(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    with pytest.raises(Exception):
+        db.bulk_codes(creates=[{"term": "Code D"}, {"term": None}], deletes=[1])
+    assert [c.term for c in db.read_all_codes()] == ["Code A", "Code B", "Code C"]
+
+
+# Code usage tests
+
+def code_usage(db: DatabaseManager) -> dict[int, tuple[int, int, int]]:
+    session = db.Session()
+    rows = {u.code_id: (u.annotation_count, u.segment_count, u.series_count) for u in session.query(CodeUsage)}
+    session.close()
+    return rows
+
+def test_code_usage_incremental(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    assert code_usage(db) == {1: (0, 0, 0), 2: (0, 0, 0), 3: (0, 0, 0)}
+    db.create_batch_annotations([1, 2, 3], [1])
+    db.create_annotation(1, 2)
+    db.create_annotation_pairs([(3, 3)])
+    assert code_usage(db) == {1: (3, 2, 2), 2: (1, 1, 1), 3: (1, 1, 1)}
+
+    db.delete_batch_annotations([3], [1])
+    db.update_annotation(4, element_id=3)
+    assert code_usage(db) == {1: (2, 1, 1), 2: (1, 1, 1), 3: (1, 1, 1)}
+
+    db.update_element(1, segment_id=2)
+    db.merge_codes(3, 2)
+    db.create_code("Code D", "Description", 1, "Reference", "Coordinates")
+    db.bulk_elements(deletes=[2])
+    assert code_usage(db) == {1: (1, 1, 1), 2: (1, 1, 1), 3: (0, 0, 0)}
+
+    expected = code_usage(db)
+    db.rebuild_code_usage()
+    assert code_usage(db) == expected
+
+def test_code_usage_segment_counts(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    session = db.Session()
+    session.add(Segment(segment_id=3, segment_title="Segment 3", series_id=1))
+    session.commit()
+    session.close()
+    db.create_element("Test element 4", 3)
+
+    db.create_batch_annotations([1, 2, 4], [1])
+    assert code_usage(db)[1] == (3, 2, 1)
+    db.delete_batch_annotations([1], [1])
+    assert code_usage(db)[1] == (2, 2, 1)
+    db.delete_batch_annotations([2], [1])
+    assert code_usage(db)[1] == (1, 1, 1)
+    db.update_element(4, segment_id=2)
+    assert code_usage(db)[1] == (1, 1, 1)
+    db.delete_batch_annotations([4], [1])
+    assert code_usage(db)[1] == (0, 0, 0)
+
+    session = db.Session()
+    assert session.query(CodeSegmentUsage).count() == 0
+    session.close()
+
+def test_read_codes_by_usage(cooccurrence_db: DatabaseManager) -> None:
+    db = cooccurrence_db
+    db.create_batch_annotations([1, 2, 3], [2])
+    db.create_batch_annotations([1], [3])
+    assert [c.code_id for c in db.read_codes_by_usage()] == [2, 3, 1]
+    assert [c.code_id for c in db.read_codes_by_usage("series", descending=False)] == [1, 3, 2]
+    assert [c.code_id for c in db.read_codes_by_usage(skip=1, limit=1)] == [3]
+    assert [c.code_id for c in db.read_codes_by_usage(max_annotations=0)] == [1]
+    codes = db.read_codes_by_usage(min_annotations=1)
+    assert [(c.term, c.usage.annotation_count, c.usage.segment_count) for c in codes] == [("Code B", 3, 2), ("Code C", 1, 1)]
+    assert codes[0].code_type.type_name == "Test Type"
+
+
+# Code search tests
+
+@pytest.fixture
+def codebook(db_manager: DatabaseManager) -> DatabaseManager:
+    db_manager.create_code_type("Theme")
+    db_manager.create_code_type("Place")
+    for term, description, type_id in [
+        ("Climate change", "Weather over decades", 1),
+        ("Change management", "Climate of an organisation", 1),
+        ("Clinic", "Health care", 2),
+        ("Émigration", "Leaving the country", 1),
+        ("Catalonia", "", 2),
+    ]:
+        db_manager.create_code(term, description, type_id, "", "")
+    return db_manager
+
+def terms(result: tuple) -> list[str]:
+    return [code["term"] for code in result[0]]
+
+def test_search_codes_prefix(codebook: DatabaseManager) -> None:
+    db = codebook
+    assert terms(db.search_codes("cli", shape="compact")) == ["Change management", "Climate change", "Clinic"]
+    assert terms(db.search_codes("cli", fields="term", shape="compact")) == ["Climate change", "Clinic"]
+    assert terms(db.search_codes("cli cha", shape="compact")) == ["Change management", "Climate change"]
+    assert terms(db.search_codes("emig", shape="compact")) == ["Émigration"]
+    assert terms(db.search_codes("c", type_ids=[2], shape="compact")) == ["Catalonia", "Clinic"]
+    codes, _ = db.search_codes("clinic")
+    assert codes[0].code_type.type_name == "Place"
+
+    # Triggers keep the index in step with code writes
+    db.update_code(3, term="Hospital")
+    db.bulk_codes(deletes=[1])
+    assert terms(db.search_codes("cli", fields="term", shape="compact")) == []
+
+def test_search_codes_fuzzy(codebook: DatabaseManager) -> None:
+    db = codebook
+    assert terms(db.search_codes("clmate chnge", "fuzzy", fields="term", shape="compact"))[0] == "Climate change"
+    assert terms(db.search_codes("talon", "fuzzy", shape="compact")) == ["Catalonia"]
+    # Too short for trigrams, searched by prefix instead
+    assert terms(db.search_codes("ca", "fuzzy", shape="compact")) == ["Catalonia", "Clinic"]
+
+@pytest.mark.parametrize("search_mode", ["prefix", "fuzzy"])
+def test_search_codes_keyset(codebook: DatabaseManager, search_mode: str) -> None:
+    db = codebook
+    expected = terms(db.search_codes("change", search_mode, limit=10, shape="compact"))
+    pages, cursor = [], None
+    while True:
+        page, cursor = db.search_codes("change", search_mode, cursor=cursor, limit=1, shape="compact")
+        pages += [code["term"] for code in page]
+        if cursor is None:
+            break
+    assert len(expected) >= 2
+    assert pages == expected
+    with pytest.raises(ValueError):
+        db.search_codes("change", search_mode, cursor="bad")
@@ -0,0 +1,38 @@
+from sqlalchemy import text
+
+from ..db.crud import DatabaseManager
+from ..db.engine import create_database_engine, database_url, pool_options
+
+
+def pragma(engine, name: str):
+    with engine.connect() as connection:
+        return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+def test_file_database_pragmas(tmp_path) -> None:
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'kanot.db'}", environ={})
+    assert pragma(engine, "journal_mode") == "wal"
+    assert pragma(engine, "synchronous") == 1  # NORMAL
+    assert pragma(engine, "temp_store") == 2  # MEMORY
+    assert pragma(engine, "cache_size") == -65536
+    assert pragma(engine, "busy_timeout") == 5000
+    assert engine.pool.size() == 10
+
+def test_settings_from_environment(tmp_path) -> None:
+    environ = {
+        "KANOT_DATABASE_URL": f"sqlite:///{tmp_path / 'env.db'}",
+        "KANOT_SQLITE_BUSY_TIMEOUT": "100",
+        "KANOT_DB_POOL_SIZE": "4",
+    }
+    assert database_url(environ) == environ["KANOT_DATABASE_URL"]
+    assert pool_options(environ)["max_overflow"] == 36
+    engine = create_database_engine(environ=environ)
+    assert engine.url.database.endswith("env.db")
+    assert pragma(engine, "busy_timeout") == 100
+    assert engine.pool.size() == 4
+
+def test_in_memory_database() -> None:
+    engine = create_database_engine("sqlite:///:memory:", environ={})
+    db_manager = DatabaseManager(engine)
+    db_manager.create_code_type("Test Type")
+    assert db_manager.read_code_type(1).type_name == "Test Type"
+    assert pragma(engine, "journal_mode") == "memory"
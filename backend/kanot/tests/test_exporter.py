@@ -0,0 +1,85 @@
+import gzip
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from ..cli import main
+from ..db.crud import DatabaseManager
+from ..exporter import export_project
+from ..importer import import_glossary, import_transcripts
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    return create_engine('sqlite:///:memory:')
+
+@pytest.fixture
+def project(db_engine: Engine, tmp_path) -> Engine:
+    DatabaseManager(db_engine)
+    glossary = tmp_path / "glossary.csv"
+    glossary.write_text(
+        "Glossary ID,Term,Description,Type,Read more,Lat/Long\n"
+        "1,Belfast,A city,Place,,\n"
+        "2,IRA,An organisation,Organisation,,\n"
+        "3,Derry,A city,Place,,\n"
+    )
+    transcripts = tmp_path / "transcripts.csv"
+    transcripts.write_text(
+        "Text ID,Text,Episode ID,Episode,Glossary IDs\n"
+        "1,We went to Belfast,10,Episode one,1\n"
+        "2,The IRA in Derry,10,Episode one,2;3\n"
+        "4,Nothing coded,11,Episode two,\n"
+        "5,Back to Belfast and Derry,11,Episode two,1;3\n"
+    )
+    import_glossary(db_engine, glossary)
+    import_transcripts(db_engine, transcripts, series_title="Conflicted")
+    return db_engine
+
+def read_json(path):
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        return json.load(file)
+
+def test_export_project(project: Engine, tmp_path) -> None:
+    out = tmp_path / "export"
+    manifest = export_project(project, out, batch_size=2)
+    assert manifest == json.loads((out / "manifest.json").read_text())
+    assert manifest["elements"] == 4
+    assert manifest["codes"] == 3
+    assert [(s["segment_id"], s["elements"]) for s in manifest["segments"]] == [(10, 2), (11, 2)]
+
+    segment = read_json(out / manifest["segments"][0]["file"])
+    assert segment == {
+        "segment_id": 10,
+        "segment_title": "Episode one",
+        "series_id": 1,
+        "elements": [[1, "We went to Belfast", [1]], [2, "The IRA in Derry", [2, 3]]],
+    }
+
+    codes = read_json(out / "codes.json.gz")
+    assert [(c["term"], c["type_name"], c["annotations"]) for c in codes] == [
+        ("Belfast", "Place", 2), ("IRA", "Organisation", 1), ("Derry", "Place", 2)
+    ]
+    assert read_json(out / "code_counts.json.gz") == {"1": {"10": 1, "11": 1}, "2": {"10": 1}, "3": {"10": 1, "11": 1}}
+    assert read_json(out / "cooccurrence.json.gz") == [[1, 3, 1], [2, 3, 1]]
+
+    # Postings are delta encoded element ids
+    belfast = read_json(out / manifest["search_index"]["shards"]["b"])["belfast"]
+    assert belfast == [1, 4]
+    assert read_json(out / manifest["search_index"]["shards"]["d"])["derry"] == [2, 3]
+
+def test_export_uncompressed(project: Engine, tmp_path) -> None:
+    manifest = export_project(project, tmp_path / "export", compression="none")
+    assert "codes.json" in manifest["files"]
+    assert len(json.loads((tmp_path / "export" / "codes.json").read_text())) == 3
+
+def test_export_rejects_unknown_compression(project: Engine, tmp_path) -> None:
+    with pytest.raises(ValueError):
+        export_project(project, tmp_path / "export", compression="zip")
+
+def test_cli_export(tmp_path) -> None:
+    url = f"sqlite:///{tmp_path / 'kanot.db'}"
+    DatabaseManager(create_engine(url)).create_code_type("Place")
+    assert main(["--database-url", url, "export", str(tmp_path / "export")]) == 0
+    assert (tmp_path / "export" / "manifest.json").exists()
@@ -0,0 +1,120 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from ..cli import main
+from ..db.crud import DatabaseManager
+from ..importer import explode_code_ids, import_glossary, import_transcripts
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    return create_engine('sqlite:///:memory:')
+
+@pytest.fixture
+def db_manager(db_engine: Engine) -> DatabaseManager:
+    return DatabaseManager(db_engine)
+
+@pytest.fixture
+def glossary_csv(tmp_path):
+    path = tmp_path / "glossary.csv"
+    path.write_text(
+        "Glossary ID,Term,Description,Type,Read more,Lat/Long\n"
+        "1,Belfast,A city,Place,,\n"
+        "2,IRA,An organisation,Organisation,,\n"
+        "3,Derry,A city,Place,,\n"
+    )
+    return path
+
+@pytest.fixture
+def transcripts_csv(tmp_path):
+    path = tmp_path / "transcripts.csv"
+    path.write_text(
+        "Text ID,Text,Episode ID,Episode,Glossary IDs\n"
+        "1,We went to Belfast,10,Episode one,1\n"
+        "2,The IRA in Derry,10,Episode one,2;3\n"
+        "3,,10,Episode one,\n"
+        "4,Nothing coded,11,Episode two,\n"
+        "5,Back to Belfast,11,Episode two,1; 3;\n"
+    )
+    return path
+
+def test_explode_code_ids() -> None:
+    elements = pd.DataFrame({"element_id": [1, 2, 3, 4], "code_ids": ["1;2", None, "3", [4, 5]]})
+    annotations = explode_code_ids(elements)
+    assert sorted(map(tuple, annotations.values.tolist())) == [(1, 1), (1, 2), (3, 3), (4, 4), (4, 5)]
+
+def test_import(db_engine: Engine, db_manager: DatabaseManager, glossary_csv, transcripts_csv) -> None:
+    assert import_glossary(db_engine, glossary_csv, batch_size=2) == 3
+    assert import_transcripts(db_engine, transcripts_csv, series_title="Conflicted", batch_size=2) == 4
+
+    assert [code_type.type_name for code_type in db_manager.read_all_code_types()] == ["Place", "Organisation"]
+    code = db_manager.read_code(3)
+    assert code.term == "Derry" and code.code_type.type_name == "Place"
+    assert [series.series_title for series in db_manager.read_all_series()] == ["Conflicted"]
+    assert [segment.segment_id for segment in db_manager.read_all_segments()] == [10, 11]
+    assert len(db_manager.read_all_elements()) == 4
+    annotations = db_manager.read_all_annotations()
+    assert {(a.element_id, a.code_id) for a in annotations} == {(1, 1), (2, 2), (2, 3), (5, 1), (5, 3)}
+    assert [element.element_id for element in db_manager.search_elements("belfast")] == [1, 5]
+
+def test_import_upsert_and_resume(db_engine: Engine, db_manager: DatabaseManager, glossary_csv, transcripts_csv, tmp_path) -> None:
+    import_glossary(db_engine, glossary_csv)
+    import_transcripts(db_engine, transcripts_csv, batch_size=2)
+
+    transcripts_csv.write_text(transcripts_csv.read_text().replace("We went to Belfast", "We went to Derry"))
+    assert import_transcripts(db_engine, transcripts_csv, batch_size=2, resume=True) == 0
+    assert import_transcripts(db_engine, transcripts_csv, batch_size=2, upsert=False) == 4
+    assert db_manager.read_element(1).element_text == "We went to Belfast"
+    assert import_transcripts(db_engine, transcripts_csv, batch_size=2) == 4
+    assert db_manager.read_element(1).element_text == "We went to Derry"
+    assert [element.element_id for element in db_manager.search_elements("derry")] == [1, 2]
+    assert len(db_manager.read_all_annotations()) == 5
+
+def test_import_glossary_term_conflicts(db_engine: Engine, db_manager: DatabaseManager, glossary_csv, tmp_path, caplog) -> None:
+    import_glossary(db_engine, glossary_csv)
+    path = tmp_path / "more.csv"
+    path.write_text(
+        "Glossary ID,Term,Description,Type,Read more,Lat/Long\n"
+        "3,Derry,Renamed,Place,,\n"
+        "4,Belfast,A duplicate,Place,,\n"
+        "5,Armagh,A city,Place,,\n"
+        "6,Armagh,A duplicate,Place,,\n"
+    )
+    assert import_glossary(db_engine, path, batch_size=3) == 2
+    assert [(code.code_id, code.term) for code in db_manager.read_all_codes()] == [(1, "Belfast"), (2, "IRA"), (3, "Derry"), (5, "Armagh")]
+    assert db_manager.read_code(3).description == "Renamed"
+    assert "Skipped code 4: term 'Belfast' is already used by code 1" in caplog.text
+    assert "Skipped code 6: term 'Armagh' is already used by code 5" in caplog.text
+
+def test_import_transcripts_segment_title_conflicts(db_engine: Engine, db_manager: DatabaseManager, transcripts_csv, tmp_path, caplog) -> None:
+    import_transcripts(db_engine, transcripts_csv, batch_size=2)
+    path = tmp_path / "more.csv"
+    path.write_text(
+        "Text ID,Text,Episode ID,Episode,Glossary IDs\n"
+        "6,Episode one again,12,Episode one,\n"
+        "7,A new episode,13,Episode three,\n"
+        "8,The same new episode,14,Episode three,\n"
+    )
+    assert import_transcripts(db_engine, path) == 3
+    assert [(segment.segment_id, segment.segment_title) for segment in db_manager.read_all_segments()] == [(10, "Episode one"), (11, "Episode two"), (13, "Episode three")]
+    assert [(element.element_id, element.segment_id) for element in db_manager.read_all_elements()][-3:] == [(6, 10), (7, 13), (8, 13)]
+    assert "title 'Episode one' is already used by segment 10" in caplog.text
+    assert "title 'Episode three' is already used by segment 13" in caplog.text
+
+def test_import_jsonl(db_engine: Engine, db_manager: DatabaseManager, tmp_path) -> None:
+    path = tmp_path / "transcripts.jsonl"
+    path.write_text(
+        '{"element_id": 1, "element_text": "First", "segment_id": 1, "segment_title": "One", "code_ids": [1, 2]}\n'
+        '{"element_id": 2, "element_text": "Second", "segment_id": 1, "segment_title": "One", "code_ids": "2"}\n'
+    )
+    assert import_transcripts(db_engine, path) == 2
+    assert {(a.element_id, a.code_id) for a in db_manager.read_all_annotations()} == {(1, 1), (1, 2), (2, 2)}
+
+def test_cli_import(glossary_csv, transcripts_csv, tmp_path) -> None:
+    database_url = f"sqlite:///{tmp_path / 'kanot.db'}"
+    assert main(["--database-url", database_url, "import", "--glossary", str(glossary_csv), "--transcripts", str(transcripts_csv)]) == 0
+    db_manager = DatabaseManager(create_engine(database_url))
+    assert len(db_manager.read_all_codes()) == 3
+    assert db_manager.read_all_series()[0].series_title == "transcripts"
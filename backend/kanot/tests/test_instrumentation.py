@@ -0,0 +1,81 @@
+import asyncio
+import logging
+
+from sqlalchemy import text
+
+from ..db.engine import create_database_engine
+from ..instrumentation import (
+    Histogram,
+    RequestMetrics,
+    RequestStats,
+    RequestTimingMiddleware,
+    current_request,
+    instrument_engine,
+)
+
+
+def test_statements_counted_per_request() -> None:
+    engine = create_database_engine("sqlite:///:memory:", environ={})
+    instrument_engine(engine, slow_query_ms=10_000)
+    stats = RequestStats()
+    token = current_request.set(stats)
+    try:
+        with engine.connect() as connection:
+            for _ in range(3):
+                connection.execute(text("SELECT 1"))
+    finally:
+        current_request.reset(token)
+    assert stats.queries == 3
+    assert stats.sql_time > 0
+
+    # Outside a request nothing is counted
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert stats.queries == 3
+
+def test_slow_query_logged_with_parameters(caplog) -> None:
+    engine = create_database_engine("sqlite:///:memory:", environ={})
+    instrument_engine(engine, slow_query_ms=0)
+    with caplog.at_level(logging.WARNING, logger="kanot"):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT :value"), {"value": 42})
+    assert "Slow query" in caplog.text
+    assert "42" in caplog.text
+
+def test_histogram() -> None:
+    histogram = Histogram((1, 5, 10))
+    for value in (1, 2, 3, 4, 20):
+        histogram.observe(value)
+    assert histogram.counts == [1, 3, 0, 1]
+    assert histogram.count == 5
+    assert histogram.sum == 30
+    assert histogram.quantile(0.5) == 5
+    assert histogram.quantile(1.0) == float("inf")
+    assert histogram.to_dict()["buckets"] == {"1": 1, "5": 3, "10": 0, "+Inf": 1}
+
+def test_middleware_records_endpoint() -> None:
+    class Route:
+        path = "/elements/{element_id}"
+
+    async def app(scope, receive, send):
+        scope["route"] = Route()
+        current_request.get().queries += 2
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    metrics = RequestMetrics()
+    middleware = RequestTimingMiddleware(app, metrics)
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(middleware({"type": "http", "method": "GET", "path": "/elements/1"}, None, send))
+
+    headers = dict(messages[0]["headers"])
+    assert headers[b"server-timing"].startswith(b'db;dur=')
+    assert b'desc="2 queries"' in headers[b"server-timing"]
+    endpoint = metrics.to_dict()["GET /elements/{element_id}"]
+    assert endpoint["duration"]["count"] == 1
+    assert endpoint["queries"]["sum"] == 2
+    assert endpoint["errors"] == 0
@@ -0,0 +1,36 @@
+import re
+
+from ..db.crud import DatabaseManager
+from ..db.engine import create_database_engine
+from ..metrics import render
+
+
+def sample(text: str, name: str) -> float:
+    match = re.search(rf"^{re.escape(name)} (\S+)$", text, re.MULTILINE)
+    assert match, f"{name} missing"
+    return float(match.group(1))
+
+def test_render_metrics(tmp_path) -> None:
+    db_manager = DatabaseManager(create_database_engine(f"sqlite:///{tmp_path / 'kanot.db'}", environ={}))
+    db_manager.create_code_type("Type")
+    db_manager.create_series("Series")
+    db_manager.create_segment(1, "Segment")
+    db_manager.create_element("Text", 1)
+    db_manager.create_code("Code", "", 1, "", "")
+
+    before = render(db_manager)
+    db_manager.create_batch_annotations([1], [1])
+    db_manager.delete_batch_annotations([1], [1])
+    after = render(db_manager)
+
+    assert sample(after, "kanot_annotations_created_total") == sample(before, "kanot_annotations_created_total") + 1
+    assert sample(after, "kanot_annotations_deleted_total") == sample(before, "kanot_annotations_deleted_total") + 1
+    assert sample(after, 'kanot_annotation_batch_size_count{operation="delete"}') >= 1
+    assert sample(after, "kanot_db_pool_checkout_wait_seconds_count") > 0
+    assert sample(after, 'kanot_sqlite_bytes{kind="database"}') > 0
+    assert "# TYPE kanot_http_request_duration_seconds histogram" in after
+    # Without jobs there is no queue to report
+    assert "kanot_autoannotation_jobs" not in after
+
+    db_manager.create_autoannotation_job("fake", [1], [1], 10)
+    assert sample(render(db_manager), 'kanot_autoannotation_jobs{status="queued"}') == 1
@@ -0,0 +1,116 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from ..cli import main
+from ..db.crud import DatabaseManager
+from ..transcripts import Splitter, Utterance, ingest_transcript, split_transcript
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    return create_engine('sqlite:///:memory:')
+
+@pytest.fixture
+def db_manager(db_engine: Engine) -> DatabaseManager:
+    return DatabaseManager(db_engine)
+
+TXT = """ALICE: Hello there. How are you? I said "fine." Then
+we left.
+BOB: Good!
+
+A line without an end"""
+
+VTT = """WEBVTT
+
+NOTE a comment
+
+1
+00:00.000 --> 00:02.000
+<v Roger>We are in New York City.
+
+00:02.000 --> 00:04.000 align:start
+<v Roger>It is cold</v>
+- and wet.
+
+00:04.000 --> 00:06.000
+<v.loud Mary>Yes it is!
+"""
+
+SRT = """1
+00:00:01,000 --> 00:00:02,000
+Hello there. General
+
+2
+00:00:02,000 --> 00:00:03,000
+Kenobi!
+"""
+
+def test_split_sentences() -> None:
+    assert list(split_transcript(TXT.splitlines())) == [
+        "ALICE: Hello there.",
+        "ALICE: How are you?",
+        'ALICE: I said "fine."',
+        "ALICE: Then we left.",
+        "BOB: Good!",
+        "BOB: A line without an end",
+    ]
+
+def test_split_turns_and_lines() -> None:
+    assert list(split_transcript(TXT.splitlines(), mode="turn")) == [
+        'ALICE: Hello there. How are you? I said "fine." Then we left.',
+        "BOB: Good! A line without an end",
+    ]
+    assert list(split_transcript(TXT.splitlines(), mode="line"))[1] == "we left."
+
+def test_split_subtitles() -> None:
+    assert list(split_transcript(VTT.splitlines(), "vtt")) == [
+        "Roger: We are in New York City.",
+        "Roger: It is cold and wet.",
+        "Mary: Yes it is!",
+    ]
+    assert list(split_transcript(SRT.splitlines(), "srt")) == ["Hello there.", "General Kenobi!"]
+
+def test_split_csv() -> None:
+    lines = ["speaker,text\n", "A,One. Two\n", 'B,"Three, four."\n']
+    assert list(split_transcript(lines, "csv")) == ["A: One.", "A: Two", "B: Three, four."]
+    with pytest.raises(ValueError):
+        list(split_transcript(["foo\n", "bar\n"], "csv"))
+
+def test_long_text_cut_at_max_chars() -> None:
+    splitter = Splitter("turn", max_chars=20)
+    elements = list(splitter.feed(Utterance("word " * 20))) + list(splitter.flush())
+    assert all(len(element) <= 20 for element in elements)
+    assert " ".join(elements) == ("word " * 20).strip()
+
+def test_ingest_transcript(db_engine: Engine, db_manager: DatabaseManager) -> None:
+    result = ingest_transcript(db_engine, TXT.splitlines(), "Episode one", "Series", batch_size=2)
+    assert result["elements"] == 6
+    segment = db_manager.read_segment(result["segment_id"])
+    assert segment.segment_title == "Episode one"
+    assert segment.series_id == result["series_id"]
+    assert [e.element_text for e in db_manager.read_all_elements()][0] == "ALICE: Hello there."
+
+    # Same series by title, next segment id
+    second = ingest_transcript(db_engine, SRT.splitlines(), "Episode two", "Series", "srt")
+    assert second["series_id"] == result["series_id"]
+    assert second["segment_id"] == result["segment_id"] + 1
+
+    with pytest.raises(ValueError):
+        ingest_transcript(db_engine, SRT.splitlines(), "Episode two", "Series", "srt")
+    # A file without text creates nothing
+    with pytest.raises(ValueError):
+        ingest_transcript(db_engine, ["", "  "], "Empty", "Other series")
+    assert [s.series_title for s in db_manager.read_all_series()] == ["Series"]
+
+def test_cli_transcript(tmp_path) -> None:
+    path = tmp_path / "interviews" / "episode.vtt"
+    path.parent.mkdir()
+    path.write_text(VTT, encoding="utf-8")
+    url = f"sqlite:///{tmp_path / 'kanot.db'}"
+    assert main(["--database-url", url, "transcript", str(path), "--split", "line"]) == 0
+    db_manager = DatabaseManager(create_engine(url))
+    assert db_manager.read_segment(1).segment_title == "episode"
+    assert db_manager.read_series(1).series_title == "interviews"
+    assert len(db_manager.read_all_elements()) == 4
+    assert main(["--database-url", url, "transcript", str(path)]) == 1
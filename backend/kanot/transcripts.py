@@ -0,0 +1,222 @@
+import csv
+import itertools
+import logging
+import re
+from pathlib import Path
+from typing import Any, Iterable, Iterator, NamedTuple, Optional, TextIO
+
+from sqlalchemy import Engine, func, insert, select
+
+from .db.schema import Element, Segment
+from .db.series import series_id_for_title
+
+logger = logging.getLogger("kanot")
+
+FORMATS = ("txt", "srt", "vtt", "csv")
+SPLIT_MODES = ("sentence", "turn", "line")
+# Longest element the splitter emits; longer sentences or turns are cut at
+# the last space before the limit
+DEFAULT_MAX_CHARS = 2000
+# Elements per transaction
+DEFAULT_BATCH_SIZE = 5000
+
+# "Speaker: text" and "SPEAKER NAME: text" at the start of a line
+SPEAKER_LINE = re.compile(r"^([A-Z][\w .'-]{0,40}?):\s+(.*)$")
+# WebVTT voice tags, <v Speaker> or <v.loud Speaker>
+VTT_VOICE = re.compile(r"<v(?:\.[\w.]+)?\s+([^>]+)>")
+CUE_TAG = re.compile(r"</?[^>]+>")
+TIMESTAMP_LINE = re.compile(r"^\s*[\d:.,]+\s+-->\s+[\d:.,]+")
+# End of a sentence: terminal punctuation and any closing quotes or
+# brackets, followed by whitespace
+SENTENCE_END = re.compile(r"[.!?…][\"'”’)\]]*(?=\s)")
+TEXT_COLUMNS = ("text", "Text", "element_text", "transcript", "Transcript")
+SPEAKER_COLUMNS = ("speaker", "Speaker", "name", "Name")
+
+class Utterance(NamedTuple):
+    text: str
+    speaker: Optional[str] = None
+
+def guess_format(filename: str) -> str:
+    suffix = Path(filename).suffix.lower().lstrip(".")
+    return suffix if suffix in FORMATS else "txt"
+
+# Parsers turn an iterable of lines into utterances without reading ahead
+# more than one cue or row
+
+def parse_txt(lines: Iterable[str]) -> Iterator[Utterance]:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        match = SPEAKER_LINE.match(line)
+        if match:
+            yield Utterance(match.group(2), match.group(1).strip())
+        else:
+            yield Utterance(line)
+
+def parse_subtitles(lines: Iterable[str]) -> Iterator[Utterance]:
+    # SRT and WebVTT: blocks separated by blank lines, the text of a cue
+    # follows its timestamp line. Headers, NOTE and STYLE blocks and cue
+    # numbers carry no timestamp and are skipped.
+    in_cue = False
+    for line in lines:
+        line = line.strip()
+        if not line:
+            in_cue = False
+            continue
+        if TIMESTAMP_LINE.match(line):
+            in_cue = True
+            continue
+        if not in_cue:
+            continue
+        voice = VTT_VOICE.search(line)
+        speaker = voice.group(1).strip() if voice else None
+        text = CUE_TAG.sub("", line).strip()
+        match = SPEAKER_LINE.match(text)
+        if match:
+            speaker, text = match.group(1).strip(), match.group(2)
+        # Dialogue dashes, the speaker is not named
+        text = text.removeprefix("- ").strip()
+        if text:
+            yield Utterance(text, speaker)
+
+def parse_csv(lines: Iterable[str]) -> Iterator[Utterance]:
+    reader = csv.DictReader(lines)
+    fields = reader.fieldnames or []
+    text_column = next((c for c in TEXT_COLUMNS if c in fields), None)
+    if text_column is None:
+        raise ValueError(f"CSV transcript needs one of the columns {', '.join(TEXT_COLUMNS)}")
+    speaker_column = next((c for c in SPEAKER_COLUMNS if c in fields), None)
+    for row in reader:
+        text = (row.get(text_column) or "").strip()
+        speaker = (row.get(speaker_column) or "").strip() if speaker_column else ""
+        if text:
+            yield Utterance(text, speaker or None)
+
+PARSERS = {"txt": parse_txt, "srt": parse_subtitles, "vtt": parse_subtitles, "csv": parse_csv}
+
+class Splitter:
+    # Incremental splitter: feed utterances, get back the elements completed
+    # so far, and flush at the end. Only the unfinished sentence or turn is
+    # buffered.
+    #   sentence: one element per sentence, a new speaker ends the sentence
+    #   turn: one element per speaker turn
+    #   line: one element per line or cue
+    def __init__(self, mode: str = "sentence", max_chars: int = DEFAULT_MAX_CHARS):
+        if mode not in SPLIT_MODES:
+            raise ValueError(f"Split mode must be one of {', '.join(SPLIT_MODES)}")
+        self.mode = mode
+        self.max_chars = max_chars
+        self.speaker: Optional[str] = None
+        self.buffer = ""
+
+    def feed(self, utterance: Utterance) -> Iterator[str]:
+        if self.mode == "line":
+            yield from self._emit(utterance.text, utterance.speaker)
+            return
+        if utterance.speaker is not None and utterance.speaker != self.speaker:
+            yield from self.flush()
+            self.speaker = utterance.speaker
+        self.buffer = f"{self.buffer} {utterance.text}".strip()
+        if self.mode == "sentence":
+            start = 0
+            for end in SENTENCE_END.finditer(self.buffer):
+                yield from self._emit(self.buffer[start:end.end()], self.speaker)
+                start = end.end()
+            self.buffer = self.buffer[start:].strip()
+        while len(self.buffer) > self.max_chars:
+            head, self.buffer = self._cut(self.buffer)
+            yield from self._emit(head, self.speaker)
+
+    def flush(self) -> Iterator[str]:
+        if self.buffer:
+            yield from self._emit(self.buffer, self.speaker)
+        self.buffer = ""
+
+    def _cut(self, text: str) -> tuple[str, str]:
+        cut = text.rfind(" ", 0, self.max_chars)
+        if cut <= 0:
+            cut = self.max_chars
+        return text[:cut].strip(), text[cut:].strip()
+
+    def _emit(self, text: str, speaker: Optional[str]) -> Iterator[str]:
+        text = text.strip()
+        while len(text) > self.max_chars:
+            head, text = self._cut(text)
+            yield f"{speaker}: {head}" if speaker else head
+        if text:
+            yield f"{speaker}: {text}" if speaker else text
+
+def split_transcript(lines: Iterable[str], format: str = "txt", mode: str = "sentence", max_chars: int = DEFAULT_MAX_CHARS) -> Iterator[str]:
+    # Element texts, in order. Arguments are checked on the call, the lines
+    # are only read as the result is iterated.
+    if format not in PARSERS:
+        raise ValueError(f"Transcript format must be one of {', '.join(FORMATS)}")
+    splitter = Splitter(mode, max_chars)
+
+    def split() -> Iterator[str]:
+        for utterance in PARSERS[format](lines):
+            yield from splitter.feed(utterance)
+        yield from splitter.flush()
+
+    return split()
+
+def _segment_id(engine: Engine, segment_title: str, series_id: int) -> int:
+    with engine.begin() as connection:
+        if connection.execute(select(Segment.segment_id).where(Segment.segment_title == segment_title)).scalar() is not None:
+            raise ValueError(f"Segment {segment_title!r} already exists")
+        # segment_id has no autoincrement, segments from the importer keep
+        # their source ids
+        segment_id = (connection.execute(select(func.max(Segment.segment_id))).scalar() or 0) + 1
+        connection.execute(insert(Segment).values(segment_id=segment_id, segment_title=segment_title, series_id=series_id))
+    return segment_id
+
+def ingest_transcript(
+    engine: Engine,
+    lines: Iterable[str],
+    segment_title: str,
+    series_title: str,
+    format: str = "txt",
+    mode: str = "sentence",
+    max_chars: int = DEFAULT_MAX_CHARS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> dict[str, Any]:
+    # Create the segment, in a series found or created by title, and insert
+    # its elements batch_size at a time, one transaction per batch. Raises
+    # ValueError for a taken segment title, an unreadable file or one
+    # without text.
+    texts = split_transcript(lines, format, mode, max_chars)
+    # Parse up to the first element before writing anything, so a file in
+    # the wrong format leaves no empty segment behind
+    first = next(texts, None)
+    if first is None:
+        raise ValueError("Transcript has no text")
+    with engine.connect() as connection:
+        if connection.execute(select(Segment.segment_id).where(Segment.segment_title == segment_title)).scalar() is not None:
+            raise ValueError(f"Segment {segment_title!r} already exists")
+    series_id = series_id_for_title(engine, series_title)
+    segment_id = _segment_id(engine, segment_title, series_id)
+    stmt = insert(Element)
+    batch: list[dict[str, Any]] = []
+    inserted = 0
+
+    def write() -> None:
+        nonlocal inserted
+        with engine.begin() as connection:
+            connection.execute(stmt, batch)
+        inserted += len(batch)
+        batch.clear()
+
+    for text in itertools.chain([first], texts):
+        batch.append({"element_text": text, "segment_id": segment_id})
+        if len(batch) >= batch_size:
+            write()
+    if batch:
+        write()
+
+    logger.info(f"Ingested {inserted} elements into segment {segment_id} ({segment_title})")
+    return {"series_id": series_id, "segment_id": segment_id, "segment_title": segment_title, "elements": inserted}
+
+def open_transcript(path: str | Path) -> TextIO:
+    # utf-8-sig drops the byte order mark some editors write
+    return open(path, encoding="utf-8-sig", newline="")